@@ -1 +0,0 @@
-git clone https://github.com/ohmyzsh/ohmyzsh.git ~/.oh-my-zsh
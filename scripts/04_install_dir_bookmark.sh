@@ -1 +0,0 @@
-git clone https://github.com/memoryInject/dir-bookmark.git ~/.local/share/dir-bookmark 2>/dev/null || echo 'Already installed'
@@ -1,5 +0,0 @@
-rm -rf ~/.config/nvim
-git clone https://github.com/memoryInject/nvim-config.git ~/.config/nvim
-cd ~/.config/nvim
-git checkout v0.11.1
-pip3 install pynvim
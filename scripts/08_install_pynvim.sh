@@ -0,0 +1 @@
+pip3 install pynvim
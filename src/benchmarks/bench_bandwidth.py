@@ -0,0 +1,103 @@
+"""
+Benchmark the bandwidth scheduler with a big download and small urgent ones.
+
+A local server throttled per response serves one big file and a few small
+ones. The big download starts first; shortly after, the small ones are
+queued. All downloads share a --cap MB/s token bucket (lib.bandwidth),
+once with every item at the same priority and once with the small items
+at a higher priority. With priorities the small items should finish
+first, in about their size divided by the cap, and the big download
+should take about as long as before.
+
+    cd src && python -m benchmarks.bench_bandwidth --cap 8 --big-mb 24
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict
+
+from lib.bandwidth import BandwidthManager
+from lib.download import download
+from tests.http_fixture import FileServer
+
+
+def run_scenario(
+    server: FileServer,
+    root: str,
+    cap: float,
+    small: int,
+    small_priority: int,
+    delay: float,
+) -> Dict[str, float]:
+    """Seconds from queueing to done for every download"""
+    manager = BandwidthManager(rate=cap * 1024**2)
+    finished: Dict[str, float] = {}
+    queued: Dict[str, float] = {}
+
+    def fetch(name: str, priority: int):
+        queued[name] = time.perf_counter()
+        flow = manager.flow(name, priority=priority)
+        download(server.url(f"/{name}"), os.path.join(root, name), flow=flow)
+        finished[name] = time.perf_counter() - queued[name]
+
+    threads = [threading.Thread(target=fetch, args=("big.dmg", 0))]
+    threads[0].start()
+    time.sleep(delay)
+    for i in range(small):
+        thread = threading.Thread(target=fetch, args=(f"small{i}.dmg", small_priority))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    for name in finished:
+        os.remove(os.path.join(root, name))
+    return {name: round(t, 3) for name, t in sorted(finished.items())}
+
+
+def run(cap: float, big_mb: float, small_mb: float, small: int, delay: float) -> dict:
+    files = {"/big.dmg": os.urandom(int(big_mb * 1024**2))}
+    for i in range(small):
+        files[f"/small{i}.dmg"] = os.urandom(int(small_mb * 1024**2))
+    # Each response alone could use twice the cap, the bucket is the limit
+    with FileServer(files, rate=int(2 * cap * 1024**2)) as server:
+        with tempfile.TemporaryDirectory(prefix="bench_bandwidth_") as root:
+            same = run_scenario(server, root, cap, small, 0, delay)
+            prioritised = run_scenario(server, root, cap, small, 10, delay)
+
+    def slowest_small(result: Dict[str, float]) -> float:
+        return max(t for name, t in result.items() if name.startswith("small"))
+
+    return {
+        "cap_mb_s": cap,
+        "same_priority": same,
+        "small_first": prioritised,
+        "small_done_s": {
+            "same_priority": slowest_small(same),
+            "small_first": slowest_small(prioritised),
+        },
+        "small_finished_before_big": all(
+            t + delay < prioritised["big.dmg"]
+            for name, t in prioritised.items()
+            if name.startswith("small")
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--cap", type=float, default=8, help="MB/s for all downloads")
+    parser.add_argument("--big-mb", type=float, default=24)
+    parser.add_argument("--small-mb", type=float, default=1)
+    parser.add_argument("--small", type=int, default=3)
+    parser.add_argument("--delay", type=float, default=0.5)
+    args = parser.parse_args()
+    result = run(args.cap, args.big_mb, args.small_mb, args.small, args.delay)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
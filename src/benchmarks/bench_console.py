@@ -0,0 +1,91 @@
+"""
+Microbenchmark of console output.
+
+Compares the previous FancyPrint behaviour (style sequence rebuilt on every
+call, one styled segment per gradient character, a print() per line) with
+the memoized, line-buffered backend. FORCE_COLOR is set so both sides do
+the styling work; output goes to a line-buffered /dev/null, which behaves
+like a terminal without its rendering cost.
+
+    cd src && python -m benchmarks.bench_console --lines 50000
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import time
+
+from lib.tui import FancyPrint
+
+
+def old_apply_style(text, color=None, bg=None, style=None):
+    result = ""
+    if style:
+        styles = style if isinstance(style, list) else [style]
+        for s in styles:
+            if s in FancyPrint.STYLES:
+                result += FancyPrint.STYLES[s]
+    if color and color in FancyPrint.COLORS:
+        result += FancyPrint.COLORS[color]
+    if bg and bg in FancyPrint.BG_COLORS:
+        result += FancyPrint.BG_COLORS[bg]
+    return result + str(text) + FancyPrint.RESET
+
+
+def old_gradient(text, colors):
+    chars_per_color = max(1, len(text) // len(colors))
+    result = ""
+    for i, char in enumerate(text):
+        color_idx = min(i // chars_per_color, len(colors) - 1)
+        result += old_apply_style(char, color=colors[color_idx])
+    print(result)
+
+
+def old_info(text):
+    print(old_apply_style(f"{FancyPrint.ICONS['info']} {text}", "bright_cyan"))
+
+
+def timed(func, lines: int) -> float:
+    began = time.perf_counter()
+    for i in range(lines):
+        func(i)
+    return time.perf_counter() - began
+
+
+def run(lines: int) -> dict:
+    text = "Installing DMG applications " * 3
+    colors = ["red", "yellow", "green", "cyan", "blue", "magenta"]
+    results = {"lines": lines}
+    os.environ["FORCE_COLOR"] = "1"
+    with (
+        open(os.devnull, "w", buffering=1) as devnull,
+        contextlib.redirect_stdout(devnull),
+    ):
+        cases = {
+            "info": (
+                lambda i: old_info(f"line {i}"),
+                lambda i: FancyPrint.info(f"line {i}"),
+            ),
+            "gradient": (
+                lambda i: old_gradient(text, colors),
+                lambda i: FancyPrint.gradient(text, colors),
+            ),
+        }
+        for name, (old, new) in cases.items():
+            old_s, new_s = timed(old, lines), timed(new, lines)
+            results[f"{name}_old_us_per_line"] = round(old_s / lines * 1e6, 2)
+            results[f"{name}_new_us_per_line"] = round(new_s / lines * 1e6, 2)
+            results[f"{name}_speedup"] = round(old_s / new_s, 1) if new_s else None
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--lines", type=int, default=50_000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.lines), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark lib.fastcopy.copy_tree against shutil.copytree.
+
+Builds a synthetic .app bundle with many small files (the shape of
+Docker.app and friends) and times both copies on the same filesystem.
+
+    cd src && python -m benchmarks.bench_copy --files 20000
+"""
+
+import argparse
+import functools
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from lib.fastcopy import copy_tree
+
+
+def make_bundle(root: str, files: int, big_files: int = 4, seed: int = 0) -> str:
+    """Create a fake .app with `files` small files spread over nested dirs"""
+    rng = random.Random(seed)
+    app = os.path.join(root, "Synthetic.app")
+    contents = os.path.join(app, "Contents")
+    os.makedirs(os.path.join(contents, "MacOS"))
+
+    for i in range(big_files):
+        path = os.path.join(contents, "MacOS", f"bin{i}")
+        with open(path, "wb") as f:
+            f.write(os.urandom(8 * 1024 * 1024))
+        os.chmod(path, 0o755)
+
+    for i in range(files):
+        d = os.path.join(
+            contents, "Resources", f"d{i % 97}", f"e{i % 13}", f"f{(i // 13) % 7}"
+        )
+        os.makedirs(d, exist_ok=True)
+        with open(os.path.join(d, f"file{i}.dat"), "wb") as f:
+            f.write(os.urandom(rng.randint(256, 16 * 1024)))
+        if i % 500 == 0:
+            os.symlink(f"file{i}.dat", os.path.join(d, f"link{i}"))
+
+    return app
+
+
+def _time(func) -> float:
+    began = time.perf_counter()
+    func()
+    return time.perf_counter() - began
+
+
+def run(files: int, repeat: int, workers: int) -> dict:
+    results = {"files": files, "workers": workers, "copytree": [], "copy_tree": []}
+    with tempfile.TemporaryDirectory(prefix="bench_copy_") as root:
+        app = make_bundle(root, files)
+        for i in range(repeat):
+            a = os.path.join(root, f"a{i}.app")
+            b = os.path.join(root, f"b{i}.app")
+            results["copytree"].append(
+                _time(functools.partial(shutil.copytree, app, a, symlinks=True))
+            )
+            results["copy_tree"].append(
+                _time(functools.partial(copy_tree, app, b, workers=workers))
+            )
+            shutil.rmtree(a)
+            shutil.rmtree(b)
+
+    best_old = min(results["copytree"])
+    best_new = min(results["copy_tree"])
+    results["speedup"] = round(best_old / best_new, 2) if best_new else None
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=16)
+    args = parser.parse_args()
+    print(json.dumps(run(args.files, args.repeat, args.workers), indent=2))
+
+
+if __name__ == "__main__":
+    main()
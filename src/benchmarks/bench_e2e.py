@@ -0,0 +1,302 @@
+"""
+End-to-end benchmark of a full run.
+
+Synthetic DMGs are served by a local throttled HTTP server, a fake hdiutil
+(benchmarks/fake_hdiutil.py) on PATH "mounts" a realistic .app bundle,
+and the bash tasks just sleep and print. Three scenarios are timed:
+
+- dmg_install: DmgManagement.run() for every DMG, without the cache
+- main_cold: main.main() with an empty artifact cache
+- main_warm: main.main() again, DMGs served from the cache
+
+Each scenario runs --repeat times and the fastest run counts. The JSON
+result holds its wall time and the time per phase from the run's event
+log (summed over threads). With --baseline the scenarios are compared to
+a stored result, and the exit status is 1 if any is slower than the
+baseline by more than --tolerance.
+
+    cd src && python -m benchmarks.bench_e2e --baseline benchmarks/e2e_baseline.json
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List
+
+import main as entry
+from benchmarks.bench_copy import make_bundle
+from lib.dmg import DmgManagement
+from lib.events import events, read_events
+from lib.manifest import parse_dmg_entries
+from lib.plan import Plan
+from tests.http_fixture import FileServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, "e2e_baseline.json")
+
+
+def _write_script(path: str, text: str):
+    with open(path, "w") as f:
+        f.write(text)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+class Workspace:
+    """Everything a run touches, under one temporary directory"""
+
+    def __init__(self, root: str, config: Dict[str, Any]) -> None:
+        self.root = root
+        self.config = config
+        self.applications = os.path.join(root, "Applications")
+        self.cache = os.path.join(root, "cache")
+        self.tasks_file = os.path.join(root, "tasks.json")
+        self.plan_file = os.path.join(root, "plan.json")
+        os.makedirs(self.applications)
+
+        self.app = make_bundle(os.path.join(root, "template"), config["app_files"])
+        self.bin_dir = os.path.join(root, "bin")
+        os.makedirs(self.bin_dir)
+        fake = os.path.join(HERE, "fake_hdiutil.py")
+        _write_script(
+            os.path.join(self.bin_dir, "hdiutil"),
+            f'#!/bin/sh\nexec "{sys.executable}" "{fake}" "$@"\n',
+        )
+        _write_script(os.path.join(self.bin_dir, "xattr"), "#!/bin/sh\nexit 0\n")
+
+        size = int(config["dmg_mb"] * 1024**2)
+        self.files = {
+            f"/Synthetic{i + 1}.dmg": os.urandom(size) for i in range(config["dmgs"])
+        }
+
+    def env(self) -> Dict[str, str]:
+        return {
+            "PATH": self.bin_dir + os.pathsep + os.environ.get("PATH", ""),
+            "MACBOOK_INIT_CACHE": self.cache,
+            "MACBOOK_INIT_JOURNAL": os.path.join(self.root, "journal.json"),
+            "MACBOOK_INIT_LOGS": os.path.join(self.root, "logs"),
+            "MACBOOK_INIT_SIZES": os.path.join(self.root, "sizes.json"),
+            "MACBOOK_INIT_APPLICATIONS": self.applications,
+            "FAKE_HDIUTIL_VOLUMES": os.path.join(self.root, "Volumes"),
+            "FAKE_HDIUTIL_APP": self.app,
+        }
+
+    def write_manifest(self, server: FileServer):
+        """tasks.json with sleeping bash tasks and the served DMGs, all approved"""
+        os.makedirs(os.path.join(self.root, "scripts"))
+        bash_tasks = []
+        for i in range(self.config["tasks"]):
+            script = f"scripts/{i + 1:02d}_task.sh"
+            _write_script(
+                os.path.join(self.root, script),
+                f"#!/bin/bash\nsleep {self.config['task_sleep']}\nseq 1 200\n",
+            )
+            bash_tasks.append(
+                {
+                    "name": f"Task {i + 1}",
+                    "script": f"./{script}",
+                    "order": (i + 1) * 10,
+                    "show_dialog": False,
+                    # Like Homebrew: one task everything else waits for
+                    "depends_on": [] if i == 0 else ["Task 1"],
+                }
+            )
+        dmgs = [
+            {"url": server.url(path), "sha256": hashlib.sha256(data).hexdigest()}
+            for path, data in self.files.items()
+        ]
+        with open(self.tasks_file, "w") as f:
+            json.dump({"bash": bash_tasks, "dmg": dmgs}, f, indent=2)
+
+        plan = Plan.build(bash_tasks, parse_dmg_entries(dmgs))
+        for action in plan.actions:
+            action.approved = True
+        plan.save(self.plan_file)
+        return parse_dmg_entries(dmgs)
+
+    def reset_applications(self):
+        shutil.rmtree(self.applications)
+        os.makedirs(self.applications)
+
+
+@contextlib.contextmanager
+def _environment(values: Dict[str, str]):
+    saved = {key: os.environ.get(key) for key in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+@contextlib.contextmanager
+def _quiet():
+    """Send console output and child processes' stdout to /dev/null"""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 1)
+        try:
+            with contextlib.redirect_stdout(devnull):
+                yield
+        finally:
+            sys.stdout.flush()
+            os.dup2(saved, 1)
+            os.close(saved)
+
+
+def _phases(events_file: str) -> Dict[str, float]:
+    totals: Dict[str, float] = defaultdict(float)
+    for record in read_events(events_file):
+        if record["type"] == "span":
+            totals[record["name"]] += record["dur"]
+    return {name: round(total, 3) for name, total in sorted(totals.items())}
+
+
+def _scenario(events_file: str, func: Callable[[], None]) -> Dict[str, Any]:
+    if os.path.exists(events_file):
+        os.remove(events_file)
+    began = time.perf_counter()
+    with _quiet():
+        func()
+    seconds = time.perf_counter() - began
+    return {"seconds": round(seconds, 3), "phases": _phases(events_file)}
+
+
+def _best(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    best = min(runs, key=lambda r: r["seconds"])
+    return {**best, "runs": [r["seconds"] for r in runs]}
+
+
+def run(config: Dict[str, Any], repeat: int = 1) -> Dict[str, Any]:
+    runs: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    with tempfile.TemporaryDirectory(prefix="bench_e2e_") as root:
+        ws = Workspace(root, config)
+        rate = int(config["rate_mb"] * 1024**2) or None
+        with FileServer(ws.files, rate=rate) as server, _environment(ws.env()):
+            dmg_entries = ws.write_manifest(server)
+            events_file = os.path.join(root, "events.jsonl")
+
+            def install_dmgs():
+                events.open(events_file)
+                try:
+                    for e in dmg_entries:
+                        DmgManagement(url=e.url, sha256=e.sha256).run()
+                finally:
+                    events.close()
+
+            argv = [
+                "--approve-plan",
+                ws.plan_file,
+                "--jobs",
+                str(config["jobs"]),
+                "--events",
+                events_file,
+                "--tasks",
+                ws.tasks_file,
+            ]
+            for _ in range(repeat):
+                ws.reset_applications()
+                runs["dmg_install"].append(_scenario(events_file, install_dmgs))
+
+                shutil.rmtree(ws.cache, ignore_errors=True)
+                for name in ("main_cold", "main_warm"):
+                    ws.reset_applications()
+                    runs[name].append(_scenario(events_file, lambda: entry.main(argv)))
+
+    scenarios = {name: _best(results) for name, results in runs.items()}
+    return {"config": config, "scenarios": scenarios}
+
+
+def compare(
+    results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float
+) -> List[str]:
+    """Scenarios slower than the baseline by more than tolerance"""
+    if baseline.get("config") != results["config"]:
+        return ["baseline was recorded with a different configuration"]
+    regressions = []
+    for name, result in results["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            continue
+        limit = base["seconds"] * (1 + tolerance)
+        if result["seconds"] > limit:
+            regressions.append(
+                f"{name}: {result['seconds']:.2f}s, baseline {base['seconds']:.2f}s "
+                f"(+{tolerance:.0%} allowed)"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dmgs", type=int, default=2)
+    parser.add_argument("--dmg-mb", type=float, default=32)
+    parser.add_argument(
+        "--rate-mb", type=float, default=32, help="Per-connection MB/s, 0 = no limit"
+    )
+    parser.add_argument("--app-files", type=int, default=3000)
+    parser.add_argument("--tasks", type=int, default=6)
+    parser.add_argument("--task-sleep", type=float, default=0.5)
+    parser.add_argument("--jobs", type=int, default=3)
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs per scenario, the fastest counts"
+    )
+    parser.add_argument("--output", help="Write the JSON result here")
+    parser.add_argument(
+        "--baseline",
+        nargs="?",
+        const=DEFAULT_BASELINE,
+        help="Compare against this result (default: %(const)s)",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store this result as the new baseline instead of comparing",
+    )
+    args = parser.parse_args()
+
+    config = {
+        "dmgs": args.dmgs,
+        "dmg_mb": args.dmg_mb,
+        "rate_mb": args.rate_mb,
+        "app_files": args.app_files,
+        "tasks": args.tasks,
+        "task_sleep": args.task_sleep,
+        "jobs": args.jobs,
+    }
+    results = run(config, max(1, args.repeat))
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    baseline_path = args.baseline or DEFAULT_BASELINE
+    if args.update_baseline:
+        with open(baseline_path, "w") as f:
+            f.write(text + "\n")
+        return
+    if args.baseline:
+        with open(baseline_path) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
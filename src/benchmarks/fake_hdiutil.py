@@ -0,0 +1,145 @@
+"""
+Stand-in for macOS hdiutil, installed on PATH by the end-to-end benchmark.
+
+`attach IMAGE` reads the whole image first, as hdiutil's verification
+does unless -noverify is given, then "mounts" it as
+$FAKE_HDIUTIL_VOLUMES/<image name>/ (or under -mountroot DIR) holding
+<image name>.app, a symlink to the app bundle at $FAKE_HDIUTIL_APP. The
+output mimics hdiutil's table, or its system-entities plist with -plist.
+With $FAKE_HDIUTIL_EXTRA_VOLUME set, the image has a second, app-less
+partition that is mounted before the app's, like some vendor DMGs.
+`detach /dev/diskN` removes every mount directory of that image,
+`detach MOUNT_POINT` only that one, leaving the image attached like
+hdiutil does.
+"""
+
+import hashlib
+import json
+import os
+import plistlib
+import shutil
+import sys
+import zlib
+
+# Options that take a value
+_VALUED = {"-mountroot"}
+
+
+def _operands(args):
+    operands, skip = [], False
+    for a in args:
+        if skip:
+            skip = False
+        elif a in _VALUED:
+            skip = True
+        elif not a.startswith("-"):
+            operands.append(a)
+    return operands
+
+
+def _option(args, name):
+    return args[args.index(name) + 1] if name in args else None
+
+
+def _mount(mount_point, app=None):
+    os.makedirs(mount_point, exist_ok=True)
+    if app is not None:
+        link = os.path.join(mount_point, f"{app}.app")
+        if not os.path.islink(link):
+            os.symlink(os.environ["FAKE_HDIUTIL_APP"], link)
+
+
+def _disks_path() -> str:
+    return os.path.join(os.environ["FAKE_HDIUTIL_VOLUMES"], ".disks.json")
+
+
+def _load_disks() -> dict:
+    try:
+        with open(_disks_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_disks(disks: dict):
+    os.makedirs(os.path.dirname(_disks_path()), exist_ok=True)
+    with open(_disks_path(), "w") as f:
+        json.dump(disks, f)
+
+
+def attach(args) -> int:
+    image = _operands(args)[0]
+    if "-noverify" not in args:
+        digest = hashlib.sha256()
+        with open(image, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                digest.update(chunk)
+
+    name = os.path.splitext(os.path.basename(image))[0]
+    root = _option(args, "-mountroot") or os.environ["FAKE_HDIUTIL_VOLUMES"]
+    disk = f"/dev/disk{4 + zlib.crc32(name.encode()) % 60}"
+    entities = [{"content-hint": "GUID_partition_scheme", "dev-entry": disk}]
+    if os.environ.get("FAKE_HDIUTIL_EXTRA_VOLUME"):
+        extra = os.path.join(root, f"{name} Resources")
+        _mount(extra)
+        entities.append(
+            {
+                "content-hint": "Apple_HFS",
+                "dev-entry": f"{disk}s1",
+                "mount-point": extra,
+            }
+        )
+    mount_point = os.path.join(root, name)
+    _mount(mount_point, app=name)
+    entities.append(
+        {
+            "content-hint": "Apple_HFS",
+            "dev-entry": f"{disk}s{len(entities)}",
+            "mount-point": mount_point,
+        }
+    )
+
+    disks = _load_disks()
+    disks[disk] = [e["mount-point"] for e in entities if "mount-point" in e]
+    _save_disks(disks)
+
+    if "-plist" in args:
+        sys.stdout.write(plistlib.dumps({"system-entities": entities}).decode())
+        return 0
+    for entity in entities:
+        print(
+            f"{entity['dev-entry']:<16}\t{entity['content-hint']:<31}\t"
+            f"{entity.get('mount-point', '')}"
+        )
+    return 0
+
+
+def detach(args) -> int:
+    target = _operands(args)[0]
+    disks = _load_disks()
+    if target in disks:
+        for mount_point in disks.pop(target):
+            shutil.rmtree(mount_point, ignore_errors=True)
+        _save_disks(disks)
+    elif os.path.isdir(target):
+        shutil.rmtree(target, ignore_errors=True)
+    else:
+        print("hdiutil: detach failed - No such file or directory", file=sys.stderr)
+        return 1
+    print(f'"{target}" ejected.')
+    return 0
+
+
+def main(argv) -> int:
+    if not argv:
+        print("usage: hdiutil attach IMAGE | detach DEVICE", file=sys.stderr)
+        return 1
+    commands = {"attach": attach, "detach": detach}
+    if argv[0] not in commands:
+        print(f"hdiutil: unsupported verb {argv[0]}", file=sys.stderr)
+        return 1
+    return commands[argv[0]](argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,177 @@
+"""
+App archives.
+
+Besides DMGs, the `dmg` list in tasks.json takes `.zip` and `.tar.xz`
+(or `.tar.gz`, `.tar.bz2`) URLs of archives holding an `.app`. These skip
+the mount/copy/detach cycle: the app is extracted into a hidden staging
+directory inside the applications directory, then renamed into place,
+which is a metadata-only move on the same volume.
+
+A tar archive is extracted while it downloads, by tarfile's stream mode,
+so it never touches the disk. A zip keeps its index (the central
+directory) at the end, so it is downloaded like a DMG first and its
+members are then written on a thread pool.
+
+Only members inside an `.app` are extracted, and whatever comes before the
+bundle in their path is dropped (`Foo-1.2/Foo.app/...` becomes
+`Foo.app/...`). Modes, executable bits included, and symlinks are kept;
+`..` in paths and symlinks out of the staging directory are refused.
+"""
+
+import os
+import shutil
+import stat
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, List, Optional
+
+from lib.fastcopy import BUFFER_SIZE, DEFAULT_WORKERS
+from lib.tarball import ExtractStats
+from utils.errors import ArchiveError
+
+APP_SUFFIX = ".app"
+# AppleDouble copies of resource forks that Finder's zip adds
+_RESOURCE_FORKS = "__MACOSX"
+
+
+def app_path(name: str) -> Optional[str]:
+    """Member name relative to the staging dir, None if it isn't in an .app"""
+    parts = [p for p in name.split("/") if p not in ("", ".")]
+    if not parts or parts[0] == _RESOURCE_FORKS:
+        return None
+    for i, part in enumerate(parts):
+        if part.endswith(APP_SUFFIX):
+            return "/".join(parts[i:])
+    return None
+
+
+def installed_apps(staging: str) -> List[str]:
+    return sorted(f for f in os.listdir(staging) if f.endswith(APP_SUFFIX))
+
+
+def extract_tar(stream: IO[bytes], dest: str) -> ExtractStats:
+    """Extract the apps in a tar stream of any compression into dest"""
+    stats = ExtractStats()
+
+    def filter(member: tarfile.TarInfo, path: str) -> Optional[tarfile.TarInfo]:
+        name = app_path(member.name)
+        if name is None:
+            return None
+        changes = {"name": name}
+        if member.islnk():
+            # Hard links name another member, which was renamed too
+            linkname = app_path(member.linkname)
+            if linkname is None:
+                return None
+            changes["linkname"] = linkname
+        try:
+            member = tarfile.data_filter(member.replace(**changes, deep=False), path)
+        except tarfile.FilterError as e:
+            raise ArchiveError(f"Unsafe member in archive: {e}")
+        if member.isfile():
+            stats.written += member.size
+            stats.files += 1
+        return member
+
+    with tarfile.open(fileobj=stream, mode="r|*") as tar:
+        tar.extractall(dest, filter=filter)
+    return stats
+
+
+def _zip_mode(info: zipfile.ZipInfo) -> int:
+    """Unix mode of a member, or the default for archives made elsewhere"""
+    mode = info.external_attr >> 16 if info.create_system == 3 else 0
+    if not stat.S_IFMT(mode):
+        mode |= stat.S_IFDIR if info.is_dir() else stat.S_IFREG
+    if not stat.S_IMODE(mode):
+        mode |= 0o755 if info.is_dir() else 0o644
+    return mode
+
+
+def _zip_members(zf: zipfile.ZipFile):
+    """(member, relative path, mode) of every member inside an .app"""
+    for info in zf.infolist():
+        name = app_path(info.filename)
+        if name is None:
+            continue
+        if ".." in name.split("/"):
+            raise ArchiveError(f"Unsafe member in archive: {info.filename}")
+        yield info, name, _zip_mode(info)
+
+
+def zip_app_size(path: str) -> int:
+    """Bytes the apps in a zip take once extracted"""
+    with zipfile.ZipFile(path) as zf:
+        return sum(info.file_size for info, _, _ in _zip_members(zf))
+
+
+def extract_zip(path: str, dest: str, workers: int = DEFAULT_WORKERS) -> ExtractStats:
+    """Extract the apps in a downloaded zip into dest, files in parallel"""
+    stats = ExtractStats(downloaded=os.path.getsize(path))
+    try:
+        zf = zipfile.ZipFile(path)
+    except zipfile.BadZipFile as e:
+        raise ArchiveError(f"Not a zip archive: {e}")
+
+    with zf:
+        members = list(_zip_members(zf))
+        files = []
+        dirs = []
+        links = []
+        # Directories first, so file writes never wait on them
+        for info, name, mode in members:
+            target = os.path.join(dest, name)
+            if stat.S_ISDIR(mode):
+                os.makedirs(target, exist_ok=True)
+                dirs.append((info, target, mode))
+            elif stat.S_ISLNK(mode):
+                links.append((zf.read(info).decode(), target))
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                files.append((info, target, mode))
+
+        def write(item):
+            info, target, mode = item
+            with zf.open(info) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst, BUFFER_SIZE)
+            os.chmod(target, stat.S_IMODE(mode) & ~(stat.S_ISUID | stat.S_ISGID))
+            _set_mtime(target, info)
+
+        if files:
+            with ThreadPoolExecutor(
+                max_workers=min(workers, len(files)), thread_name_prefix="unzip"
+            ) as pool:
+                list(pool.map(write, files))
+
+        # Symlinks after the files, so no file is written through one, and
+        # each checked with those before it resolved, like tarfile.data_filter
+        for link, target in links:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            _check_link(dest, target, link)
+            os.symlink(link, target)
+
+        # Last, and deepest first, so writing into them doesn't undo it
+        dirs.sort(key=lambda d: d[1].count(os.sep), reverse=True)
+        for info, target, mode in dirs:
+            os.chmod(target, stat.S_IMODE(mode))
+            _set_mtime(target, info)
+
+    stats.files = len(files)
+    stats.written = sum(info.file_size for info, _, _ in files)
+    return stats
+
+
+def _check_link(dest: str, target: str, link: str):
+    root = os.path.realpath(dest)
+    parent = os.path.realpath(os.path.dirname(target))
+    resolved = os.path.realpath(os.path.join(parent, link))
+    if os.path.isabs(link) or os.path.commonpath([root, resolved]) != root:
+        name = os.path.relpath(target, dest)
+        raise ArchiveError(f"Symlink out of the archive: {name} -> {link}")
+
+
+def _set_mtime(path: str, info: zipfile.ZipInfo):
+    mtime = time.mktime(info.date_time + (0, 0, -1))
+    os.utime(path, (mtime, mtime))
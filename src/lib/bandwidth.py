@@ -0,0 +1,142 @@
+"""
+Global download bandwidth scheduler.
+
+Background downloads compete with each other and with the bash tasks'
+own curl and git traffic. With a cap set (`--max-bandwidth`), every
+downloaded chunk takes tokens from one token bucket refilled at the cap,
+so all downloads together stay under it and leave the rest of the link to
+everything else.
+
+Each download is a Flow with the `priority` and `weight` of its
+tasks.json entry. When tokens are available they go to the waiting flow
+with the highest priority, so a small, important item queued behind
+Docker.dmg takes the bandwidth over as soon as it starts and hands it
+back when it is done. Flows of equal priority share in proportion to
+their weights (start-time fair queueing on bytes / weight). The bucket
+is work-conserving: a flow whose server is slower than its share leaves
+the rest to lower priorities instead of wasting it.
+
+Without a cap nothing is throttled and priorities have no effect; there
+is no link speed to divide up.
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+DEFAULT_PRIORITY = 0
+DEFAULT_WEIGHT = 1.0
+# Bucket size in seconds of the cap, how far a quiet moment can be caught up
+BURST_SECONDS = 0.25
+# Longest a waiter sleeps before looking again
+MAX_WAIT = 0.1
+# A flow silent for longer than this was idle, not just between two reads
+IDLE_AFTER = 0.1
+
+
+class Flow:
+    """One download's share of the bandwidth, see BandwidthManager.flow()"""
+
+    def __init__(
+        self, manager: "BandwidthManager", name: str, priority: int, weight: float
+    ) -> None:
+        self.manager = manager
+        self.name = name
+        self.priority = priority
+        self.weight = weight
+        self.bytes = 0
+        # Bytes / weight granted so far, the fair-queueing clock
+        self.vtime = 0.0
+        self.last_grant = 0.0
+
+    def consume(self, n: int):
+        """Account for n bytes received, blocking while over the flow's share"""
+        self.manager.consume(self, n)
+
+
+@dataclass
+class _Waiter:
+    flow: Flow
+    n: int
+    seq: int
+
+
+class BandwidthManager:
+    def __init__(self, rate: Optional[float] = None) -> None:
+        self._cond = threading.Condition()
+        self._waiters: List[_Waiter] = []
+        self._seq = 0
+        self._vclock = 0.0
+        self.configure(rate)
+
+    def configure(self, rate: Optional[float]):
+        """Cap all downloads at rate bytes per second, None for no cap"""
+        with self._cond:
+            self.rate = rate if rate and rate > 0 else None
+            self._capacity = (self.rate or 0) * BURST_SECONDS
+            self._tokens = self._capacity
+            self._refilled = time.monotonic()
+            self._cond.notify_all()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate is not None
+
+    def flow(
+        self,
+        name: str,
+        priority: int = DEFAULT_PRIORITY,
+        weight: float = DEFAULT_WEIGHT,
+    ) -> Flow:
+        return Flow(self, name, priority, weight if weight > 0 else DEFAULT_WEIGHT)
+
+    def consume(self, flow: Flow, n: int):
+        if self.rate is None or n <= 0:
+            flow.bytes += n
+            return
+        with self._cond:
+            if time.monotonic() - flow.last_grant > IDLE_AFTER:
+                # A flow that was idle starts level with the others, not ahead
+                flow.vtime = max(flow.vtime, self._vclock)
+            waiter = _Waiter(flow, n, self._seq)
+            self._seq += 1
+            self._waiters.append(waiter)
+            try:
+                while True:
+                    self._refill()
+                    if self.rate is None or (
+                        self._tokens > 0 and self._next() is waiter
+                    ):
+                        break
+                    self._cond.wait(self._wait_time())
+            finally:
+                self._waiters.remove(waiter)
+            if self.rate is not None:
+                # May go below zero, the next grant waits for the debt
+                self._tokens -= n
+            self._vclock = flow.vtime
+            flow.vtime += n / flow.weight
+            flow.bytes += n
+            flow.last_grant = time.monotonic()
+            self._cond.notify_all()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate is not None:
+            self._tokens = min(
+                self._capacity, self._tokens + (now - self._refilled) * self.rate
+            )
+        self._refilled = now
+
+    def _next(self) -> _Waiter:
+        """Highest priority first, then the least served per weight, then FIFO"""
+        return min(self._waiters, key=lambda w: (-w.flow.priority, w.flow.vtime, w.seq))
+
+    def _wait_time(self) -> float:
+        if self.rate is None or self._tokens > 0:
+            return MAX_WAIT
+        return min(MAX_WAIT, -self._tokens / self.rate + 0.001)
+
+
+bandwidth = BandwidthManager()
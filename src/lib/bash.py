@@ -1,11 +1,23 @@
 import subprocess
-from typing import Union, List
+from typing import TYPE_CHECKING, Optional, Union, List
 
+from lib.events import traced
 from lib.tui import console, confirm
-from utils.errors import UserCancelled
+from utils.errors import TaskFailed, UserCancelled
 
+if TYPE_CHECKING:
+    from lib.session import BashSession
+    from lib.tasklog import TaskLog
 
-def run(cmd: Union[str, List[str]], show_log: bool = True, show_dialog: bool = True):
+
+@traced("bash.run", "bash", args=lambda cmd, *a, **kw: {"cmd": str(cmd)})
+def run(
+    cmd: Union[str, List[str]],
+    show_log: bool = True,
+    show_dialog: bool = True,
+    log: Optional["TaskLog"] = None,
+    session: Optional["BashSession"] = None,
+):
     if show_log:
         console.warning(f"executing shell command: {cmd}")
 
@@ -13,6 +25,12 @@ def run(cmd: Union[str, List[str]], show_log: bool = True, show_dialog: bool = T
         if not confirm(prompt="Continue?"):
             raise UserCancelled("User cancelled command execution")
 
+    if session is not None:
+        return session.run(cmd, log)
+
+    if log is not None:
+        return _run_captured(cmd, log)
+
     return subprocess.run(
         cmd,
         shell=True,
@@ -20,3 +38,21 @@ def run(cmd: Union[str, List[str]], show_log: bool = True, show_dialog: bool = T
         check=True,
         text=True,
     )
+
+
+def _run_captured(cmd: Union[str, List[str]], log: "TaskLog"):
+    """Run with stdout/stderr streamed through a pipe into the task log"""
+    with subprocess.Popen(
+        cmd,
+        shell=True,
+        executable="/bin/bash",
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    ) as proc:
+        assert proc.stdout is not None
+        log.pump(proc.stdout)
+        returncode = proc.wait()
+
+    if returncode != 0:
+        raise TaskFailed(cmd, returncode, tail=log.tail(), log_path=log.path)
+    return subprocess.CompletedProcess(cmd, returncode)
@@ -0,0 +1,453 @@
+"""
+Offline provisioning bundles.
+
+`python -m lib.bundle export macbook.bundle` resolves everything tasks.json
+fetches into one file: every DMG and tarball (through the artifact cache,
+so a warm cache exports without downloading), a `git bundle` of every
+repository's mirror, tasks.json itself with the bash scripts, and every
+URL those scripts fetch with curl or wget (the Homebrew, nvm and uv
+`install.sh`).
+`main.py --from-bundle macbook.bundle` then installs from that file alone.
+Nothing is fetched from the network in that mode; an entry the bundle
+doesn't have fails instead of falling back to a download.
+
+The bundle is a zip file. Artifacts are stored uncompressed (they are
+compressed already) under their SHA-256, and `bundle.json` lists each one
+with its source URL or repository, size and hash. The zip's central
+directory is the index: a member is read by seeking straight to it, so
+installing one DMG reads the index and that DMG, not the whole bundle.
+Every member is hashed as it is extracted and checked against bundle.json.
+
+When the scripts are extracted, each of those URLs is replaced with a
+`file://` URL of its bundled copy, so `curl -fsSL URL | bash` runs the
+bundled installer. A script that fetches a URL the bundle doesn't have
+fails --from-bundle before anything runs. What an installer downloads by
+itself (Homebrew's own checkout, `brew bundle`, `pip3 install`) is out of
+reach of the bundle and still needs the network.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from lib.download import ProgressCallback, StreamReader
+from lib.manifest import Manifest, load_manifest
+from lib.tui import console
+from utils.errors import (
+    BundleError,
+    ChecksumError,
+    DownloadError,
+    GitError,
+    ManifestError,
+    TaskFailed,
+)
+
+INDEX_MEMBER = "bundle.json"
+FORMAT_VERSION = 1
+# tasks.json and the scripts, at their paths relative to tasks.json
+FILES_PREFIX = "files/"
+TASKS_NAME = "tasks.json"
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_TASKS = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", TASKS_NAME)
+)
+
+DMG = "dmg"
+TARBALL = "tarball"
+GIT = "git"
+# An installer a bash script downloads, e.g. Homebrew's install.sh
+SCRIPT = "script"
+
+_FETCHERS = re.compile(r"\b(?:curl|wget)\b")
+_URL = re.compile(r"https?://[^\s\"'`()|;&<>]+")
+
+
+@dataclass(frozen=True)
+class BundleItem:
+    kind: str
+    source: str  # URL, or the repository for git
+    member: str
+    sha256: str
+    size: int
+
+
+class BundleWriter:
+    """Builds a bundle at path; nothing is there until close() succeeds"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._partial = path + ".partial"
+        self._zip = zipfile.ZipFile(self._partial, "w")
+        self.items: List[BundleItem] = []
+        self.files: Dict[str, str] = {}
+
+    def add_file(self, name: str, path: str):
+        """tasks.json or a script, extracted to name under the work dir"""
+        sha256 = _file_sha256(path)
+        self._zip.write(path, FILES_PREFIX + name, compress_type=zipfile.ZIP_DEFLATED)
+        self.files[name] = sha256
+
+    def add_artifact(self, kind: str, source: str, path: str, sha256: str):
+        member = f"{kind}/{sha256}"
+        if member not in self._zip.NameToInfo:
+            # Stored, not deflated: DMGs and tarballs are compressed already
+            self._zip.write(path, member, compress_type=zipfile.ZIP_STORED)
+        size = self._zip.getinfo(member).file_size
+        self.items.append(BundleItem(kind, source, member, sha256, size))
+
+    def close(self):
+        index = {
+            "version": FORMAT_VERSION,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "files": self.files,
+            "artifacts": [asdict(item) for item in self.items],
+        }
+        self._zip.writestr(INDEX_MEMBER, json.dumps(index, indent=2))
+        self._zip.close()
+        os.replace(self._partial, self.path)
+
+    def abort(self):
+        self._zip.close()
+        if os.path.exists(self._partial):
+            os.remove(self._partial)
+
+
+class Bundle:
+    """A bundle opened for installing; members are extracted to a work dir"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        try:
+            self._zip = zipfile.ZipFile(path)
+            index = json.loads(self._zip.read(INDEX_MEMBER))
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            raise BundleError(f"{path} is not a provisioning bundle: {e}") from e
+        if index.get("version") != FORMAT_VERSION:
+            self._zip.close()
+            raise BundleError(
+                f"{path} has format version {index.get('version')}, "
+                f"expected {FORMAT_VERSION}"
+            )
+        self.created: str = index.get("created", "")
+        self.files: Dict[str, str] = index["files"]
+        self.items: Dict[str, BundleItem] = {
+            raw["source"]: BundleItem(**raw) for raw in index["artifacts"]
+        }
+        self.work_dir = tempfile.mkdtemp(prefix="bundle_")
+        self._extracted: Dict[str, str] = {}
+        self._installers: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def item(self, source: str) -> BundleItem:
+        try:
+            return self.items[source]
+        except KeyError:
+            raise BundleError(f"{source} is not in {self.path}") from None
+
+    def size(self, source: str) -> int:
+        return self.item(source).size
+
+    def extract_files(self) -> str:
+        """Write tasks.json and the scripts to the work dir, returns tasks.json"""
+        root = os.path.join(self.work_dir, "files")
+        for name, sha256 in self.files.items():
+            self._copy(FILES_PREFIX + name, os.path.join(root, name), sha256)
+        for name in self.files:
+            if name != TASKS_NAME:
+                self._localize(os.path.join(root, name), name)
+        return os.path.join(root, TASKS_NAME)
+
+    def _localize(self, path: str, name: str):
+        """Point the script's curl and wget at the bundled copies of their URLs"""
+        with open(path) as f:
+            text = f.read()
+        # Longest first, so a URL isn't cut short by another it starts with
+        for url in sorted(fetched_urls(text), key=len, reverse=True):
+            item = self.items.get(url)
+            if item is None or item.kind != SCRIPT:
+                raise BundleError(
+                    f"{name} downloads {url}, which is not in {self.path}"
+                )
+            # Named by content, so the script and its journal digest are the same
+            # every run
+            local = os.path.join(_installers_dir(), item.sha256)
+            with self._lock:
+                if local not in self._installers:
+                    self._copy(item.member, local, item.sha256)
+                    self._installers.add(local)
+            text = text.replace(url, f"file://{local}")
+        with open(path, "w") as f:
+            f.write(text)
+
+    def extract(
+        self,
+        source: str,
+        dest: str,
+        progress: Optional[ProgressCallback] = None,
+        sha256: Optional[str] = None,
+    ) -> str:
+        """Copy the artifact for source to dest, e.g. a DMG into its temp dir"""
+        item = self._checked(source, sha256)
+        self._copy(item.member, dest, item.sha256, progress)
+        return dest
+
+    def open_stream(
+        self,
+        url: str,
+        progress: Optional[ProgressCallback] = None,
+        sha256: Optional[str] = None,
+    ) -> StreamReader:
+        """Read an artifact front to back without extracting it, like open_stream"""
+        item = self._checked(url, sha256)
+        member = self._zip.open(item.member)
+        return StreamReader(
+            url, member, progress=progress, sha256=item.sha256, total=item.size
+        )
+
+    def git_source(self, repo: str) -> str:
+        """Path of the repository's git bundle to clone from, extracted once"""
+        item = self.item(repo)
+        with self._lock:
+            path = self._extracted.get(item.member)
+            if path is None:
+                path = os.path.join(self.work_dir, f"{item.sha256}.bundle")
+                self._copy(item.member, path, item.sha256)
+                self._extracted[item.member] = path
+        return path
+
+    def close(self):
+        self._zip.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        for path in self._installers:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _checked(self, source: str, sha256: Optional[str]) -> BundleItem:
+        item = self.item(source)
+        if sha256 and sha256.lower() != item.sha256:
+            raise ChecksumError(
+                f"{source} in {self.path} has SHA-256 {item.sha256}, "
+                f"tasks.json expects {sha256.lower()}"
+            )
+        return item
+
+    def _copy(
+        self,
+        member: str,
+        dest: str,
+        sha256: str,
+        progress: Optional[ProgressCallback] = None,
+    ):
+        info = self._zip.getinfo(member)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        digest = hashlib.sha256()
+        done = 0
+        with self._zip.open(info) as src, open(dest, "wb") as dst:
+            while chunk := src.read(CHUNK_SIZE):
+                digest.update(chunk)
+                dst.write(chunk)
+                done += len(chunk)
+                if progress:
+                    progress(done, info.file_size)
+        if digest.hexdigest() != sha256:
+            os.remove(dest)
+            raise ChecksumError(
+                f"{member} in {self.path} is corrupted: "
+                f"expected {sha256}, got {digest.hexdigest()}"
+            )
+        mode = (info.external_attr >> 16) & 0o777
+        if mode:
+            os.chmod(dest, mode)
+
+
+def _file_sha256(path: str) -> str:
+    from lib.cache import file_sha256
+
+    return file_sha256(path)
+
+
+def _installers_dir() -> str:
+    # $TMPDIR is private to the user on macOS
+    path = os.path.join(tempfile.gettempdir(), "macbook-init-installers")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+def fetched_urls(script: str) -> List[str]:
+    """URLs a bash script downloads with curl or wget, in order"""
+    urls: List[str] = []
+    for line in script.splitlines():
+        if _FETCHERS.search(line):
+            urls += [url for url in _URL.findall(line) if url not in urls]
+    return urls
+
+
+def bundle_files(manifest: Manifest, tasks_file: str) -> Dict[str, str]:
+    """tasks.json and every bash script, by their path relative to tasks.json"""
+    base_dir = os.path.dirname(os.path.abspath(tasks_file))
+    files = {TASKS_NAME: tasks_file}
+    for task in manifest.bash:
+        name = os.path.normpath(task["script"])
+        path = os.path.join(base_dir, name)
+        if os.path.isabs(name) or name.startswith(".."):
+            raise BundleError(f"{task['name']}: {task['script']} is outside {base_dir}")
+        if not os.path.isfile(path):
+            raise BundleError(f"{task['name']}: {path} does not exist")
+        files[name] = path
+    return files
+
+
+def export_bundle(
+    tasks_file: str,
+    out: str,
+    cache_dir: Optional[str] = None,
+    workers: int = 4,
+) -> List[BundleItem]:
+    """
+    Fetch every DMG, tarball and repository in tasks_file and write them
+    with the manifest and scripts to the bundle out. The fetches run on a
+    small pool; the bundle is written in manifest order once they are done.
+    """
+    import contextlib
+    from concurrent.futures import ThreadPoolExecutor
+
+    from lib.cache import ArtifactCache
+    from lib.git import GitCheckout, mirror_path, mirror_root
+
+    manifest = load_manifest(tasks_file)
+    files = bundle_files(manifest, tasks_file)
+    cache = ArtifactCache(root=cache_dir)
+    mirrors = mirror_root(cache_dir)
+    staging = tempfile.mkdtemp(prefix="bundle_export_")
+
+    def fetch(url: str, sha256: Optional[str]) -> Tuple[str, str]:
+        path = cache.fetch(url, sha256=sha256)
+        # Cache objects are named by their SHA-256
+        return path, os.path.basename(path)
+
+    def bundle_repo(checkout: GitCheckout) -> Tuple[str, str]:
+        name = os.path.basename(mirror_path(mirrors, checkout.entry.repo))
+        path = checkout.write_bundle(os.path.join(staging, name + ".bundle"))
+        return path, _file_sha256(path)
+
+    sources: Dict[str, Tuple[str, Callable[[], Tuple[str, str]]]] = {}
+    # Cached objects are only read once all fetches are done, no fetch may
+    # evict another's object before that
+    pins = contextlib.ExitStack()
+    for dmg in manifest.dmg:
+        sources[dmg.url] = (DMG, lambda e=dmg: fetch(e.url, e.sha256))
+        pins.enter_context(cache.pinned(dmg.url, dmg.sha256))
+    for tar in manifest.tarball:
+        sources[tar.url] = (TARBALL, lambda e=tar: fetch(e.url, e.sha256))
+        pins.enter_context(cache.pinned(tar.url, tar.sha256))
+    for name, path in files.items():
+        if name == TASKS_NAME:
+            continue
+        with open(path) as f:
+            for url in fetched_urls(f.read()):
+                if url not in sources:
+                    sources[url] = (SCRIPT, lambda u=url: fetch(u, None))
+                    pins.enter_context(cache.pinned(url))
+    for git in manifest.git:
+        # Entries cloning the same repository share one git bundle
+        checkout = GitCheckout(git, mirrors)
+        sources.setdefault(git.repo, (GIT, lambda c=checkout: bundle_repo(c)))
+
+    writer = BundleWriter(out)
+    try:
+        with pins, ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {
+                source: (kind, pool.submit(func))
+                for source, (kind, func) in sources.items()
+            }
+            for name, path in files.items():
+                writer.add_file(name, path)
+            for source, (kind, future) in futures.items():
+                path, sha256 = future.result()
+                writer.add_artifact(kind, source, path, sha256)
+                size = writer.items[-1].size
+                console.info(f"Added {kind} {source} ({size / 1024**2:.1f} MB)")
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return writer.items
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m lib.bundle", description="Offline provisioning bundles"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser(
+        "export", help="Fetch everything tasks.json needs into one bundle file"
+    )
+    export.add_argument("output", help="Bundle file to write")
+    export.add_argument(
+        "--tasks", default=DEFAULT_TASKS, help="Manifest (default: %(default)s)"
+    )
+    export.add_argument(
+        "--cache-dir",
+        help="Artifact cache location (default: ~/Library/Caches/macbook-init)",
+    )
+    export.add_argument(
+        "-j", "--jobs", type=int, default=4, help="Fetches to run at once"
+    )
+    show = commands.add_parser("list", help="Show what a bundle contains")
+    show.add_argument("bundle")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    if args.command == "list":
+        try:
+            with Bundle(args.bundle) as bundle:
+                console.header(f"{args.bundle}, created {bundle.created}")
+                for name in bundle.files:
+                    console.print(f" file: {name}")
+                for item in bundle.items.values():
+                    console.print(
+                        f" {item.kind}: {item.source} "
+                        f"({item.size / 1024**2:.1f} MB, sha256 {item.sha256[:12]})"
+                    )
+        except BundleError as e:
+            console.error(e)
+            return 1
+        return 0
+
+    try:
+        items = export_bundle(args.tasks, args.output, args.cache_dir, args.jobs)
+    except (BundleError, DownloadError, GitError, ManifestError, OSError) as e:
+        console.error(e)
+        return 1
+    except TaskFailed as e:
+        console.error(e)
+        for line in e.tail:
+            console.print(f"  {line}", color="bright_black")
+        return 1
+    total = sum(item.size for item in items)
+    console.success(
+        f"{args.output}: {len(items)} artifact(s), {total / 1024**2:.1f} MB"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
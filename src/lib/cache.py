@@ -0,0 +1,356 @@
+"""
+Persistent, content-addressed artifact cache.
+
+Downloads are stored once under `objects/<sha256>` and indexed by URL
+together with the server's ETag/Last-Modified. A cached URL is revalidated
+with a conditional request and served straight from disk on 304. The cache
+is capped in size and evicts the least recently used objects.
+
+When the expected SHA-256 is known up front, a cached object that still
+hashes to it is served without touching the network at all.
+
+Callers fetching the same URL at the same time share one download: the
+first one downloads, the others wait for it and get the same object. With
+a LAN peer (lib/peer.py) a miss is downloaded from the peer first.
+
+An object can be evicted by another thread's download as soon as fetch()
+returns. fetch_to() pins the URL (and its SHA-256) from before the fetch
+until the object is linked to its destination, and eviction skips pinned
+objects. Callers that read the object later pin it themselves with
+pinned().
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from lib.bandwidth import Flow
+    from lib.download import ProgressCallback
+    from lib.peer import PeerCache
+
+DEFAULT_CACHE_DIR = os.path.expanduser("~/Library/Caches/macbook-init")
+CACHE_DIR_ENV = "MACBOOK_INIT_CACHE"
+DEFAULT_MAX_BYTES = 10 * 1024**3
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    bytes_served: int = 0
+    bytes_downloaded: int = 0
+
+    def summary(self) -> str:
+        return (
+            f"Artifact cache: {self.hits} hit(s), {self.misses} miss(es), "
+            f"{self.evictions} eviction(s), "
+            f"{self.bytes_served / 1024**2:.1f} MB served from cache, "
+            f"{self.bytes_downloaded / 1024**2:.1f} MB downloaded"
+        )
+
+
+class _Pending:
+    """A fetch in progress, for the callers who wait on it"""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.path: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+    def result(self) -> str:
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        assert self.path is not None
+        return self.path
+
+
+def file_sha256(path: str) -> str:
+    """Hash a file through a read-only memory map (no copies into Python)"""
+    import hashlib
+    import mmap
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.sha256(mm).hexdigest()
+
+
+class ArtifactCache:
+    def __init__(
+        self,
+        root: Optional[str] = None,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        timeout: float = 30,
+        peer: Optional["PeerCache"] = None,
+    ) -> None:
+        root = root or os.environ.get(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR
+        self.root = root
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.peer = peer
+        self.objects_dir = os.path.join(root, "objects")
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.index_path = os.path.join(root, "index.json")
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[str, Optional[str]], _Pending] = {}
+        # URL or SHA-256 -> callers that need its object to stay
+        self._pins: Dict[str, int] = {}
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._index: Dict[str, dict] = self._load_index()
+
+    def object_path(self, sha256: str) -> str:
+        return os.path.join(self.objects_dir, sha256)
+
+    def lookup(self, url: str) -> Optional[str]:
+        """Path of the cached object for url, without revalidation"""
+        with self._lock:
+            entry = self._index.get(url)
+        if entry and os.path.isfile(self.object_path(entry["sha256"])):
+            return self.object_path(entry["sha256"])
+        return None
+
+    def info(self, url: str) -> Optional[dict]:
+        """Index entry for url: sha256, size, etag, last_modified"""
+        with self._lock:
+            entry = self._index.get(url)
+            return dict(entry) if entry else None
+
+    def fetch(
+        self,
+        url: str,
+        progress: Optional["ProgressCallback"] = None,
+        sha256: Optional[str] = None,
+        flow: Optional["Flow"] = None,
+    ) -> str:
+        """
+        Return the path of an up to date local copy of url.
+
+        With sha256 given, a cached object with that content is trusted
+        without revalidation, and a fresh download must match it.
+
+        The returned file is owned by the cache; callers should link or copy
+        it rather than modify or delete it.
+        """
+        key = (url, sha256.lower() if sha256 else None)
+        with self._lock:
+            pending = self._pending.get(key)
+            first = pending is None
+            if pending is None:
+                pending = self._pending[key] = _Pending()
+        if not first:
+            return pending.result()
+
+        try:
+            pending.path = self._fetch(url, progress, sha256, flow)
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.done.set()
+        return pending.path
+
+    def fetch_to(
+        self,
+        url: str,
+        dest: str,
+        progress: Optional["ProgressCallback"] = None,
+        sha256: Optional[str] = None,
+        flow: Optional["Flow"] = None,
+    ) -> str:
+        """fetch() url and hardlink (or copy) the object to dest, safe from eviction"""
+        import shutil
+
+        with self.pinned(url, sha256):
+            path = self.fetch(url, progress=progress, sha256=sha256, flow=flow)
+            try:
+                os.link(path, dest)
+            except OSError:
+                shutil.copyfile(path, dest)
+        return dest
+
+    @contextlib.contextmanager
+    def pinned(self, url: str, sha256: Optional[str] = None):
+        """Keep the objects of url and sha256 from being evicted meanwhile"""
+        pins = [url, *([sha256.lower()] if sha256 else [])]
+        with self._lock:
+            for key in pins:
+                self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                for key in pins:
+                    self._pins[key] -= 1
+                    if not self._pins[key]:
+                        del self._pins[key]
+
+    def _fetch(
+        self,
+        url: str,
+        progress: Optional["ProgressCallback"],
+        sha256: Optional[str],
+        flow: Optional["Flow"] = None,
+    ) -> str:
+        if sha256:
+            path = self._verified(sha256.lower())
+            if path:
+                self._hit(url, path, sha256.lower())
+                return path
+        else:
+            path = self.lookup(url)
+            if path and self._not_modified(url):
+                self._hit(url, path)
+                return path
+
+        return self._download(url, progress, sha256, flow)
+
+    def _verified(self, sha256: str) -> Optional[str]:
+        """Cached object for sha256 if its content is still intact"""
+        path = self.object_path(sha256)
+        if not os.path.isfile(path):
+            return None
+        if file_sha256(path) == sha256:
+            return path
+        # Corrupted on disk, drop it and download again
+        os.remove(path)
+        return None
+
+    def _hit(self, url: str, path: str, sha256: Optional[str] = None):
+        with self._lock:
+            entry = self._index.get(url)
+            if entry is None or (sha256 and entry["sha256"] != sha256):
+                entry = self._index[url] = {
+                    "sha256": sha256,
+                    "size": os.path.getsize(path),
+                    "etag": None,
+                    "last_modified": None,
+                }
+            entry["last_used"] = time.time()
+            self.stats.hits += 1
+            self.stats.bytes_served += entry["size"]
+            self._save_index()
+
+    def _not_modified(self, url: str) -> bool:
+        import urllib.error
+
+        from lib.httpclient import request
+
+        with self._lock:
+            entry = dict(self._index[url])
+
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        if not headers:
+            return False
+
+        try:
+            # Not retried, offline the cached copy is used right away
+            with request("HEAD", url, headers, timeout=self.timeout, retries=0) as resp:
+                return resp.status == 304
+        except urllib.error.HTTPError as e:
+            return e.code == 304
+        except OSError:
+            # Offline: a cached copy is better than failing the install
+            return True
+
+    def _download(
+        self,
+        url: str,
+        progress: Optional["ProgressCallback"],
+        expected_sha256: Optional[str] = None,
+        flow: Optional["Flow"] = None,
+    ) -> str:
+        import hashlib
+
+        from lib.download import Downloader
+        from lib.peer import with_peer
+
+        # One partial file per URL so an interrupted download can resume
+        tmp = os.path.join(self.tmp_dir, hashlib.sha256(url.encode()).hexdigest())
+
+        def run(source: str) -> Downloader:
+            downloader = Downloader(
+                source, tmp, progress=progress, sha256=expected_sha256, flow=flow
+            )
+            downloader.run()
+            return downloader
+
+        downloader = with_peer(self.peer, url, expected_sha256, run)
+
+        sha256 = downloader.sha256 or file_sha256(tmp)
+        size = os.path.getsize(tmp)
+        path = self.object_path(sha256)
+        os.replace(tmp, path)
+
+        with self._lock:
+            self.stats.misses += 1
+            self.stats.bytes_downloaded += size
+            self._index[url] = {
+                "sha256": sha256,
+                "size": size,
+                "etag": downloader.etag,
+                "last_modified": downloader.last_modified,
+                "last_used": time.time(),
+            }
+            self._evict(keep=sha256)
+            self._save_index()
+        return path
+
+    def _evict(self, keep: str):
+        """Drop least recently used objects until the cache fits (lock held)"""
+        # Several URLs may share one object, it is as recent as its newest user
+        objects: Dict[str, dict] = {}
+        for url, entry in self._index.items():
+            obj = objects.setdefault(
+                entry["sha256"], {"size": entry["size"], "last_used": 0, "urls": []}
+            )
+            obj["last_used"] = max(obj["last_used"], entry["last_used"])
+            obj["urls"].append(url)
+
+        total = sum(obj["size"] for obj in objects.values())
+        by_age = sorted(objects.items(), key=lambda kv: kv[1]["last_used"])
+        for sha256, obj in by_age:
+            if total <= self.max_bytes:
+                break
+            if sha256 == keep or self._is_pinned(sha256, obj["urls"]):
+                continue
+            try:
+                os.remove(self.object_path(sha256))
+            except FileNotFoundError:
+                pass
+            for url in obj["urls"]:
+                del self._index[url]
+            total -= obj["size"]
+            self.stats.evictions += 1
+
+    def _is_pinned(self, sha256: str, urls) -> bool:
+        return sha256 in self._pins or any(url in self._pins for url in urls)
+
+    def _load_index(self) -> Dict[str, dict]:
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._index, f, indent=2)
+        os.replace(tmp, self.index_path)
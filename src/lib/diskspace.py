@@ -0,0 +1,260 @@
+"""
+Disk-space admission control.
+
+Installing a DMG needs room for the image where it is downloaded plus the
+expanded .app in /Applications. Before a DMG is downloaded its needs are
+estimated from the Content-Length and from how much the same (or any)
+DMG expanded in earlier runs, and reserved with the AdmissionController.
+
+A reservation is only granted while `shutil.disk_usage` shows the space
+free after subtracting everything already reserved on that filesystem
+and a safety margin. Background downloads wait in FIFO order until
+earlier installs release their space; foreground steps fail with
+InsufficientSpace before writing anything. Reservations are held until
+the DMG's install finishes, so the estimate stays conservative while
+files are still being written.
+
+Background downloads don't finish in install order, so a later DMG can
+hold the space an earlier one is waiting for, and it only gives it back
+after its own install. When the installer reaches a DMG whose download
+is still waiting, it abandons the wait and tries in the foreground
+instead, which fails with InsufficientSpace rather than waiting forever.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Optional, Set, Tuple
+
+from utils.errors import InsufficientSpace
+
+DEFAULT_SIZES = os.path.expanduser(
+    "~/Library/Application Support/macbook-init/sizes.json"
+)
+SIZES_ENV = "MACBOOK_INIT_SIZES"
+DEFAULT_MIN_FREE = 1024**3
+# Expanded .app size relative to the DMG when there is no history yet
+DEFAULT_EXPANSION = 3.0
+
+
+@dataclass
+class SpaceEstimate:
+    download: int = 0
+    install: int = 0
+
+
+def probe_size(url: str, timeout: float = 10) -> Optional[int]:
+    """Content-Length of url from a HEAD request, None if unknown"""
+    from lib.httpclient import request
+
+    try:
+        with request("HEAD", url, timeout=timeout, retries=0) as resp:
+            length = resp.headers.get("Content-Length")
+    except OSError:
+        return None
+    return int(length) if length and length.isdigit() else None
+
+
+def tree_size(path: str) -> int:
+    """Bytes used by the regular files under path, symlinks not followed"""
+    total = 0
+    stack = [path]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+
+class SizeHistory:
+    """Download and installed sizes of DMGs from earlier runs"""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or os.environ.get(SIZES_ENV) or DEFAULT_SIZES
+        self._lock = threading.Lock()
+        self._sizes: Dict[str, dict] = self._load()
+
+    def estimate(self, url: str, download: Optional[int]) -> SpaceEstimate:
+        with self._lock:
+            known = self._sizes.get(url)
+            ratios = [
+                s["installed"] / s["download"]
+                for s in self._sizes.values()
+                if s.get("download")
+            ]
+        if not download and known:
+            download = known["download"]
+        download = download or 0
+
+        if known and known.get("download"):
+            # Same DMG before, scale in case a new version grew
+            install = known["installed"] * download / known["download"]
+        else:
+            import statistics
+
+            expansion = statistics.median(ratios) if ratios else DEFAULT_EXPANSION
+            install = download * expansion
+        return SpaceEstimate(download=download, install=int(install))
+
+    def record(self, url: str, download: int, installed: int):
+        with self._lock:
+            self._sizes[url] = {
+                "download": download,
+                "installed": installed,
+                "recorded_at": time.time(),
+            }
+            self._save()
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._sizes, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+def _existing(path: str) -> str:
+    # The target may not exist yet, its nearest existing parent decides
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+
+def _device(path: str) -> int:
+    return os.stat(_existing(path)).st_dev
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        min_free: int = DEFAULT_MIN_FREE,
+        history: Optional[SizeHistory] = None,
+        disk_usage: Optional[Callable] = None,
+    ) -> None:
+        import shutil
+
+        self.min_free = min_free
+        self.history = history or SizeHistory()
+        self._disk_usage = disk_usage or shutil.disk_usage
+        # key -> {path: bytes}
+        self._held: Dict[str, Dict[str, int]] = {}
+        self._queue: Deque[str] = deque()
+        self._abandoned: Set[str] = set()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def held(self, key: str) -> bool:
+        with self._cond:
+            return key in self._held
+
+    def headroom(self, path: str, exclude: Optional[str] = None) -> int:
+        """Bytes that can still be written to path's filesystem"""
+        with self._cond:
+            return self._headroom(path, exclude)
+
+    def acquire(self, key: str, needs: Dict[str, int], wait: bool = True):
+        """
+        Reserve needs (path -> bytes) under key. With wait, queue behind
+        earlier callers until enough space is released; without, or when
+        nothing is left to wait for, raise InsufficientSpace.
+        """
+        with self._cond:
+            if key in self._held:
+                return
+            if not wait:
+                self._check(key, needs)
+                self._held[key] = dict(needs)
+                return
+
+            self._queue.append(key)
+            try:
+                while True:
+                    if self._closed:
+                        raise InsufficientSpace(
+                            f"Stopped waiting for disk space: {key}"
+                        )
+                    if key in self._abandoned:
+                        raise InsufficientSpace(
+                            f"Gave up waiting for disk space in the background: {key}"
+                        )
+                    if self._queue[0] == key:
+                        if self._fits(needs):
+                            self._held[key] = dict(needs)
+                            return
+                        if not self._held:
+                            self._check(key, needs)
+                    self._cond.wait()
+            finally:
+                self._queue.remove(key)
+                self._cond.notify_all()
+
+    def release(self, key: str):
+        with self._cond:
+            if self._held.pop(key, None) is not None:
+                self._cond.notify_all()
+
+    def abandon(self, key: str):
+        """Make a waiting acquire() of key give up, no effect once it's held"""
+        with self._cond:
+            if key not in self._held:
+                self._abandoned.add(key)
+                self._cond.notify_all()
+
+    def close(self):
+        """Make every waiting acquire() give up, e.g. when the run is aborted"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def check(self, key: str, needs: Dict[str, int]):
+        """Raise InsufficientSpace unless needs fit next to key's own reservation"""
+        with self._cond:
+            self._check(key, needs, exclude=key)
+
+    def _check(self, key: str, needs: Dict[str, int], exclude: Optional[str] = None):
+        for path, need in _per_device(needs).values():
+            room = self._headroom(path, exclude)
+            if need > room:
+                raise InsufficientSpace(
+                    f"{key} needs {need / 1024**2:.0f} MB on the disk holding "
+                    f"{path}, only {max(room, 0) / 1024**2:.0f} MB available"
+                )
+
+    def _fits(self, needs: Dict[str, int]) -> bool:
+        return all(
+            need <= self._headroom(path) for path, need in _per_device(needs).values()
+        )
+
+    def _headroom(self, path: str, exclude: Optional[str] = None) -> int:
+        device = _device(path)
+        reserved = sum(
+            need
+            for key, held in self._held.items()
+            if key != exclude
+            for p, need in held.items()
+            if _device(p) == device
+        )
+        return self._disk_usage(_existing(path)).free - reserved - self.min_free
+
+
+def _per_device(needs: Dict[str, int]) -> Dict[int, Tuple[str, int]]:
+    """Needs summed per filesystem, e.g. a download and an install on one disk"""
+    totals: Dict[int, Tuple[str, int]] = {}
+    for path, need in needs.items():
+        device = _device(path)
+        first, total = totals.get(device, (path, 0))
+        totals[device] = (first, total + need)
+    return totals
@@ -2,83 +2,290 @@ import subprocess
 import re
 import tempfile
 import os
-import urllib.request
+import plistlib
 import shutil
 import time
-import sys
-from typing import Optional
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, List, Optional, Tuple
 
-from lib.tui import confirm, console
-from utils.errors import UserCancelled
+from lib.apparchive import extract_tar, extract_zip, installed_apps, zip_app_size
+from lib.bandwidth import DEFAULT_PRIORITY, DEFAULT_WEIGHT, bandwidth
+from lib.diskspace import probe_size, tree_size
+from lib.download import download
+from lib.events import traced
+from lib.fastcopy import copy_tree
+from lib.manifest import TAR, ZIP, archive_kind
+from lib.plan import dmg_key
+from lib.tarball import ExtractStats, open_source
+from lib.tui import confirm, console, progress
+from utils.errors import ArchiveError, ChecksumError, UserCancelled
+
+if TYPE_CHECKING:
+    from lib.bundle import Bundle
+    from lib.cache import ArtifactCache
+    from lib.diskspace import AdmissionController
+    from lib.peer import PeerCache
+    from lib.plan import Plan
+
+DEFAULT_APPLICATIONS_DIR = "/Applications"
+APPLICATIONS_ENV = "MACBOOK_INIT_APPLICATIONS"
+
+
+def _span_args(dmg: "DmgManagement", *args, **kwargs):
+    return {"dmg": dmg.dmg_name}
+
+
+def parse_attach_plist(output: bytes) -> List[Tuple[str, str]]:
+    """(dev-entry, mount-point) of every volume `hdiutil attach -plist` mounted"""
+    try:
+        entities = plistlib.loads(output).get("system-entities", [])
+    except (plistlib.InvalidFileException, ValueError, AttributeError) as e:
+        raise RuntimeError(f"Could not parse hdiutil output: {e}")
+    return [
+        (e["dev-entry"], e["mount-point"])
+        for e in entities
+        if isinstance(e, dict) and e.get("dev-entry") and e.get("mount-point")
+    ]
+
+
+def _whole_disk(dev_entry: str) -> str:
+    """/dev/disk4s2 -> /dev/disk4"""
+    match = re.match(r"/dev/disk\d+", dev_entry)
+    return match.group(0) if match else dev_entry
 
 
 class DmgManagement:
-    def __init__(self, url: str, show_dialog: bool = False) -> None:
+    def __init__(
+        self,
+        url: str,
+        show_dialog: bool = False,
+        prefetched: Optional["Future[Tuple[str, str]]"] = None,
+        cache: Optional["ArtifactCache"] = None,
+        sha256: Optional[str] = None,
+        plan: Optional["Plan"] = None,
+        applications_dir: Optional[str] = None,
+        admission: Optional["AdmissionController"] = None,
+        bundle: Optional["Bundle"] = None,
+        peer: Optional["PeerCache"] = None,
+        fast_mount: bool = False,
+        mount_root: Optional[str] = None,
+        priority: int = DEFAULT_PRIORITY,
+        weight: float = DEFAULT_WEIGHT,
+    ) -> None:
         self.url = url
+        self.sha256 = sha256
         self.show_dialog = show_dialog
+        self.plan = plan
+        self.prefetched = prefetched
+        self.cache = cache
+        self.applications_dir = (
+            applications_dir
+            or os.environ.get(APPLICATIONS_ENV)
+            or DEFAULT_APPLICATIONS_DIR
+        )
+        self.admission = admission
+        # Installing from an offline bundle: the DMG is extracted, not fetched
+        self.bundle = bundle
+        # Asked first without a cache; with one, the cache asks it
+        self.peer = peer
+        # Attach without Finder and, once the checksum passed, without
+        # hdiutil re-reading the whole image to verify it
+        self.fast_mount = fast_mount
+        self.mount_root = mount_root
+        # Set once the DMG matched its pinned sha256
+        self.verified = False
+        self.download_bytes = 0
         self.tmpdir: Optional[str] = None
+        self.flow = bandwidth.flow(os.path.basename(url), priority, weight)
         self.dmg_path: Optional[str] = None
         self.dmg_name: str = os.path.basename(self.url)
+        # A .zip or .tar.xz holding the app instead of a DMG
+        self.archive = archive_kind(self.url)
         self.disk_id: Optional[str] = None
         self.mount_point: Optional[str] = None
 
+    @traced("dmg.install", "dmg", args=_span_args)
     def run(self):
         console.box(f"Download and install {self.dmg_name}", color="bright_blue")
-        self.download_dmg()
-        self.mount_dmg()
-        self.copy_to_applications()
-        self.detach()
-        self.cleanup()
+        try:
+            if self.archive == TAR:
+                self.stream_archive()
+            else:
+                self.download_dmg()
+                if self.archive == ZIP:
+                    self.extract_archive()
+                else:
+                    self.mount_dmg()
+                    self.copy_to_applications()
+                    self.detach()
+                self.cleanup()
+        finally:
+            if self.admission is not None:
+                self.admission.release(self.url)
         console.success("Installation finished successfully!")
 
-    def _confirm(self, msg: str, result=False):
-        """Ask user for confirmation before continuing"""
-        if not self.show_dialog:
-            return
-
-        ans = confirm(prompt=msg)
+    def _confirm(self, msg: str, result=False, step: Optional[str] = None):
+        """
+        Ask user for confirmation before continuing. With a plan the answer
+        given up front for this step is used instead of prompting.
+        """
+        if self.plan is not None and step:
+            ans = self.plan.approved(dmg_key(self.url, step))
+        elif not self.show_dialog:
+            return True
+        else:
+            ans = confirm(prompt=msg)
         if result:
             return ans
         if not ans:
             raise UserCancelled(f"User cancelled: {msg}")
 
-    def _progress_hook(self, block_num, block_size, total_size):
-        downloaded = block_num * block_size
-        percent = min(downloaded / total_size * 100, 100)
-        # Carriage return '\r' keeps it on the same line
-        # sys.stdout.write(f"\rDownloading: {percent:.2f}%")
-        console.progress(percent, 100, color="bright_green")
-        sys.stdout.flush()
-
+    @traced("dmg.download", "dmg", args=_span_args)
     def download_dmg(self):
         # 1. Confirm download
         console.warning(f"Download DMG from: \n{self.url}")
-        self._confirm("Proceed to download DMG? ")
+        try:
+            self._confirm("Proceed to download DMG? ", step="download")
+        except UserCancelled:
+            self._discard_prefetched()
+            raise
 
+        if not self._use_prefetched():
+            self._admit()
+            bar = progress.add(self.dmg_name)
+            try:
+                self._fetch(reporthook=bar)
+            finally:
+                progress.finish(bar)
+        if self.dmg_path and os.path.isfile(self.dmg_path):
+            self.download_bytes = os.path.getsize(self.dmg_path)
+        console.success("Download complete.\n")
+
+    def prefetch(self, label: str) -> Tuple[str, str]:
+        """Download in the background once disk space is admitted
+
+        Waits for earlier installs to free up space, the installer releases it
+        after taking over the returned (tmpdir, dmg_path).
+        """
+        self._admit(wait=True)
+        bar = progress.add(label)
+        try:
+            return self._fetch(reporthook=bar)
+        except BaseException:
+            if self.admission is not None:
+                self.admission.release(self.url)
+            raise
+        finally:
+            progress.finish(bar)
+
+    def _admit(self, wait: bool = False):
+        """Reserve disk space for the download and the installed app"""
+        if self.admission is None or self.admission.held(self.url):
+            return
+        cached = self.cache.lookup(self.url) if self.cache is not None else None
+        if self.bundle is not None:
+            size: Optional[int] = self.bundle.size(self.url)
+        else:
+            size = os.path.getsize(cached) if cached else probe_size(self.url)
+        estimate = self.admission.history.estimate(self.url, size)
+        download_dir = (
+            self.cache.root if self.cache is not None else tempfile.gettempdir()
+        )
+        # A tar archive is extracted as it arrives, nothing is downloaded to disk
+        needs = {
+            download_dir: 0 if cached or self.archive == TAR else estimate.download,
+            self.applications_dir: estimate.install,
+        }
+        self.admission.acquire(self.url, needs, wait=wait)
+
+    def _fetch(self, reporthook=None) -> Tuple[str, str]:
+        """Download the DMG into a fresh temp dir without any prompts"""
         self.tmpdir = tempfile.mkdtemp(prefix="dmgdl_")
         self.dmg_path = os.path.join(self.tmpdir, self.dmg_name)
-        console.info(f"Downloading {self.url} -> {self.dmg_path}")
-        urllib.request.urlretrieve(
-            self.url, self.dmg_path, reporthook=self._progress_hook
-        )
+        if self.bundle is not None:
+            self.bundle.extract(
+                self.url, self.dmg_path, progress=reporthook, sha256=self.sha256
+            )
+        elif self.cache is not None:
+            # A link to the cached object, cleanup() must not touch the object
+            self.cache.fetch_to(
+                self.url,
+                self.dmg_path,
+                progress=reporthook,
+                sha256=self.sha256,
+                flow=self.flow,
+            )
+        else:
+            from lib.peer import with_peer
+
+            console.info(f"Downloading {self.url} -> {self.dmg_path}")
+            with_peer(
+                self.peer,
+                self.url,
+                self.sha256,
+                lambda source: download(
+                    source,
+                    self.dmg_path,
+                    progress=reporthook,
+                    sha256=self.sha256,
+                    flow=self.flow,
+                ),
+            )
+        # Every source above raises ChecksumError rather than return a mismatch
+        self.verified = self.sha256 is not None
 
         # Set quarantine attribute
         quarantine_value = f"0081;{hex(int(time.time()))[2:]};Python;"
         os.system(
             f'xattr -w com.apple.quarantine "{quarantine_value}" "{self.dmg_path}"'
         )
+        return self.tmpdir, self.dmg_path
 
-        console.success("Download complete.\n")
+    def _use_prefetched(self) -> bool:
+        """Take over the file from a background download if there is one"""
+        if self.prefetched is None:
+            return False
+
+        if not self.prefetched.done():
+            if self.prefetched.cancel():
+                return False
+            if self.admission is not None and not self.admission.held(self.url):
+                # Only later installs would free the space it's waiting for
+                self.admission.abandon(self.url)
+            console.info(f"Waiting for background download of {self.dmg_name}...")
+        try:
+            self.tmpdir, self.dmg_path = self.prefetched.result()
+        except ChecksumError:
+            raise
+        except Exception as e:
+            console.warning(f"Background download failed ({e}), retrying...")
+            return False
+        # The background download checked the same pinned sha256
+        self.verified = self.sha256 is not None
+        console.info(f"Using prefetched {self.dmg_path}")
+        return True
 
+    def _discard_prefetched(self):
+        if self.prefetched is None:
+            return
+        if not self.prefetched.cancel() and self.prefetched.exception() is None:
+            tmpdir, _ = self.prefetched.result()
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    @traced("dmg.mount", "dmg", args=_span_args)
     def mount_dmg(self):
         if not self.dmg_path:
             raise Exception("DMG does not exists, please download dmg file first")
 
-        ans = self._confirm(f"Mount DMG: {self.dmg_name}?", result=True)
+        ans = self._confirm(f"Mount DMG: {self.dmg_name}?", result=True, step="mount")
         if not ans:
             self.cleanup()
             raise UserCancelled("User cancelled at mount dmg")
         console.info("Mounting DMG...")
+        if self.fast_mount:
+            self._fast_attach()
+            console.success(f"Mounted at: {self.mount_point}\n")
+            return
         result = subprocess.run(
             ["hdiutil", "attach", self.dmg_path],
             capture_output=True,
@@ -89,7 +296,7 @@ class DmgManagement:
 
         # Extract disk and mount point
         disk_match = re.search(r"(/dev/disk\d+)", result.stdout)
-        mount_match = re.search(r"(/Volumes/.*)", result.stdout)
+        mount_match = re.search(r"(\S*/Volumes/.*)", result.stdout)
 
         if not disk_match or not mount_match:
             raise RuntimeError("Could not determine disk or mount point.")
@@ -98,6 +305,35 @@ class DmgManagement:
         self.mount_point = mount_match.group(1).strip()
         console.success(f"Mounted at: {self.mount_point}\n")
 
+    def attach_args(self) -> List[str]:
+        """The fast-mount `hdiutil attach` command line"""
+        assert self.dmg_path is not None
+        args = ["hdiutil", "attach", "-nobrowse", "-readonly", "-plist"]
+        if self.verified:
+            # hdiutil's own verification reads the whole image again
+            args.append("-noverify")
+        if self.mount_root:
+            args += ["-mountroot", self.mount_root]
+        return args + [self.dmg_path]
+
+    def _fast_attach(self):
+        if self.mount_root:
+            os.makedirs(self.mount_root, exist_ok=True)
+        result = subprocess.run(self.attach_args(), capture_output=True, check=True)
+        volumes = parse_attach_plist(result.stdout)
+        if not volumes:
+            raise RuntimeError("Could not determine disk or mount point.")
+
+        # Images with several partitions mount several volumes, the app is on one
+        dev_entry, mount_point = volumes[0]
+        for dev, mount in volumes:
+            if any(f.endswith(".app") for f in os.listdir(mount)):
+                dev_entry, mount_point = dev, mount
+                break
+        self.disk_id = _whole_disk(dev_entry)
+        self.mount_point = mount_point
+
+    @traced("dmg.copy", "dmg", args=_span_args)
     def copy_to_applications(self):
         if not self.mount_point:
             raise Exception(
@@ -109,20 +345,24 @@ class DmgManagement:
 
         app_name = apps[0]
         src_app_path = os.path.join(self.mount_point, app_name)
-        dest_app_path = f"/Applications/{app_name}"
+        dest_app_path = os.path.join(self.applications_dir, app_name)
 
         console.info(f"Found app: {src_app_path}")
         console.warning(f"Copy {app_name} to Destination: {dest_app_path}")
-        ans = self._confirm("Continue?", result=True)
+        ans = self._confirm("Continue?", result=True, step="copy")
         if not ans:
             self.detach()
             self.cleanup()
             raise UserCancelled("User cancelled at copy to Applications")
 
+        self._check_space(src_app_path, dest_app_path)
+
         # Remove old version if exists
         if os.path.exists(dest_app_path):
             ans = self._confirm(
-                "App already exists in /Applications. Replace it?", result=True
+                "App already exists in /Applications. Replace it?",
+                result=True,
+                step="replace",
             )
             if not ans:
                 self.detach()
@@ -130,27 +370,127 @@ class DmgManagement:
                 raise UserCancelled("User cancelled at replace existing Applications")
             shutil.rmtree(dest_app_path)
 
-        shutil.copytree(src_app_path, dest_app_path)
-        console.success("Copied successfully.\n")
+        stats = copy_tree(src_app_path, dest_app_path)
+        if self.admission is not None and self.download_bytes:
+            self.admission.history.record(self.url, self.download_bytes, stats.bytes)
+        console.success(
+            f"Copied {stats.files} files ({stats.bytes / 1024**2:.1f} MB) successfully.\n"
+        )
+
+    def _check_space(self, src_app_path: str, dest_app_path: str):
+        """Fail before touching /Applications rather than leave a half-copied app"""
+        if self.admission is None:
+            return
+        need = tree_size(src_app_path)
+        if os.path.exists(dest_app_path):
+            # The old version is removed before copying
+            need -= tree_size(dest_app_path)
+        self.admission.check(self.url, {self.applications_dir: max(need, 0)})
+
+    @traced("dmg.extract", "dmg", args=_span_args)
+    def stream_archive(self):
+        """Download a tar archive and extract its app in the same pass"""
+        console.warning(f"Download and extract: \n{self.url}")
+        self._confirm("Proceed to download the archive? ", step="download")
+        self._confirm(f"Extract the app into {self.applications_dir}?", step="copy")
+        self._admit()
+        staging = self._staging_dir()
+        bar = progress.add(self.dmg_name)
+        try:
+            try:
+                with open_source(
+                    self.url, self.sha256, bar, self.bundle, self.peer, self.flow
+                ) as stream:
+                    stats = extract_tar(stream, staging)
+                    stream.verify()
+                    stats.downloaded = self.download_bytes = stream.bytes_read
+            finally:
+                progress.finish(bar)
+            self._install_apps(staging, stats)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    @traced("dmg.extract", "dmg", args=_span_args)
+    def extract_archive(self):
+        """Extract the app from a downloaded zip archive"""
+        if not self.dmg_path:
+            raise Exception("Archive does not exist, please download it first")
+        console.warning(f"Extract {self.dmg_name} into {self.applications_dir}")
+        ans = self._confirm("Continue?", result=True, step="copy")
+        if not ans:
+            self.cleanup()
+            raise UserCancelled("User cancelled at extract to Applications")
+        if self.admission is not None:
+            self.admission.check(
+                self.url, {self.applications_dir: zip_app_size(self.dmg_path)}
+            )
+
+        staging = self._staging_dir()
+        try:
+            stats = extract_zip(self.dmg_path, staging)
+            self._install_apps(staging, stats)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def _staging_dir(self) -> str:
+        """Hidden, on the same volume as the apps, so they are renamed into place"""
+        staging = os.path.join(
+            self.applications_dir, f".{self.dmg_name}.{os.getpid()}.tmp"
+        )
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        return staging
+
+    def _install_apps(self, staging: str, stats: ExtractStats):
+        apps = installed_apps(staging)
+        if not apps:
+            raise ArchiveError(f"No .app found inside {self.dmg_name}.")
+
+        for app_name in apps:
+            dest_app_path = os.path.join(self.applications_dir, app_name)
+            if os.path.lexists(dest_app_path):
+                ans = self._confirm(
+                    "App already exists in /Applications. Replace it?",
+                    result=True,
+                    step="replace",
+                )
+                if not ans:
+                    raise UserCancelled(
+                        "User cancelled at replace existing Applications"
+                    )
+                shutil.rmtree(dest_app_path)
+            os.replace(os.path.join(staging, app_name), dest_app_path)
+            console.info(f"Installed {dest_app_path}")
+
+        if self.admission is not None and self.download_bytes:
+            self.admission.history.record(self.url, self.download_bytes, stats.written)
+        console.success(
+            f"Extracted {stats.files} files ({stats.written / 1024**2:.1f} MB) "
+            "successfully.\n"
+        )
 
+    @traced("dmg.detach", "dmg", args=_span_args)
     def _force_detach(self):
         console.info("Detaching …")
-        proc = subprocess.run(["hdiutil", "detach", self.mount_point])
+        # The whole disk, so images with several partitions are detached too
+        target = self.disk_id or self.mount_point
+        proc = subprocess.run(["hdiutil", "detach", target])
         if proc.returncode == 0:
             console.success("Detached cleanly.\n")
             return
 
         console.warning("Normal detach failed, forcing detach …")
         time.sleep(1)
-        subprocess.run(["hdiutil", "detach", self.mount_point, "-force"])
+        subprocess.run(["hdiutil", "detach", target, "-force"])
         console.success("Force-detached.\n")
 
     def detach(self):
-        self._confirm("Ready to unmount the DMG?")
+        self._confirm("Ready to unmount the DMG?", step="detach")
         self._force_detach()
 
+    @traced("dmg.cleanup", "dmg", args=_span_args)
     def cleanup(self):
-        self._confirm("Delete temporary download files?")
+        self._confirm("Delete temporary download files?", step="cleanup")
         shutil.rmtree(self.tmpdir)
         console.success("Cleanup complete.\n")
 
@@ -0,0 +1,440 @@
+"""
+Segmented, resumable HTTP downloads.
+
+When the server supports byte ranges the file is split into segments that
+are fetched in parallel into a preallocated `.part` file. Progress of every
+segment is kept in a sidecar `.state.json`, so a dropped connection (or a
+killed process) resumes from the last written byte instead of byte zero.
+Servers without range support fall back to a single stream.
+
+The SHA-256 of the content is computed while it is written, so checksum
+verification needs no separate pass over the file.
+
+`open_stream` is for content that is consumed as it arrives (tarballs
+extracted on the fly): same hashing and progress, nothing on disk.
+
+Requests go through the shared keep-alive client in lib.httpclient, so the
+segments reuse the connection of the size probe and of earlier downloads
+from the same host.
+"""
+
+import hashlib
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING, Callable, List, Optional
+
+from lib.httpclient import backoff, is_transient, request
+from utils.errors import ChecksumError, DownloadError
+
+if TYPE_CHECKING:
+    from lib.bandwidth import Flow
+
+DEFAULT_SEGMENTS = 4
+CHUNK_SIZE = 64 * 1024
+# Files smaller than this per segment are not worth extra connections
+MIN_SEGMENT_SIZE = 1024 * 1024
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".state.json"
+STATE_SAVE_INTERVAL = 1.0
+
+ProgressCallback = Callable[[int, int], None]
+
+_RETRYABLE = (OSError, http.client.HTTPException, DownloadError)
+
+
+def _retryable(error: BaseException) -> bool:
+    """A broken segment is retried, unless the server refused it for good"""
+    if isinstance(error, urllib.error.HTTPError):
+        return is_transient(error)
+    return True
+
+
+@dataclass
+class Segment:
+    start: int
+    end: int  # inclusive
+    done: int = 0
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start + 1
+
+
+def _write_all(f, chunk: bytes):
+    view = memoryview(chunk)
+    while view:
+        view = view[f.write(view) :]
+
+
+class _InlineHasher:
+    """
+    SHA-256 over a file whose segments are written concurrently.
+
+    Bytes at the hash cursor are hashed straight from memory in the write
+    loop. Bytes written ahead of the cursor by later segments are hashed
+    from the (still hot) page cache once the cursor catches up with them.
+    """
+
+    def __init__(self, path: str, segments: List[Segment]) -> None:
+        self.path = path
+        self.segments = sorted(segments, key=lambda s: s.start)
+        self.cursor = 0
+        self._hash = hashlib.sha256()
+        self._lock = threading.Lock()
+
+    def feed(self, offset: int, chunk: bytes):
+        """Call after chunk is on disk and before its segment's done is bumped"""
+        with self._lock:
+            if offset != self.cursor:
+                return
+            self._hash.update(chunk)
+            self.cursor += len(chunk)
+            self._catch_up()
+
+    def catch_up(self):
+        with self._lock:
+            self._catch_up()
+
+    def _catch_up(self):
+        for seg in self.segments:
+            if not (seg.start <= self.cursor <= seg.end):
+                continue
+            written = seg.start + seg.done
+            if self.cursor >= written:
+                return
+            with open(self.path, "rb") as f:
+                f.seek(self.cursor)
+                while self.cursor < written:
+                    data = f.read(min(CHUNK_SIZE * 16, written - self.cursor))
+                    self._hash.update(data)
+                    self.cursor += len(data)
+            if self.cursor <= seg.end:
+                return
+
+    def hexdigest(self) -> str:
+        with self._lock:
+            self._catch_up()
+            return self._hash.hexdigest()
+
+
+def _total_size(resp) -> Optional[int]:
+    content_range = resp.headers.get("Content-Range")
+    if resp.status == 206 and content_range and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1].strip()
+        return int(total) if total.isdigit() else None
+    length = resp.headers.get("Content-Length")
+    return int(length) if length and length.isdigit() else None
+
+
+class Downloader:
+    def __init__(
+        self,
+        url: str,
+        dest: str,
+        segments: int = DEFAULT_SEGMENTS,
+        progress: Optional[ProgressCallback] = None,
+        retries: int = 3,
+        timeout: float = 30,
+        chunk_size: int = CHUNK_SIZE,
+        sha256: Optional[str] = None,
+        flow: Optional["Flow"] = None,
+    ) -> None:
+        self.url = url
+        self.dest = dest
+        self.segments = max(1, segments)
+        self.progress = progress
+        self.retries = retries
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.part_path = dest + PART_SUFFIX
+        self.state_path = dest + STATE_SUFFIX
+        self.expected_sha256 = sha256.lower() if sha256 else None
+        # This download's share of the bandwidth cap, if there is one
+        self.flow = flow
+
+        # Hex SHA-256 of the downloaded content, set by run()
+        self.sha256: Optional[str] = None
+        # Validators of the downloaded content, for conditional requests
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+
+        self._lock = threading.Lock()
+        self._downloaded = 0
+        self._total = 0
+        self._last_save = 0.0
+
+    def _open(self, url: str, headers: Optional[dict] = None, retries: int = 0):
+        return request("GET", url, headers, timeout=self.timeout, retries=retries)
+
+    def run(self) -> str:
+        """Download the file and return its destination path"""
+        resp = self._open(self.url, {"Range": "bytes=0-0"}, retries=self.retries)
+        self.etag = resp.headers.get("ETag")
+        self.last_modified = resp.headers.get("Last-Modified")
+        total = _total_size(resp)
+        accepts = resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+
+        if total is None or not (resp.status == 206 or accepts):
+            if resp.status == 206:
+                # Partial response with unknown size, start over without Range
+                resp.close()
+                resp = self._open(self.url, retries=self.retries)
+            with resp:
+                return self._single(resp, _total_size(resp))
+
+        url = resp.geturl()
+        resp.close()
+        return self._segmented(url, total, self.etag)
+
+    # Single stream fallback
+
+    def _single(self, resp, total: Optional[int]) -> str:
+        self._discard_state()
+        self._total = total or 0
+        digest = hashlib.sha256()
+        with open(self.part_path, "wb") as f:
+            while True:
+                chunk = resp.read(self.chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                digest.update(chunk)
+                self._advance(None, len(chunk))
+                if self.flow is not None:
+                    self.flow.consume(len(chunk))
+
+        if total is not None and self._downloaded != total:
+            raise DownloadError(
+                f"Incomplete download: got {self._downloaded} of {total} bytes"
+            )
+        return self._finish(digest.hexdigest())
+
+    def _finish(self, sha256: str) -> str:
+        self.sha256 = sha256
+        if self.expected_sha256 and sha256 != self.expected_sha256:
+            os.remove(self.part_path)
+            self._discard_state()
+            raise ChecksumError(
+                f"Checksum mismatch for {self.url}: "
+                f"expected {self.expected_sha256}, got {sha256}"
+            )
+        os.replace(self.part_path, self.dest)
+        self._discard_state()
+        return self.dest
+
+    # Segmented download
+
+    def _segmented(self, url: str, total: int, etag: Optional[str]) -> str:
+        self._total = total
+        segments = self._load_state(total, etag)
+        if segments is None:
+            segments = self._plan(total)
+            with open(self.part_path, "wb") as f:
+                f.truncate(total)
+        self._downloaded = sum(s.done for s in segments)
+        self._state = {"url": self.url, "size": total, "etag": etag}
+        self._segments = segments
+        self._save_state(force=True)
+        self._hasher = _InlineHasher(self.part_path, segments)
+        # Bytes from an earlier attempt are only on disk
+        self._hasher.catch_up()
+
+        todo = [s for s in segments if s.done < s.length]
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, len(todo))) as pool:
+                for fut in [pool.submit(self._fetch_segment, url, s) for s in todo]:
+                    fut.result()
+        finally:
+            self._save_state(force=True)
+
+        return self._finish(self._hasher.hexdigest())
+
+    def _plan(self, total: int) -> List[Segment]:
+        count = min(self.segments, max(1, total // MIN_SEGMENT_SIZE))
+        size = total // count
+        segments = []
+        for i in range(count):
+            start = i * size
+            end = total - 1 if i == count - 1 else start + size - 1
+            segments.append(Segment(start=start, end=end))
+        return segments
+
+    def _fetch_segment(self, url: str, seg: Segment):
+        attempt = 0
+        while seg.done < seg.length:
+            try:
+                offset = seg.start + seg.done
+                headers = {"Range": f"bytes={offset}-{seg.end}"}
+                with self._open(url, headers) as resp:
+                    if resp.status != 206:
+                        raise DownloadError("Server ignored the range request")
+                    # Unbuffered, so the hasher can read back what was written
+                    with open(self.part_path, "r+b", buffering=0) as f:
+                        f.seek(offset)
+                        while seg.done < seg.length:
+                            want = min(self.chunk_size, seg.length - seg.done)
+                            chunk = resp.read(want)
+                            if not chunk:
+                                raise DownloadError("Connection closed early")
+                            _write_all(f, chunk)
+                            self._hasher.feed(seg.start + seg.done, chunk)
+                            self._advance(seg, len(chunk))
+                            if self.flow is not None:
+                                self.flow.consume(len(chunk))
+            except _RETRYABLE as e:
+                attempt += 1
+                if attempt > self.retries or not _retryable(e):
+                    raise
+                time.sleep(backoff(attempt))
+
+    def _advance(self, seg: Optional[Segment], n: int):
+        with self._lock:
+            if seg is not None:
+                seg.done += n
+            self._downloaded += n
+            if self.progress:
+                self.progress(self._downloaded, self._total)
+        if seg is not None:
+            self._save_state()
+
+    # Sidecar state
+
+    def _load_state(self, total: int, etag: Optional[str]) -> Optional[List[Segment]]:
+        if not (os.path.isfile(self.state_path) and os.path.isfile(self.part_path)):
+            return None
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            if (
+                state["url"] != self.url
+                or state["size"] != total
+                or state["etag"] != etag
+                or os.path.getsize(self.part_path) != total
+            ):
+                return None
+            return [Segment(**s) for s in state["segments"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _save_state(self, force: bool = False):
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_save < STATE_SAVE_INTERVAL:
+                return
+            self._last_save = now
+            state = dict(self._state, segments=[asdict(s) for s in self._segments])
+            tmp = self.state_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_path)
+
+    def _discard_state(self):
+        for path in (self.state_path, self.state_path + ".tmp"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def download(
+    url: str,
+    dest: str,
+    segments: int = DEFAULT_SEGMENTS,
+    progress: Optional[ProgressCallback] = None,
+    sha256: Optional[str] = None,
+    flow: Optional["Flow"] = None,
+) -> str:
+    """
+    Download url to dest, resuming a previous attempt if possible.
+
+    Raises ChecksumError if sha256 is given and the content does not match.
+    """
+    return Downloader(
+        url, dest, segments=segments, progress=progress, sha256=sha256, flow=flow
+    ).run()
+
+
+class StreamReader:
+    """
+    A response body consumed front to back, e.g. by tarfile's stream mode,
+    instead of being written to disk. It is hashed and reported as it is
+    read; verify() drains whatever the consumer left and checks it.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        resp,
+        progress: Optional[ProgressCallback] = None,
+        sha256: Optional[str] = None,
+        total: Optional[int] = None,
+        flow: Optional["Flow"] = None,
+    ) -> None:
+        self.url = url
+        # Any file object works, e.g. a bundle member, given its size
+        self.total = total if total is not None else _total_size(resp)
+        self.progress = progress
+        self.expected_sha256 = sha256.lower() if sha256 else None
+        self.flow = flow
+        self.bytes_read = 0
+        self._resp = resp
+        self._hash = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self._resp.read(size)
+        if chunk:
+            self._hash.update(chunk)
+            self.bytes_read += len(chunk)
+            if self.progress:
+                self.progress(self.bytes_read, self.total or 0)
+            if self.flow is not None:
+                self.flow.consume(len(chunk))
+        return chunk
+
+    def verify(self) -> str:
+        """Read to the end and return the SHA-256 of the whole body"""
+        while self.read(CHUNK_SIZE):
+            pass
+        if self.total is not None and self.bytes_read != self.total:
+            raise DownloadError(
+                f"Incomplete download: got {self.bytes_read} of {self.total} bytes"
+            )
+        sha256 = self._hash.hexdigest()
+        if self.expected_sha256 and sha256 != self.expected_sha256:
+            raise ChecksumError(
+                f"Checksum mismatch for {self.url}: "
+                f"expected {self.expected_sha256}, got {sha256}"
+            )
+        return sha256
+
+    def close(self):
+        self._resp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def open_stream(
+    url: str,
+    progress: Optional[ProgressCallback] = None,
+    sha256: Optional[str] = None,
+    retries: int = 3,
+    timeout: float = 30,
+    flow: Optional["Flow"] = None,
+) -> StreamReader:
+    """
+    Open url to be read once, front to back. Only opening the connection
+    is retried; a stream that breaks halfway can't be resumed.
+    """
+    resp = request("GET", url, timeout=timeout, retries=retries)
+    return StreamReader(url, resp, progress=progress, sha256=sha256, flow=flow)
@@ -0,0 +1,218 @@
+"""
+Structured run events.
+
+Timed spans and point events are written as JSON lines, one record per
+finished span, so a crashed run still leaves everything up to the crash on
+disk. The records convert to the Chrome trace-event format, which trace
+viewers such as Perfetto or chrome://tracing show as one lane per thread.
+
+Recording is off until `events.open()` is called. While off, a `traced`
+function costs one attribute check and `span()` returns a shared no-op
+context manager.
+
+    python -m lib.events events.jsonl trace.json
+"""
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, TextIO
+
+SPAN = "span"
+EVENT = "event"
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """A timed phase, recorded when the with block exits"""
+
+    __slots__ = ("_stream", "name", "cat", "args", "_ts", "_began")
+
+    def __init__(self, stream: "EventStream", name: str, cat: str, args: dict):
+        self._stream = stream
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def set(self, **args):
+        """Attach more arguments, e.g. sizes only known at the end"""
+        self.args.update(args)
+
+    def __enter__(self):
+        self._ts = time.time()
+        self._began = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record = self._stream._record(SPAN, self.name, self.cat, self.args, self._ts)
+        record["dur"] = time.perf_counter() - self._began
+        if exc_type is not None:
+            record["error"] = f"{exc_type.__name__}: {exc}"
+        self._stream._write(record)
+        return False
+
+
+class EventStream:
+    def __init__(self) -> None:
+        self.enabled = False
+        self.records: Optional[List[dict]] = None
+        self._file: Optional[TextIO] = None
+        self._lock = threading.Lock()
+
+    def open(self, path: Optional[str] = None, keep: bool = False):
+        """
+        Start recording into the JSON-lines file at path and/or, with keep,
+        into `records` for exporting a trace at the end of the run.
+        """
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = open(path, "a")
+        if keep:
+            self.records = []
+        self.enabled = bool(path or keep)
+
+    def close(self):
+        self.enabled = False
+        self.records = None
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def span(self, name: str, cat: str = "run", **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, cat, args)
+
+    def event(self, name: str, cat: str = "run", **args):
+        """Record a point in time, e.g. a task being skipped"""
+        if self.enabled:
+            self._write(self._record(EVENT, name, cat, args, time.time()))
+
+    def _record(self, kind: str, name: str, cat: str, args: dict, ts: float) -> dict:
+        thread = threading.current_thread()
+        return {
+            "type": kind,
+            "name": name,
+            "cat": cat,
+            "ts": ts,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "thread": thread.name,
+            "args": args,
+        }
+
+    def _write(self, record: dict):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + "\n")
+                self._file.flush()
+            if self.records is not None:
+                self.records.append(record)
+
+
+# Shared stream, like `console` and `progress`
+events = EventStream()
+
+
+def traced(
+    name: Optional[str] = None,
+    cat: str = "run",
+    args: Optional[Callable[..., Dict[str, Any]]] = None,
+):
+    """
+    Record every call of the decorated function as a span. args receives
+    the call's arguments and returns the span arguments.
+    """
+
+    def decorate(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*a, **kw):
+            if not events.enabled:
+                return func(*a, **kw)
+            span_args = args(*a, **kw) if args else {}
+            with events.span(span_name, cat, **span_args):
+                return func(*a, **kw)
+
+        return wrapper
+
+    return decorate
+
+
+def read_events(path: str) -> List[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def chrome_trace(records: Iterable[dict]) -> dict:
+    """Convert event records to the Chrome trace-event JSON format"""
+    trace: List[dict] = []
+    threads: Dict[tuple, str] = {}
+    for r in records:
+        threads[(r["pid"], r["tid"])] = r["thread"]
+        item = {
+            "name": r["name"],
+            "cat": r["cat"],
+            "ts": round(r["ts"] * 1e6),
+            "pid": r["pid"],
+            "tid": r["tid"],
+            "args": dict(r["args"]),
+        }
+        if r["type"] == SPAN:
+            item["ph"] = "X"
+            item["dur"] = round(r["dur"] * 1e6)
+            if "error" in r:
+                item["args"]["error"] = r["error"]
+        else:
+            item["ph"] = "i"
+            item["s"] = "t"
+        trace.append(item)
+
+    for (pid, tid), thread in threads.items():
+        trace.append(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": thread},
+            }
+        )
+    return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+
+def write_chrome_trace(records: Iterable[dict], path: str):
+    with open(path, "w") as f:
+        json.dump(chrome_trace(records), f)
+
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        sys.exit("usage: python -m lib.events EVENTS.jsonl TRACE.json")
+    write_chrome_trace(read_events(argv[0]), argv[1])
+
+
+if __name__ == "__main__":
+    main()
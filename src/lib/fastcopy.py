@@ -0,0 +1,203 @@
+"""
+Parallel tree copy for large .app bundles.
+
+The source tree is walked once; directories and symlinks are created
+inline and regular files are copied on a thread pool. Each file uses the
+fastest path the platform offers:
+
+- macOS: copyfile(3) with COPYFILE_CLONE, an APFS clone when source and
+  destination share a volume, otherwise an in-kernel copy. Mode, flags,
+  ACLs and xattrs come along in the same call.
+- Linux: FICLONE reflink, then os.copy_file_range, then os.sendfile,
+  followed by shutil.copystat for permissions, times and xattrs.
+- Anything else: a plain buffered copy plus shutil.copystat.
+
+Directory metadata is applied last so file creation doesn't change it.
+"""
+
+import ctypes
+import ctypes.util
+import fcntl
+import os
+import shutil
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+DEFAULT_WORKERS = min(16, (os.cpu_count() or 4) * 2)
+BUFFER_SIZE = 1024 * 1024
+
+# <copyfile.h>
+_COPYFILE_ACL = 1 << 0
+_COPYFILE_STAT = 1 << 1
+_COPYFILE_XATTR = 1 << 2
+_COPYFILE_DATA = 1 << 3
+_COPYFILE_ALL = _COPYFILE_ACL | _COPYFILE_STAT | _COPYFILE_XATTR | _COPYFILE_DATA
+_COPYFILE_CLONE = 1 << 24
+
+# <linux/fs.h>
+_FICLONE = 0x40049409
+
+
+def _load_copyfile():
+    if sys.platform != "darwin":
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        func = libc.copyfile
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_void_p, ctypes.c_uint]
+    func.restype = ctypes.c_int
+    return func
+
+
+_copyfile = _load_copyfile()
+
+
+@dataclass
+class CopyStats:
+    files: int = 0
+    dirs: int = 0
+    symlinks: int = 0
+    bytes: int = 0
+    methods: Counter = field(default_factory=Counter)
+
+
+class _Copier:
+    def __init__(self) -> None:
+        # Fast paths that failed with "not supported" are not retried
+        self.reflink = sys.platform.startswith("linux")
+        self.copy_file_range = hasattr(os, "copy_file_range")
+        self.sendfile = sys.platform.startswith("linux") and hasattr(os, "sendfile")
+
+    def copy(self, src: str, dst: str, size: int) -> str:
+        """Copy one regular file with its metadata, returns the method used"""
+        if _copyfile is not None:
+            if _copyfile(
+                src.encode(), dst.encode(), None, _COPYFILE_ALL | _COPYFILE_CLONE
+            ):
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err), src)
+            return "copyfile"
+
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            method = self._copy_data(fsrc.fileno(), fdst.fileno(), size)
+        shutil.copystat(src, dst)
+        return method
+
+    def _copy_data(self, infd: int, outfd: int, size: int) -> str:
+        if self.reflink and size:
+            try:
+                fcntl.ioctl(outfd, _FICLONE, infd)
+                return "reflink"
+            except OSError:
+                # Cross-device or filesystem without reflinks
+                self.reflink = False
+
+        if self.copy_file_range and size:
+            try:
+                self._loop(os.copy_file_range, infd, outfd, size)
+                return "copy_file_range"
+            except OSError:
+                self.copy_file_range = False
+                os.lseek(infd, 0, os.SEEK_SET)
+                os.ftruncate(outfd, 0)
+                os.lseek(outfd, 0, os.SEEK_SET)
+
+        if self.sendfile and size:
+            try:
+                offset = 0
+                while offset < size:
+                    sent = os.sendfile(outfd, infd, offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                return "sendfile"
+            except OSError:
+                self.sendfile = False
+                os.ftruncate(outfd, 0)
+                os.lseek(outfd, 0, os.SEEK_SET)
+
+        while True:
+            chunk = os.read(infd, BUFFER_SIZE)
+            if not chunk:
+                break
+            # os.write() may take only part of the chunk
+            view = memoryview(chunk)
+            while view:
+                view = view[os.write(outfd, view) :]
+        return "read/write"
+
+    @staticmethod
+    def _loop(func, infd: int, outfd: int, size: int):
+        remaining = size
+        while remaining > 0:
+            n = func(infd, outfd, remaining)
+            if n == 0:
+                break
+            remaining -= n
+
+
+def _copy_symlink(src: str, dst: str):
+    os.symlink(os.readlink(src), dst)
+    try:
+        shutil.copystat(src, dst, follow_symlinks=False)
+    except (OSError, NotImplementedError):
+        pass
+
+
+def copy_tree(src: str, dst: str, workers: int = DEFAULT_WORKERS) -> CopyStats:
+    """
+    Copy the directory tree src to dst (which must not exist), preserving
+    symlinks, permissions and extended attributes.
+    """
+    stats = CopyStats()
+    lock = threading.Lock()
+    copier = _Copier()
+    dirs: List[Tuple[str, str]] = []
+    files: List[Tuple[str, str, int]] = []
+
+    # Single walk: create the skeleton, collect files for the pool
+    stack = [(src, dst)]
+    while stack:
+        sdir, ddir = stack.pop()
+        os.mkdir(ddir)
+        dirs.append((sdir, ddir))
+        stats.dirs += 1
+        with os.scandir(sdir) as it:
+            for entry in it:
+                target = os.path.join(ddir, entry.name)
+                if entry.is_symlink():
+                    _copy_symlink(entry.path, target)
+                    stats.symlinks += 1
+                elif entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, target))
+                else:
+                    size = entry.stat(follow_symlinks=False).st_size
+                    files.append((entry.path, target, size))
+
+    def copy_one(item: Tuple[str, str, int]):
+        method = copier.copy(*item)
+        with lock:
+            stats.files += 1
+            stats.bytes += item[2]
+            stats.methods[method] += 1
+
+    if files:
+        # Big files first so a single large binary doesn't finish last
+        files.sort(key=lambda f: f[2], reverse=True)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for _ in pool.map(copy_one, files):
+                pass
+
+    # Deepest first, so a read-only parent is locked only after its children
+    for sdir, ddir in reversed(dirs):
+        shutil.copystat(sdir, ddir)
+        if _copyfile is not None:
+            _copyfile(sdir.encode(), ddir.encode(), None, _COPYFILE_XATTR)
+
+    return stats
@@ -0,0 +1,182 @@
+"""
+Native git checkouts.
+
+`git` entries in tasks.json are run by the scheduler next to the bash
+tasks, in their own pool, so every clone runs at once whatever --jobs is.
+
+Each repository is mirrored into the artifact cache under `git/` with
+`git clone --mirror`; later runs only `git fetch` what changed upstream.
+The checkout is a shallow clone of that local mirror (file://, so --depth
+applies), made in a temporary directory next to dest and renamed into
+place, so a failed clone never leaves a half-written checkout behind.
+
+An existing checkout of the same repository that is already on the
+requested branch, tag or commit is left alone after one or two local
+`git rev-parse` calls; one on another ref is fetched and switched.
+
+For offline bundles (lib/bundle.py) the mirror is written out as a
+`git bundle` file, and installs from a bundle clone from that file.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from lib.cache import CACHE_DIR_ENV, DEFAULT_CACHE_DIR
+from lib.events import traced
+from lib.manifest import GitEntry
+from utils.errors import GitError, TaskFailed
+
+if TYPE_CHECKING:
+    from lib.bundle import Bundle
+
+CLONED = "cloned"
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+
+_SHA = re.compile(r"^[0-9a-f]{7,40}$")
+# Entries cloning the same repository share one mirror
+_mirror_locks: Dict[str, threading.Lock] = {}
+_mirror_locks_guard = threading.Lock()
+
+
+def mirror_root(cache_dir: Optional[str] = None) -> str:
+    root = cache_dir or os.environ.get(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR
+    return os.path.join(root, "git")
+
+
+def mirror_path(root: str, repo: str) -> str:
+    name = re.sub(r"\.git$", "", os.path.basename(repo.rstrip("/"))) or "repo"
+    digest = hashlib.sha256(repo.encode()).hexdigest()[:12]
+    return os.path.join(root, f"{name}-{digest}.git")
+
+
+def _git(args: List[str], cwd: Optional[str] = None, check: bool = True) -> str:
+    cmd = ["git", "-c", "advice.detachedHead=false", *args]
+    result = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True)
+    if check and result.returncode != 0:
+        tail = result.stderr.strip().splitlines()[-10:]
+        raise TaskFailed(" ".join(args), result.returncode, tail=tail)
+    return result.stdout.strip() if result.returncode == 0 else ""
+
+
+def _mirror_lock(path: str) -> threading.Lock:
+    with _mirror_locks_guard:
+        return _mirror_locks.setdefault(path, threading.Lock())
+
+
+class GitCheckout:
+    def __init__(
+        self,
+        entry: GitEntry,
+        mirrors: Optional[str] = None,
+        bundle: Optional["Bundle"] = None,
+    ) -> None:
+        """
+        Args:
+            entry: The tasks.json entry
+            mirrors: Directory of bare mirrors, None to clone from the repo
+            bundle: Offline bundle to clone from instead of the network
+        """
+        self.entry = entry
+        self.dest = os.path.abspath(os.path.expanduser(entry.dest))
+        self.mirror = mirror_path(mirrors, entry.repo) if mirrors else None
+        self.bundle = bundle
+
+    @traced("git.checkout", "git", args=lambda self: {"repo": self.entry.repo})
+    def run(self) -> str:
+        """Bring dest to the entry's ref, returns CLONED, UPDATED or UNCHANGED"""
+        if os.path.exists(os.path.join(self.dest, ".git")):
+            if self._at_ref():
+                return UNCHANGED
+            self._update(self._sync_mirror())
+            return UPDATED
+
+        if os.path.isdir(self.dest) and os.listdir(self.dest):
+            raise GitError(f"{self.dest} exists and is not a git checkout")
+        self._clone(self._sync_mirror())
+        return CLONED
+
+    def _at_ref(self) -> bool:
+        origin = _git(["config", "--get", "remote.origin.url"], self.dest, False)
+        if origin != self.entry.repo:
+            raise GitError(
+                f"{self.dest} is a checkout of {origin or 'another repository'}, "
+                f"not {self.entry.repo}"
+            )
+        ref = self.entry.ref
+        if ref is None:
+            return True
+        if _git(["symbolic-ref", "-q", "--short", "HEAD"], self.dest, False) == ref:
+            return True
+        head = _git(["rev-parse", "HEAD"], self.dest)
+        if _SHA.match(ref):
+            return head.startswith(ref)
+        tag = _git(
+            ["rev-parse", "-q", "--verify", f"{ref}^{{commit}}"], self.dest, False
+        )
+        return tag == head
+
+    def write_bundle(self, path: str) -> str:
+        """Bring the mirror up to date and write all of its refs to path"""
+        if self.mirror is None:
+            raise GitError(f"Bundling {self.entry.repo} needs a mirror directory")
+        self._sync_mirror()
+        _git(["--git-dir", self.mirror, "bundle", "create", path, "--all"])
+        return path
+
+    def _sync_mirror(self) -> str:
+        """Where to clone from: the bundle, the fetched mirror or the repo itself"""
+        if self.bundle is not None:
+            # A bundle file: --depth is ignored, it holds the whole history
+            return self.bundle.git_source(self.entry.repo)
+        if self.mirror is None:
+            return self.entry.repo
+        with _mirror_lock(self.mirror):
+            if os.path.isdir(self.mirror):
+                _git(["--git-dir", self.mirror, "fetch", "--prune", "--quiet"])
+            else:
+                os.makedirs(os.path.dirname(self.mirror), exist_ok=True)
+                partial = self.mirror + ".partial"
+                shutil.rmtree(partial, ignore_errors=True)
+                _git(["clone", "--mirror", "--quiet", self.entry.repo, partial])
+                os.replace(partial, self.mirror)
+        return "file://" + self.mirror
+
+    def _depth(self) -> List[str]:
+        return ["--depth", str(self.entry.depth)] if self.entry.depth else []
+
+    def _clone(self, source: str):
+        ref = self.entry.ref
+        parent = os.path.dirname(self.dest)
+        os.makedirs(parent, exist_ok=True)
+        tmp = os.path.join(parent, f".{os.path.basename(self.dest)}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        try:
+            if ref and _SHA.match(ref):
+                # A commit can't be cloned by name, fetch it into an empty repo
+                _git(["init", "--quiet", tmp])
+                _git(["remote", "add", "origin", self.entry.repo], tmp)
+                _git(["fetch", "--quiet", *self._depth(), source, ref], tmp)
+                _git(["checkout", "--quiet", "FETCH_HEAD"], tmp)
+            else:
+                branch = ["--branch", ref] if ref else []
+                _git(["clone", "--quiet", *self._depth(), *branch, source, tmp])
+                if source != self.entry.repo:
+                    _git(["remote", "set-url", "origin", self.entry.repo], tmp)
+            os.replace(tmp, self.dest)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def _update(self, source: str):
+        ref = self.entry.ref
+        assert ref is not None
+        _git(["fetch", "--quiet", *self._depth(), source, ref], self.dest)
+        if _git(["ls-remote", "--heads", source, ref], self.dest):
+            _git(["checkout", "--quiet", "-B", ref, "FETCH_HEAD"], self.dest)
+        else:
+            _git(["checkout", "--quiet", "FETCH_HEAD"], self.dest)
@@ -0,0 +1,421 @@
+"""
+Shared HTTP client with keep-alive connection pools.
+
+urllib opens a new connection for every request, each with its own DNS
+lookup, TCP handshake and, for https, TLS handshake. A segmented download
+alone makes one request to probe the size and one per segment, and most
+artifacts come from a few hosts (GitHub release assets, the peer cache),
+so those handshakes add up.
+
+`client`, the module-level HttpClient, keeps idle connections per
+(scheme, host, port) and hands them out again once a response has been
+read to the end. Redirects are followed on the pool of the host they
+point at, so segments of a GitHub download that redirect to the same
+object store reuse its connections. `warm_up()` resolves every host of
+tasks.json at once in the background at startup; connections use those
+lookups instead of resolving again.
+
+Errors look like urllib's: an HTTP status of 400 or more raises
+urllib.error.HTTPError and a failure to connect raises URLError, so
+callers handle both the same way. Transient failures (connection errors,
+timeouts, 429 and 5xx) are retried with jittered exponential backoff. A
+pooled connection the server has closed in the meantime is replaced
+without counting as a retry. Proxies from the environment are honoured.
+"""
+
+import http.client
+import io
+import random
+import socket
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+DEFAULT_RETRIES = 3
+DEFAULT_TIMEOUT = 30.0
+MAX_REDIRECTS = 10
+# Idle connections kept per host, enough for every segment of a download
+MAX_IDLE_PER_HOST = 8
+# Servers drop idle keep-alive connections, don't bother reusing older ones
+IDLE_TIMEOUT = 30.0
+DNS_TTL = 300.0
+# Unread bodies up to this size are drained so the connection can be reused
+DRAIN_LIMIT = 64 * 1024
+BACKOFF_BASE = 0.1
+BACKOFF_CAP = 2.0
+
+REDIRECTS = (301, 302, 303, 307, 308)
+TRANSIENT_STATUS = (429, 500, 502, 503, 504)
+# A kept-alive connection the server closed fails like this on reuse
+_STALE = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+_PoolKey = Tuple[str, str, int, Optional[str]]
+_Address = Tuple[str, int]
+
+
+def backoff(
+    attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP
+) -> float:
+    """Seconds to wait before retry number attempt, half fixed and half random"""
+    delay = min(cap, base * 2**attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether a failed request is worth retrying"""
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code in TRANSIENT_STATUS
+    if isinstance(error, urllib.error.URLError) and isinstance(
+        error.reason, ConnectionRefusedError
+    ):
+        # Nothing listens there, asking again won't change that
+        return False
+    return isinstance(error, (OSError, http.client.HTTPException))
+
+
+@dataclass
+class ClientStats:
+    connections: int = 0
+    reused: int = 0
+    requests: int = 0
+    redirects: int = 0
+    retries: int = 0
+    dns_lookups: int = 0
+
+
+class Response:
+    """
+    A response whose connection goes back to the pool once it is closed
+    with the body read. Reads like the response urlopen() returns.
+    """
+
+    def __init__(
+        self,
+        client: "HttpClient",
+        key: _PoolKey,
+        conn: http.client.HTTPConnection,
+        resp: http.client.HTTPResponse,
+        url: str,
+    ) -> None:
+        self._client = client
+        self._key = key
+        self._conn: Optional[http.client.HTTPConnection] = conn
+        self._resp = resp
+        self.url = url
+        self.status = resp.status
+        self.reason = resp.reason
+        self.headers = resp.headers
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        if amt is not None and amt < 0:
+            amt = None
+        return self._resp.read(amt)
+
+    def readinto(self, b) -> int:
+        return self._resp.readinto(b)
+
+    def geturl(self) -> str:
+        return self.url
+
+    def getheader(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self._resp.getheader(name, default)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        resp = self._resp
+        try:
+            if not resp.isclosed() and (
+                resp.length is not None and resp.length <= DRAIN_LIMIT
+            ):
+                resp.read()
+        except (OSError, http.client.HTTPException):
+            pass
+        if resp.isclosed() and not resp.will_close:
+            self._client._release(self._key, conn)
+        else:
+            resp.close()
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class HttpClient:
+    def __init__(
+        self, max_idle_per_host: int = MAX_IDLE_PER_HOST, proxies: Optional[dict] = None
+    ) -> None:
+        self.max_idle_per_host = max_idle_per_host
+        self.stats = ClientStats()
+        self._proxies = proxies
+        self._lock = threading.Lock()
+        self._idle: Dict[_PoolKey, List[Tuple[http.client.HTTPConnection, float]]] = {}
+        self._dns: Dict[_Address, Tuple["Future[list]", float]] = {}
+        self._ssl: Optional[ssl.SSLContext] = None
+
+    # Requests
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[dict] = None,
+        timeout: float = DEFAULT_TIMEOUT,
+        retries: int = DEFAULT_RETRIES,
+    ) -> Response:
+        """
+        Send a request, following redirects and retrying transient failures.
+        Raises HTTPError for a status of 400 or more.
+        """
+        attempt = 0
+        while True:
+            try:
+                return self._follow(method, url, headers or {}, timeout)
+            except (OSError, http.client.HTTPException) as e:
+                if attempt >= retries or not is_transient(e):
+                    raise
+                attempt += 1
+                with self._lock:
+                    self.stats.retries += 1
+                time.sleep(backoff(attempt))
+
+    def _follow(self, method: str, url: str, headers: dict, timeout: float) -> Response:
+        for _ in range(MAX_REDIRECTS + 1):
+            resp = self._send(method, url, headers, timeout)
+            location = resp.headers.get("Location")
+            if resp.status in REDIRECTS and location:
+                resp.close()
+                with self._lock:
+                    self.stats.redirects += 1
+                url = urljoin(url, location)
+                if resp.status == 303 and method != "HEAD":
+                    method = "GET"
+                continue
+            if resp.status >= 400:
+                body = resp.read(DRAIN_LIMIT)
+                resp.close()
+                raise urllib.error.HTTPError(
+                    url, resp.status, resp.reason, resp.headers, io.BytesIO(body)
+                )
+            return resp
+        raise urllib.error.HTTPError(
+            url, resp.status, "Too many redirects", resp.headers, None
+        )
+
+    def _send(self, method: str, url: str, headers: dict, timeout: float) -> Response:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise urllib.error.URLError(f"unsupported URL: {url}")
+        key, target = self._route(parts)
+        with self._lock:
+            self.stats.requests += 1
+
+        while True:
+            conn, reused = self._acquire(key, timeout)
+            try:
+                conn.request(method, target, headers=headers)
+                resp = conn.getresponse()
+            except _STALE as e:
+                conn.close()
+                if reused:
+                    # Closed by the server while idle, not a failed attempt
+                    continue
+                raise urllib.error.URLError(e) if isinstance(e, OSError) else e
+            except OSError as e:
+                conn.close()
+                raise urllib.error.URLError(e)
+            except BaseException:
+                conn.close()
+                raise
+            return Response(self, key, conn, resp, url)
+
+    def _route(self, parts) -> Tuple[_PoolKey, str]:
+        """Pool key and request target, through the scheme's proxy if there is one"""
+        scheme, host = parts.scheme, parts.hostname
+        port = parts.port or (443 if scheme == "https" else 80)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        proxy = self._proxy_for(scheme, host)
+        if proxy and scheme == "http":
+            # Plain http goes to the proxy with the absolute URL
+            return (scheme, host, port, proxy), f"http://{parts.netloc}{path}"
+        return (scheme, host, port, proxy), path
+
+    def _proxy_for(self, scheme: str, host: str) -> Optional[str]:
+        if self._proxies is None:
+            self._proxies = urllib.request.getproxies()
+        proxy = self._proxies.get(scheme)
+        if not proxy or urllib.request.proxy_bypass(host):
+            return None
+        return proxy
+
+    # Pool
+
+    def _acquire(
+        self, key: _PoolKey, timeout: float
+    ) -> Tuple[http.client.HTTPConnection, bool]:
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, since = idle.pop()
+                if now - since < IDLE_TIMEOUT and conn.sock is not None:
+                    self.stats.reused += 1
+                    conn.timeout = timeout
+                    conn.sock.settimeout(timeout)
+                    return conn, True
+                conn.close()
+            self.stats.connections += 1
+        return self._connect(key, timeout), False
+
+    def _release(self, key: _PoolKey, conn: http.client.HTTPConnection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def _connect(self, key: _PoolKey, timeout: float) -> http.client.HTTPConnection:
+        scheme, host, port, proxy = key
+        if proxy:
+            proxy_parts = urlsplit(proxy if "//" in proxy else f"//{proxy}")
+            conn_host = proxy_parts.hostname or ""
+            conn_port = proxy_parts.port or 80
+        else:
+            conn_host, conn_port = host, port
+
+        conn: http.client.HTTPConnection
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(
+                conn_host, conn_port, timeout=timeout, context=self._ssl_context()
+            )
+            if proxy:
+                conn.set_tunnel(host, port)
+        else:
+            conn = http.client.HTTPConnection(conn_host, conn_port, timeout=timeout)
+        # Use (and fill) the shared DNS cache instead of resolving every time
+        conn._create_connection = self._open_socket  # type: ignore[attr-defined]
+        return conn
+
+    def _ssl_context(self) -> ssl.SSLContext:
+        with self._lock:
+            if self._ssl is None:
+                self._ssl = ssl.create_default_context()
+            return self._ssl
+
+    def close(self):
+        """Close every idle connection"""
+        with self._lock:
+            pools, self._idle = self._idle, {}
+        for idle in pools.values():
+            for conn, _ in idle:
+                conn.close()
+
+    # DNS
+
+    def warm_up(self, urls: Iterable[str]):
+        """Resolve the hosts of urls in the background, all at once"""
+        for url in urls:
+            parts = urlsplit(url)
+            if parts.scheme not in ("http", "https") or not parts.hostname:
+                continue
+            port = parts.port or (443 if parts.scheme == "https" else 80)
+            address = (parts.hostname, port)
+            if self._lookup(address, start=False) is None:
+                threading.Thread(
+                    target=self._resolve,
+                    args=(address,),
+                    name=f"dns-{parts.hostname}",
+                    daemon=True,
+                ).start()
+
+    def _lookup(
+        self, address: _Address, start: bool = True
+    ) -> Optional["Future[list]"]:
+        """The cached lookup of address; with start, begin one if there is none"""
+        with self._lock:
+            cached = self._dns.get(address)
+            if cached is not None and time.monotonic() - cached[1] < DNS_TTL:
+                return cached[0]
+            if not start:
+                # Claimed here, the caller resolves it
+                self._dns[address] = (Future(), time.monotonic())
+                return None
+            fut: "Future[list]" = Future()
+            self._dns[address] = (fut, time.monotonic())
+        self._resolve(address, fut)
+        return fut
+
+    def _resolve(self, address: _Address, fut: Optional["Future[list]"] = None):
+        if fut is None:
+            with self._lock:
+                fut = self._dns[address][0]
+        with self._lock:
+            self.stats.dns_lookups += 1
+        try:
+            infos = socket.getaddrinfo(*address, type=socket.SOCK_STREAM)
+        except OSError as e:
+            with self._lock:
+                # Not cached, the next connection tries again
+                if self._dns.get(address, (None,))[0] is fut:
+                    del self._dns[address]
+            fut.set_exception(e)
+        else:
+            fut.set_result(infos)
+
+    def _open_socket(self, address: _Address, timeout=None, source_address=None):
+        """socket.create_connection() over the cached addresses"""
+        fut = self._lookup(address)
+        assert fut is not None
+        error: Optional[OSError] = None
+        for family, kind, proto, _, sockaddr in fut.result():
+            sock = socket.socket(family, kind, proto)
+            try:
+                if timeout is not None:
+                    sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect(sockaddr)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                return sock
+            except OSError as e:
+                error = e
+                sock.close()
+        raise error or OSError(f"No addresses for {address[0]}")
+
+
+client = HttpClient()
+
+
+def request(
+    method: str,
+    url: str,
+    headers: Optional[dict] = None,
+    timeout: float = DEFAULT_TIMEOUT,
+    retries: int = DEFAULT_RETRIES,
+) -> Response:
+    """client.request(), for the module-level shared client"""
+    return client.request(method, url, headers, timeout=timeout, retries=retries)
+
+
+def warm_up(urls: Iterable[str]):
+    client.warm_up(urls)
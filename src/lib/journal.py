@@ -0,0 +1,88 @@
+"""
+Run journal.
+
+Records every bash task and DMG that completed, together with a digest of
+what was run (the script contents or the tasks.json entry). With resume
+enabled, entries whose digest is unchanged are skipped on the next run;
+editing a script only invalidates that one entry.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+DEFAULT_JOURNAL = os.path.expanduser(
+    "~/Library/Application Support/macbook-init/journal.json"
+)
+JOURNAL_ENV = "MACBOOK_INIT_JOURNAL"
+
+BASH = "bash"
+DMG = "dmg"
+
+
+def file_digest(path: str) -> str:
+    import hashlib
+
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def entry_digest(entry: Any) -> str:
+    """Digest of a JSON-serialisable manifest entry"""
+    import hashlib
+
+    raw = json.dumps(entry, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class Journal:
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        resume: bool = False,
+        force: Iterable[str] = (),
+    ) -> None:
+        self.path = path or os.environ.get(JOURNAL_ENV) or DEFAULT_JOURNAL
+        self.resume = resume
+        self.force = set(force)
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, dict]] = self._load()
+
+    def is_done(self, kind: str, key: str, digest: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(kind, {}).get(key)
+        return entry is not None and entry["digest"] == digest
+
+    def should_skip(
+        self, kind: str, key: str, digest: str, aliases: Iterable[str] = ()
+    ) -> bool:
+        """True if resuming and the entry already completed unchanged"""
+        if not self.resume:
+            return False
+        if self.force.intersection([key, *aliases]):
+            return False
+        return self.is_done(kind, key, digest)
+
+    def record(self, kind: str, key: str, digest: str):
+        with self._lock:
+            self._entries.setdefault(kind, {})[key] = {
+                "digest": digest,
+                "completed_at": time.time(),
+            }
+            self._save()
+
+    def _load(self) -> Dict[str, Dict[str, dict]]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._entries, f, indent=2)
+        os.replace(tmp, self.path)
@@ -0,0 +1,341 @@
+"""
+Parsing helpers for tasks.json entries.
+
+This module is all `--list`, `--validate` and `--dry-run` need, so it only
+imports what parsing the manifest takes.
+"""
+
+import json
+import os
+import re
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from lib.scheduler import Job, Scheduler
+from utils.errors import DependencyError, ManifestError
+
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+# App archives the DMG list also takes, by file name suffix
+ZIP = "zip"
+TAR = "tar"
+ARCHIVE_SUFFIXES = {
+    ".zip": ZIP,
+    ".tar.xz": TAR,
+    ".txz": TAR,
+    ".tar.gz": TAR,
+    ".tgz": TAR,
+    ".tar.bz2": TAR,
+}
+
+
+def archive_kind(url: str) -> Optional[str]:
+    """ZIP or TAR for an app archive URL, None for a DMG"""
+    name = os.path.basename(url.split("?", 1)[0].split("#", 1)[0]).lower()
+    for suffix, kind in ARCHIVE_SUFFIXES.items():
+        if name.endswith(suffix):
+            return kind
+    return None
+
+
+@dataclass(frozen=True)
+class DmgEntry:
+    url: str
+    sha256: Optional[str] = None
+    # Share of a --max-bandwidth cap: higher priorities go first, equal
+    # ones split it by weight
+    priority: int = 0
+    weight: float = 1.0
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.url)
+
+    @property
+    def archive(self) -> Optional[str]:
+        return archive_kind(self.url)
+
+
+def parse_dmg_entry(raw: Any) -> DmgEntry:
+    """A bare URL string or an object with `url`, optional `sha256`, `priority`, ..."""
+    if isinstance(raw, str):
+        return DmgEntry(url=raw)
+    if not isinstance(raw, dict) or not isinstance(raw.get("url"), str):
+        raise ManifestError(f"DMG entry must be a URL or an object with 'url': {raw!r}")
+
+    sha256 = raw.get("sha256")
+    if sha256 is not None:
+        sha256 = str(sha256).lower()
+        if not _SHA256.match(sha256):
+            raise ManifestError(f"Invalid sha256 for {raw['url']}: {raw['sha256']!r}")
+    return DmgEntry(url=raw["url"], sha256=sha256, **_bandwidth_share(raw))
+
+
+def parse_dmg_entries(raw: List[Any]) -> List[DmgEntry]:
+    return [parse_dmg_entry(item) for item in raw]
+
+
+@dataclass(frozen=True)
+class GitEntry:
+    repo: str
+    dest: str
+    ref: Optional[str] = None
+    # 0 clones the full history
+    depth: int = 1
+    name: str = ""
+    depends_on: Tuple[str, ...] = ()
+
+
+def parse_git_entry(raw: Any) -> GitEntry:
+    """An object with `repo` and `dest`, optional `ref`, `depth`, `name`, `depends_on`"""
+    if not isinstance(raw, dict) or not all(
+        isinstance(raw.get(key), str) and raw[key] for key in ("repo", "dest")
+    ):
+        raise ManifestError(f"git entry needs a 'repo' and a 'dest': {raw!r}")
+
+    ref = raw.get("ref")
+    depth = raw.get("depth", 1)
+    if ref is not None and (not isinstance(ref, str) or not ref):
+        raise ManifestError(f"Invalid ref for {raw['repo']}: {ref!r}")
+    if not _count(depth):
+        raise ManifestError(f"Invalid depth for {raw['repo']}: {depth!r}")
+
+    repo_name = re.sub(r"\.git$", "", os.path.basename(raw["repo"].rstrip("/")))
+    return GitEntry(
+        repo=raw["repo"],
+        dest=raw["dest"],
+        ref=ref,
+        depth=depth,
+        name=raw.get("name") or f"Clone {repo_name}",
+        depends_on=_depends_on(raw),
+    )
+
+
+@dataclass(frozen=True)
+class TarballEntry:
+    url: str
+    dest: str
+    strip_components: int = 0
+    sha256: Optional[str] = None
+    name: str = ""
+    depends_on: Tuple[str, ...] = ()
+    priority: int = 0
+    weight: float = 1.0
+
+
+def parse_tarball_entry(raw: Any) -> TarballEntry:
+    """An object with `url` and `dest`, optional `strip_components`, `sha256`, ..."""
+    if not isinstance(raw, dict) or not all(
+        isinstance(raw.get(key), str) and raw[key] for key in ("url", "dest")
+    ):
+        raise ManifestError(f"tarball entry needs a 'url' and a 'dest': {raw!r}")
+
+    strip = raw.get("strip_components", 0)
+    if not _count(strip):
+        raise ManifestError(f"Invalid strip_components for {raw['url']}: {strip!r}")
+    sha256 = raw.get("sha256")
+    if sha256 is not None:
+        sha256 = str(sha256).lower()
+        if not _SHA256.match(sha256):
+            raise ManifestError(f"Invalid sha256 for {raw['url']}: {raw['sha256']!r}")
+
+    return TarballEntry(
+        url=raw["url"],
+        dest=raw["dest"],
+        strip_components=strip,
+        sha256=sha256,
+        name=raw.get("name") or f"Install {os.path.basename(raw['url'])}",
+        depends_on=_depends_on(raw),
+        **_bandwidth_share(raw),
+    )
+
+
+@dataclass(frozen=True)
+class Probe:
+    """A cheap check that an entry is already installed"""
+
+    path: Optional[str] = None
+    command: Optional[str] = None
+
+
+def parse_probe(raw: Any, owner: str) -> Probe:
+    """`{"path": ...}` that exists when installed, or a `{"command": ...}` exiting 0"""
+    if isinstance(raw, dict) and len(raw) == 1:
+        key, value = next(iter(raw.items()))
+        if key in ("path", "command") and isinstance(value, str) and value:
+            return Probe(**{key: value})
+    raise ManifestError(
+        f'probe for {owner} must be {{"path": ...}} or {{"command": ...}}: {raw!r}'
+    )
+
+
+def _count(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def _bandwidth_share(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """`priority` (any integer) and `weight` (positive number) of a download"""
+    priority = raw.get("priority", 0)
+    weight = raw.get("weight", 1.0)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        raise ManifestError(f"Invalid priority for {raw['url']}: {priority!r}")
+    if (
+        not isinstance(weight, (int, float))
+        or isinstance(weight, bool)
+        or not weight > 0
+    ):
+        raise ManifestError(f"Invalid weight for {raw['url']}: {weight!r}")
+    return {"priority": priority, "weight": float(weight)}
+
+
+def _depends_on(raw: Dict[str, Any]) -> Tuple[str, ...]:
+    depends_on = raw.get("depends_on", [])
+    if not isinstance(depends_on, list) or not all(
+        isinstance(d, str) for d in depends_on
+    ):
+        raise ManifestError(f"depends_on must be a list of names: {raw!r}")
+    return tuple(depends_on)
+
+
+@dataclass
+class Manifest:
+    bash: List[Dict[str, Any]]
+    dmg: List[DmgEntry]
+    git: List[GitEntry] = field(default_factory=list)
+    tarball: List[TarballEntry] = field(default_factory=list)
+    # Entry name -> its probe, for the entries that have one
+    probes: Dict[str, Probe] = field(default_factory=dict)
+
+    def fetches(self) -> List[Any]:
+        """Entries run as fetch jobs next to the bash tasks"""
+        return [*self.git, *self.tarball]
+
+    def without(self, names: Set[str]) -> "Manifest":
+        """
+        The manifest minus the named entries. Nothing waits for them any
+        more; a task that implicitly waited for a dropped one waits for the
+        task before that instead.
+        """
+
+        def prune(deps) -> Tuple[str, ...]:
+            return tuple(dep for dep in deps if dep not in names)
+
+        bash = [
+            {**t, "depends_on": list(prune(t["depends_on"]))}
+            if "depends_on" in t
+            else t
+            for t in self.bash
+            if t["name"] not in names
+        ]
+        return Manifest(
+            bash=bash,
+            dmg=[e for e in self.dmg if e.name not in names],
+            git=[
+                replace(e, depends_on=prune(e.depends_on))
+                for e in self.git
+                if e.name not in names
+            ],
+            tarball=[
+                replace(e, depends_on=prune(e.depends_on))
+                for e in self.tarball
+                if e.name not in names
+            ],
+            probes={n: p for n, p in self.probes.items() if n not in names},
+        )
+
+
+def parse_prefix(filename: str):
+    """Extract numeric prefix from filename for fallback ordering."""
+    match = re.match(r"(\d+)_", filename)
+    return int(match.group(1)) if match else float("inf")
+
+
+def load_manifest(path: str) -> Manifest:
+    """Read tasks.json, with bash tasks in run order"""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except ValueError as e:
+        raise ManifestError(f"{path} is not valid JSON: {e}") from e
+    if not isinstance(data, dict):
+        raise ManifestError(f"{path} must contain a JSON object")
+
+    bash_tasks = data.get("bash", [])
+    if not isinstance(bash_tasks, list) or not all(
+        isinstance(t, dict) and isinstance(t.get("name"), str) and t.get("script")
+        for t in bash_tasks
+    ):
+        raise ManifestError("Every bash task needs a 'name' and a 'script'")
+
+    # Sort bash tasks by 'order', fallback to filename numeric prefix
+    bash_tasks.sort(
+        key=lambda t: t.get("order", parse_prefix(os.path.basename(t["script"])))
+    )
+    manifest = Manifest(
+        bash=bash_tasks,
+        dmg=parse_dmg_entries(data.get("dmg", [])),
+        git=[parse_git_entry(item) for item in data.get("git", [])],
+        tarball=[parse_tarball_entry(item) for item in data.get("tarball", [])],
+    )
+    raw_entries: List[Tuple[Any, Any]] = [(t, t["name"]) for t in bash_tasks]
+    for section, entries in (
+        ("git", manifest.git),
+        ("tarball", manifest.tarball),
+        ("dmg", manifest.dmg),
+    ):
+        raw_entries += [(r, e.name) for r, e in zip(data.get(section, []), entries)]
+    for raw, name in raw_entries:
+        if isinstance(raw, dict) and "probe" in raw:
+            manifest.probes[name] = parse_probe(raw["probe"], name)
+    return manifest
+
+
+def task_dependencies(bash_tasks: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+    """
+    What each task waits for. A task with a `depends_on` list only waits for
+    the named tasks; one without it waits for the task before it.
+    """
+    deps: Dict[str, List[str]] = {}
+    previous: Optional[str] = None
+    for task in bash_tasks:
+        if "depends_on" in task:
+            deps[task["name"]] = list(task["depends_on"])
+        else:
+            deps[task["name"]] = [previous] if previous else []
+        previous = task["name"]
+    return deps
+
+
+def validate_manifest(manifest: Manifest, base_dir: str) -> List[str]:
+    """Problems that would stop tasks from running, empty if there are none"""
+    problems = []
+    for task in manifest.bash:
+        if not os.path.isfile(os.path.join(base_dir, task["script"])):
+            problems.append(f"Script not found for '{task['name']}': {task['script']}")
+
+    names = [task["name"] for task in manifest.bash]
+    names += [entry.name for entry in manifest.fetches()]
+    if len(set(names)) == len(names):
+        jobs = [
+            Job(name, run=lambda: True, depends_on=deps)
+            for name, deps in task_dependencies(manifest.bash).items()
+        ]
+        jobs += [
+            Job(e.name, run=lambda: True, depends_on=list(e.depends_on))
+            for e in manifest.fetches()
+        ]
+        try:
+            Scheduler.validate(jobs)
+        except DependencyError as e:
+            problems.append(str(e))
+    else:
+        dupes = sorted({n for n in names if names.count(n) > 1})
+        problems.append(f"Duplicate task names: {', '.join(dupes)}")
+
+    urls = [entry.url for entry in manifest.dmg]
+    for url in sorted({u for u in urls if urls.count(u) > 1}):
+        problems.append(f"DMG listed more than once: {url}")
+    dests = [os.path.normpath(os.path.expanduser(e.dest)) for e in manifest.fetches()]
+    for dest in sorted({d for d in dests if dests.count(d) > 1}):
+        problems.append(f"More than one checkout or tarball into {dest}")
+    return problems
@@ -0,0 +1,315 @@
+"""
+LAN peer cache.
+
+One Mac runs `main.py --serve-cache` to share its artifact cache over
+HTTP, the others run with `--peer-cache http://that-mac:8642`. A client
+asks the peer for each URL first: the peer serves its cached copy, or
+downloads it from upstream once and then serves it, so Macs imaged at the
+same time pull each DMG over the office uplink only once. Requests for a
+URL the peer is still downloading wait for that download (the artifact
+cache coalesces them) instead of starting another.
+
+`GET /fetch?url=...&sha256=...` makes sure the peer has the URL and
+redirects to `GET /objects/<sha256>`, which serves the stored file with
+byte ranges, so the client's segmented downloader fetches from the peer
+in parallel and resumes just like it does from upstream. A large DMG
+takes the peer longer to download than any sensible read timeout, so
+`/fetch` only waits POLL_WAIT seconds; until the download is done it
+answers 202 with its progress and the client asks again. The client
+gives up on the peer when that progress stalls for STALL_TIMEOUT.
+
+Anything the peer can't serve (it is down, upstream failed, the content
+doesn't match a pinned SHA-256) is fetched from upstream directly. A peer
+that can't be reached at all is not asked again for the rest of the run.
+The peer only downloads the URLs in its own tasks.json, so it can't be
+used to fetch arbitrary URLs from the LAN.
+"""
+
+import http.client
+import os
+import re
+import threading
+import time
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Collection,
+    Dict,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from lib.tui import console
+from utils.errors import DownloadError
+
+if TYPE_CHECKING:
+    from lib.cache import ArtifactCache
+
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 8642
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_PEER_ERRORS = (DownloadError, OSError, http.client.HTTPException)
+# How long /fetch waits for the download before answering 202
+POLL_WAIT = 10.0
+# Give up on the peer when its download makes no progress for this long
+STALL_TIMEOUT = 60.0
+PROGRESS_HEADER = "X-Peer-Progress"
+
+T = TypeVar("T")
+
+
+class PeerCache:
+    """Client side: where to ask the peer for a URL, and whether it is up"""
+
+    def __init__(self, base_url: str) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.reachable = True
+
+    def url_for(self, url: str, sha256: Optional[str] = None) -> str:
+        query = {"url": url, **({"sha256": sha256.lower()} if sha256 else {})}
+        return f"{self.base_url}/fetch?{urlencode(query)}"
+
+    def resolve(self, url: str, sha256: Optional[str] = None) -> str:
+        """URL of the peer's copy of url, waiting while the peer downloads it"""
+        from lib.httpclient import request
+
+        fetch_url = self.url_for(url, sha256)
+        progress, since = None, time.monotonic()
+        while True:
+            # HEAD follows the redirect to the object without its body
+            with request("HEAD", fetch_url, timeout=POLL_WAIT + 20) as resp:
+                if resp.status != 202:
+                    return resp.geturl()
+                latest = resp.getheader(PROGRESS_HEADER)
+            if latest != progress:
+                progress, since = latest, time.monotonic()
+            elif time.monotonic() - since > STALL_TIMEOUT:
+                raise DownloadError(
+                    f"Peer stopped making progress on {url} at {progress} bytes"
+                )
+
+
+def with_peer(
+    peer: Optional[PeerCache],
+    url: str,
+    sha256: Optional[str],
+    fetch: Callable[[str], T],
+) -> T:
+    """fetch() the peer's copy of url, or url itself if the peer can't serve it"""
+    if peer is None or not peer.reachable:
+        return fetch(url)
+    try:
+        return fetch(peer.resolve(url, sha256))
+    except _PEER_ERRORS as e:
+        if isinstance(e, urllib.error.URLError) and not isinstance(
+            e, urllib.error.HTTPError
+        ):
+            # No HTTP response at all: the peer is down, stop asking it
+            peer.reachable = False
+        console.warning(
+            f"Peer cache can't serve {os.path.basename(url)} ({e}), "
+            "downloading from upstream"
+        )
+        return fetch(url)
+
+
+def parse_address(addr: str) -> Tuple[str, int]:
+    """`HOST:PORT`, `PORT` or empty for the defaults"""
+    host, _, port = addr.rpartition(":")
+    if not port:
+        return host or DEFAULT_HOST, DEFAULT_PORT
+    return host or DEFAULT_HOST, int(port)
+
+
+def _byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) inclusive for a single-range header, None for the whole file"""
+    match = _RANGE.match(header or "")
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+class _PeerFetch:
+    """A download the peer runs for its clients, see CacheServer.fetch()"""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.received = 0
+        self.total = 0
+        self.path: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+    def progress(self, received: int, total: int):
+        self.received, self.total = received, total
+
+
+class CacheServer:
+    """
+    Serves an ArtifactCache to peers until shutdown(). With urls given,
+    only those are downloaded on a client's behalf.
+    """
+
+    def __init__(
+        self,
+        cache: "ArtifactCache",
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        urls: Optional[Collection[str]] = None,
+    ) -> None:
+        self.cache = cache
+        self.urls = None if urls is None else frozenset(urls)
+        self._lock = threading.Lock()
+        self._fetches: Dict[Tuple[str, Optional[str]], _PeerFetch] = {}
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self) -> "CacheServer":
+        """Serve from a background thread, e.g. in tests"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def shutdown(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        return False
+
+    def fetch(self, url: str, sha256: Optional[str]) -> _PeerFetch:
+        """The running download of url, started in the background if there is none"""
+        key = (url, sha256)
+        with self._lock:
+            job = self._fetches.get(key)
+            if job is not None:
+                return job
+            job = self._fetches[key] = _PeerFetch()
+
+        def run():
+            try:
+                job.path = self.cache.fetch(url, progress=job.progress, sha256=sha256)
+            except BaseException as e:
+                job.error = e
+            finally:
+                with self._lock:
+                    del self._fetches[key]
+                job.done.set()
+
+        threading.Thread(target=run, name="peer-fetch", daemon=True).start()
+        return job
+
+    def _handler(self):
+        server = self
+        cache = self.cache
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self._route(body=False)
+
+            def do_GET(self):
+                self._route(body=True)
+
+            def _route(self, body: bool):
+                parts = urlsplit(self.path)
+                query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                if parts.path == "/fetch" and query.get("url"):
+                    self._fetch(query["url"], query.get("sha256"))
+                elif parts.path.startswith("/objects/"):
+                    self._object(parts.path[len("/objects/") :], query, body)
+                else:
+                    self.send_error(404)
+
+            def _fetch(self, url: str, sha256: Optional[str]):
+                if server.urls is not None and url not in server.urls:
+                    self.send_error(403, "Not in the peer's tasks.json")
+                    return
+                job = server.fetch(url, sha256)
+                if not job.done.wait(POLL_WAIT):
+                    self.send_response(202)
+                    self.send_header(PROGRESS_HEADER, str(job.received))
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if job.error is not None or job.path is None:
+                    self.send_error(502, f"Upstream fetch failed: {job.error}")
+                    return
+                path = job.path
+                # Ranges of the object are served without revalidating each time
+                location = (
+                    f"/objects/{os.path.basename(path)}?{urlencode({'url': url})}"
+                )
+                self.send_response(302)
+                self.send_header("Location", location)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def _object(self, sha256: str, query: dict, body: bool):
+                path = cache.object_path(sha256) if _SHA256.match(sha256) else None
+                if path is None or not os.path.isfile(path):
+                    self.send_error(404)
+                    return
+                # Pass on upstream's validators, so clients revalidate with them
+                info = cache.info(query.get("url", "")) or {}
+                if info.get("sha256") != sha256:
+                    info = {}
+                with open(path, "rb") as f:
+                    size = os.fstat(f.fileno()).st_size
+                    try:
+                        span = _byte_range(self.headers.get("Range"), size)
+                    except ValueError:
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{size}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    start, end = span or (0, size - 1)
+                    self.send_response(206 if span else 200)
+                    self.send_header("Content-Length", str(end - start + 1))
+                    self.send_header("Accept-Ranges", "bytes")
+                    self.send_header("ETag", info.get("etag") or f'"{sha256}"')
+                    if info.get("last_modified"):
+                        self.send_header("Last-Modified", info["last_modified"])
+                    if span:
+                        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                    self.end_headers()
+                    if body and end >= start:
+                        try:
+                            self.connection.sendfile(f, start, end - start + 1)
+                        except (BrokenPipeError, ConnectionResetError):
+                            self.close_connection = True
+
+        return Handler
@@ -0,0 +1,178 @@
+"""
+Up-front approval plan.
+
+Every prompt the run would show (one per bash task, git checkout and
+tarball, six per DMG, fewer per app archive) is an
+Action with a stable key. The plan is answered once before anything
+runs, either interactively or from a saved plan file, so no step ever
+blocks on a keypress while downloads and tasks are in flight.
+"""
+
+import json
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterable, List
+
+from lib.manifest import TAR, ZIP, DmgEntry, GitEntry, TarballEntry
+from lib.tui import confirm, console
+from utils.errors import PlanError
+
+PLAN_VERSION = 1
+
+DMG_STEPS = [
+    ("download", "Download {name}"),
+    ("mount", "Mount {name}"),
+    ("copy", "Copy the app from {name} to /Applications"),
+    ("replace", "Replace the app if it is already in /Applications"),
+    ("detach", "Unmount {name} when done"),
+    ("cleanup", "Delete the temporary download of {name}"),
+]
+# App archives have nothing to mount, and a tar one nothing to clean up
+ARCHIVE_STEPS = {
+    ZIP: [
+        ("download", "Download {name}"),
+        ("copy", "Extract the app from {name} into /Applications"),
+        ("replace", "Replace the app if it is already in /Applications"),
+        ("cleanup", "Delete the temporary download of {name}"),
+    ],
+    TAR: [
+        ("download", "Download {name}"),
+        ("copy", "Extract the app from {name} into /Applications as it downloads"),
+        ("replace", "Replace the app if it is already in /Applications"),
+    ],
+}
+
+
+def bash_key(name: str) -> str:
+    return f"bash:{name}"
+
+
+def dmg_key(url: str, step: str) -> str:
+    return f"dmg:{url}:{step}"
+
+
+def git_key(name: str) -> str:
+    return f"git:{name}"
+
+
+def tarball_key(name: str) -> str:
+    return f"tarball:{name}"
+
+
+@dataclass
+class Action:
+    key: str
+    description: str
+    approved: bool = False
+
+
+class Plan:
+    def __init__(self, actions: List[Action]) -> None:
+        self.actions = actions
+        self._by_key: Dict[str, Action] = {a.key: a for a in actions}
+
+    @classmethod
+    def build(
+        cls,
+        bash_tasks: Iterable[dict],
+        dmg_entries: Iterable[DmgEntry],
+        git_entries: Iterable[GitEntry] = (),
+        tarball_entries: Iterable[TarballEntry] = (),
+    ):
+        actions = []
+        for task in bash_tasks:
+            name = task["name"]
+            # Tasks that never asked before don't need an approval now either
+            approved = not task.get("show_dialog", True)
+            actions.append(
+                Action(bash_key(name), f"Run {task['script']} ({name})", approved)
+            )
+        for git in git_entries:
+            actions.append(
+                Action(git_key(git.name), f"Clone {git.repo} into {git.dest}")
+            )
+        for tar in tarball_entries:
+            actions.append(
+                Action(tarball_key(tar.name), f"Extract {tar.url} into {tar.dest}")
+            )
+        for entry in dmg_entries:
+            steps = ARCHIVE_STEPS.get(entry.archive or "", DMG_STEPS)
+            for step, text in steps:
+                actions.append(
+                    Action(dmg_key(entry.url, step), text.format(name=entry.name))
+                )
+        return cls(actions)
+
+    def approved(self, key: str) -> bool:
+        action = self._by_key.get(key)
+        return action is not None and action.approved
+
+    def pending(self) -> List[Action]:
+        return [a for a in self.actions if not a.approved]
+
+    def show(self):
+        console.header("Planned actions")
+        for action in self.actions:
+            icon = "check" if action.approved else "bullet"
+            console.print(f" {action.description}", icon=icon)
+        console.print()
+
+    def ask(self):
+        """Collect every approval now, instead of during the run"""
+        pending = self.pending()
+        if not pending:
+            return
+        self.show()
+        if confirm(prompt=f"Approve all {len(pending)} actions?"):
+            for action in pending:
+                action.approved = True
+            return
+        for action in pending:
+            action.approved = confirm(prompt=f"{action.description}?")
+
+    def merge(self, saved: "Plan") -> List[str]:
+        """
+        Take approvals from a saved plan. Returns keys of actions the saved
+        plan doesn't cover (they stay unapproved).
+        """
+        missing = []
+        for action in self.actions:
+            if action.key in saved._by_key:
+                action.approved = saved.approved(action.key)
+            elif not action.approved:
+                missing.append(action.key)
+        return missing
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(
+                {"version": PLAN_VERSION, "actions": [asdict(a) for a in self.actions]},
+                f,
+                indent=2,
+            )
+            f.write("\n")
+
+    @classmethod
+    def load(cls, path: str) -> "Plan":
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            return cls([Action(**a) for a in data.get("actions", [])])
+        except OSError as e:
+            raise PlanError(f"Can't read plan file: {e}") from e
+        except (ValueError, TypeError, AttributeError) as e:
+            raise PlanError(f"{path} is not a plan file: {e}") from e
+
+
+def load_approved(
+    path: str,
+    bash_tasks: Iterable[dict],
+    dmg_entries: Iterable[DmgEntry],
+    git_entries: Iterable[GitEntry] = (),
+    tarball_entries: Iterable[TarballEntry] = (),
+) -> Plan:
+    """Build the plan for this manifest and apply the approvals saved in path"""
+    plan = Plan.build(bash_tasks, dmg_entries, git_entries, tarball_entries)
+    missing = plan.merge(Plan.load(path))
+    for key in missing:
+        console.warning(f"Not in plan file, will be skipped: {key}")
+    return plan
@@ -0,0 +1,95 @@
+"""
+Background DMG downloads.
+
+All DMGs are fetched on a small thread pool as soon as the manifest is
+loaded, so they download while the bash tasks run. Each DmgManagement
+then picks up its finished (or still running) download from here, which
+also pipelines installs: the next DMG keeps downloading while the current
+one is mounted and copied.
+"""
+
+import shutil
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+from lib.dmg import DmgManagement
+from lib.events import traced
+from lib.manifest import DmgEntry
+
+if TYPE_CHECKING:
+    from lib.bundle import Bundle
+    from lib.cache import ArtifactCache
+    from lib.diskspace import AdmissionController
+    from lib.peer import PeerCache
+
+
+class DmgPrefetcher:
+    def __init__(
+        self,
+        entries: List[DmgEntry],
+        workers: int = 2,
+        cache: Optional["ArtifactCache"] = None,
+        admission: Optional["AdmissionController"] = None,
+        bundle: Optional["Bundle"] = None,
+        peer: Optional["PeerCache"] = None,
+    ) -> None:
+        self.entries = entries
+        self.workers = max(1, workers)
+        self.cache = cache
+        self.admission = admission
+        self.bundle = bundle
+        self.peer = peer
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._futures: Dict[str, "Future[Tuple[str, str]]"] = {}
+        self._taken: Set[str] = set()
+
+    def start(self):
+        if self._pool or not self.entries:
+            return
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="prefetch"
+        )
+        # Queued by priority, so important downloads don't wait for a worker
+        for entry in sorted(self.entries, key=lambda e: -e.priority):
+            if entry.url not in self._futures:
+                self._futures[entry.url] = self._pool.submit(self._fetch, entry)
+
+    @traced("dmg.prefetch", "dmg", args=lambda self, entry: {"dmg": entry.name})
+    def _fetch(self, entry: DmgEntry) -> Tuple[str, str]:
+        dmg = DmgManagement(
+            url=entry.url,
+            show_dialog=False,
+            cache=self.cache,
+            sha256=entry.sha256,
+            admission=self.admission,
+            bundle=self.bundle,
+            peer=self.peer,
+            priority=entry.priority,
+            weight=entry.weight,
+        )
+        return dmg.prefetch(f"{entry.name} (background)")
+
+    def take(self, url: str) -> Optional["Future[Tuple[str, str]]"]:
+        """Hand a download over to its installer, who now owns the temp dir"""
+        fut = self._futures.get(url)
+        if fut is not None:
+            self._taken.add(url)
+        return fut
+
+    def shutdown(self):
+        """Stop queued downloads and remove files nobody picked up"""
+        if not self._pool:
+            return
+        for fut in self._futures.values():
+            fut.cancel()
+        if self.admission is not None:
+            self.admission.close()
+        self._pool.shutdown(wait=True)
+        for url, fut in self._futures.items():
+            if url in self._taken or fut.cancelled() or fut.exception() is not None:
+                continue
+            tmpdir, _ = fut.result()
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            if self.admission is not None:
+                self.admission.release(url)
+        self._pool = None
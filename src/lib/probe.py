@@ -0,0 +1,74 @@
+"""
+Startup probes.
+
+A bash task, git checkout, tarball or DMG in tasks.json can carry a
+`probe`: a path that exists once it is installed, or a shell command that
+exits 0 when it is. All probes run at once on a thread pool before the
+plan is built, and whatever they report as already satisfied is dropped
+from the run, so it is neither confirmed, downloaded nor run.
+
+A probe that fails, errors or outlives its timeout means the entry runs as
+usual; probes can only ever skip work.
+"""
+
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from lib.events import traced
+from lib.manifest import Probe
+
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_WORKERS = 8
+
+
+@dataclass
+class ProbeResult:
+    name: str
+    satisfied: bool
+    reason: str
+
+
+def check(probe: Probe, timeout: float = DEFAULT_TIMEOUT) -> Tuple[bool, str]:
+    """Whether probe finds its entry installed, and why"""
+    if probe.path is not None:
+        if os.path.exists(os.path.expanduser(probe.path)):
+            return True, f"{probe.path} exists"
+        return False, f"{probe.path} does not exist"
+
+    assert probe.command is not None
+    try:
+        result = subprocess.run(
+            ["/bin/bash", "-c", probe.command],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return False, f"`{probe.command}` timed out after {timeout:g}s"
+    except OSError as e:
+        return False, f"`{probe.command}` could not run: {e}"
+    if result.returncode == 0:
+        return True, f"`{probe.command}` succeeded"
+    return False, f"`{probe.command}` exited {result.returncode}"
+
+
+@traced("probes", "probe", args=lambda probes, *a, **kw: {"count": len(probes)})
+def run_probes(
+    probes: Dict[str, Probe],
+    timeout: float = DEFAULT_TIMEOUT,
+    workers: int = DEFAULT_WORKERS,
+) -> List[ProbeResult]:
+    """Run every probe concurrently, results in the order of probes"""
+    if not probes:
+        return []
+    with ThreadPoolExecutor(
+        max_workers=min(workers, len(probes)), thread_name_prefix="probe"
+    ) as pool:
+        futures = {
+            name: pool.submit(check, probe, timeout) for name, probe in probes.items()
+        }
+        return [ProbeResult(name, *fut.result()) for name, fut in futures.items()]
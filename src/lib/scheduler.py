@@ -0,0 +1,157 @@
+"""
+Dependency-aware job scheduler.
+
+Jobs run on a bounded thread pool as soon as every job they depend on has
+finished successfully. When a job fails, only the jobs that (transitively)
+depend on it are skipped; independent branches keep running.
+
+A job can name a pool with its own limit, e.g. git clones, which are
+mostly waiting on the network and shouldn't take the slots of --jobs.
+"""
+
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional
+
+from lib.tui import console
+from utils.errors import DependencyError
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+OK = "ok"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+@dataclass
+class Job:
+    name: str
+    run: Callable[[], bool]
+    depends_on: List[str] = field(default_factory=list)
+    # None: one of the Scheduler's `jobs` slots
+    pool: Optional[str] = None
+
+
+class Scheduler:
+    def __init__(
+        self,
+        jobs: int = 1,
+        on_skip: Optional[Callable[[Job, str], None]] = None,
+        pools: Optional[Dict[str, int]] = None,
+    ) -> None:
+        self.jobs = max(1, jobs)
+        self.on_skip = on_skip
+        self.pools = {name: max(1, size) for name, size in (pools or {}).items()}
+
+    @staticmethod
+    def validate(jobs: List[Job]):
+        """Check for duplicate names, unknown dependencies and cycles"""
+        names = [job.name for job in jobs]
+        by_name = {job.name: job for job in jobs}
+        if len(by_name) != len(names):
+            dupes = sorted({n for n in names if names.count(n) > 1})
+            raise DependencyError(f"Duplicate task names: {', '.join(dupes)}")
+
+        for job in jobs:
+            for dep in job.depends_on:
+                if dep not in by_name:
+                    raise DependencyError(
+                        f"Task '{job.name}' depends on unknown task '{dep}'"
+                    )
+
+        # Depth-first search, 1 = visiting, 2 = done
+        state: Dict[str, int] = {}
+
+        def visit(name: str, path: List[str]):
+            if state.get(name) == 2:
+                return
+            if state.get(name) == 1:
+                cycle = path[path.index(name) :] + [name]
+                raise DependencyError(f"Dependency cycle: {' -> '.join(cycle)}")
+            state[name] = 1
+            for dep in by_name[name].depends_on:
+                visit(dep, path + [name])
+            state[name] = 2
+
+        for name in names:
+            visit(name, [])
+
+    def run(self, jobs: List[Job]) -> Dict[str, str]:
+        """
+        Run all jobs respecting their dependencies.
+
+        Ready jobs are started in list order, so with jobs=1 the execution
+        order is the same as a plain sequential loop over the list.
+
+        Returns:
+            Mapping of job name to OK, FAILED or SKIPPED
+        """
+        # Imported here so validating a manifest doesn't load the thread pool
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+        self.validate(jobs)
+
+        status: Dict[str, str] = {}
+        pending = list(jobs)
+        running: Dict["Future", Job] = {}
+
+        workers = self.jobs + sum(self.pools.values())
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while pending or running:
+                progressed = True
+                while progressed:
+                    progressed = False
+                    for job in list(pending):
+                        dep_states = [status.get(dep) for dep in job.depends_on]
+                        blocker = next(
+                            (
+                                dep
+                                for dep, st in zip(job.depends_on, dep_states)
+                                if st in (FAILED, SKIPPED)
+                            ),
+                            None,
+                        )
+                        if blocker is not None:
+                            pending.remove(job)
+                            status[job.name] = SKIPPED
+                            if self.on_skip:
+                                self.on_skip(job, blocker)
+                            progressed = True
+                        elif all(st == OK for st in dep_states):
+                            if self._full(job, running.values()):
+                                continue
+                            pending.remove(job)
+                            running[pool.submit(self._call, job)] = job
+
+                if not running:
+                    # Nothing runnable is left; validate() rules out cycles
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    job = running.pop(fut)
+                    status[job.name] = OK if fut.result() else FAILED
+
+        return status
+
+    def _full(self, job: Job, running: Iterable[Job]) -> bool:
+        """True if the slots job would run in are all taken"""
+        pool = self._pool(job)
+        used = sum(1 for other in running if self._pool(other) == pool)
+        return used >= (self.pools[pool] if pool else self.jobs)
+
+    def _pool(self, job: Job) -> Optional[str]:
+        return job.pool if job.pool in self.pools else None
+
+    @staticmethod
+    def _call(job: Job) -> bool:
+        try:
+            return bool(job.run())
+        except Exception as e:
+            # A bug in the job, not a task that failed: keep its traceback
+            import traceback
+
+            console.error(f"{job.name} crashed: {e!r}")
+            for line in traceback.format_exc().splitlines():
+                console.print(f"  {line}", color="bright_black")
+            return False
@@ -0,0 +1,160 @@
+"""
+Persistent bash session for tasks that share their environment.
+
+Tasks marked `shared_env: true` don't start a fresh `bash script`. They
+are sent as command lines over a control pipe to one long-lived bash
+coprocess, so variables a script exports (e.g. PATH from `brew shellenv`)
+are still set for the next shared task, and shell startup is paid once.
+
+Each command runs in a subshell, so `exit`, `set -e` or `cd` in a script
+can't end or disturb the session. When the subshell exits, an EXIT trap
+writes its exported variables to a file the session shell then sources;
+unset variables, functions and the working directory don't carry over.
+The command's output goes to the session's stdout, followed by a sentinel
+line with a per-session random marker and the exit status, which is how
+the reader knows where one task's output ends.
+"""
+
+import os
+import secrets
+import subprocess
+import threading
+from typing import TYPE_CHECKING, Optional, Union, List
+
+from lib.events import traced
+from lib.tasklog import LINE_LIMIT
+from lib.tui import console
+from utils.errors import TaskFailed
+
+if TYPE_CHECKING:
+    from lib.tasklog import TaskLog
+
+
+# fd 3 is the session's stdout; the file receives each command's exports
+_SETUP = """exec 3>&1
+__mi_env=$(mktemp) || exit 1
+trap 'rm -f "$__mi_env"' EXIT
+"""
+# Run by the command's subshell as it exits, also after `exit` or `set -e`
+_SAVE_ENV = 'unset OLDPWD PWD SHLVL; export -p >"$__mi_env"'
+
+
+class BashSession:
+    def __init__(self, shell: str = "/bin/bash") -> None:
+        self.shell = shell
+        self.marker = f"__macbook_init_done_{secrets.token_hex(8)}__".encode()
+        self._proc: Optional[subprocess.Popen] = None
+        self._stdin_fd: Optional[int] = None
+        self._started = 0
+        # One shell, so shared tasks take turns even with --jobs > 1
+        self._lock = threading.Lock()
+
+    def run(self, cmd: Union[str, List[str]], log: Optional["TaskLog"] = None):
+        """
+        Run cmd in the session; output goes to log, or to the console
+        without one. Raises TaskFailed if it exits non-zero.
+        """
+        if not isinstance(cmd, str):
+            cmd = " ".join(cmd)
+        with self._lock:
+            proc = self._proc if self._alive() else self._start()
+            assert proc.stdin is not None and proc.stdout is not None
+            proc.stdin.write(self._command(cmd).encode())
+            proc.stdin.flush()
+            returncode = self._read_output(proc.stdout, log)
+            if returncode is None:
+                # The session itself died, e.g. a script ran `exec` or `kill $$`
+                returncode = proc.wait()
+                self._proc = None
+
+        if returncode != 0:
+            tail = log.tail() if log else []
+            raise TaskFailed(cmd, returncode, tail=tail, log_path=log and log.path)
+        return subprocess.CompletedProcess(cmd, returncode)
+
+    def close(self):
+        with self._lock:
+            if self._proc is not None:
+                _stop(self._proc)
+                self._proc = None
+            if self._stdin_fd is not None:
+                os.close(self._stdin_fd)
+                self._stdin_fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    @traced("bash.session.start", "bash")
+    def _start(self) -> subprocess.Popen:
+        if self._started:
+            console.warning("Restarting the shared shell, exported variables are lost")
+        if self._stdin_fd is None:
+            # Tasks still read the terminal, the shell's own stdin is the control pipe
+            try:
+                self._stdin_fd = os.dup(0)
+            except OSError:
+                self._stdin_fd = None
+        self._proc = subprocess.Popen(
+            [self.shell, "--noprofile", "--norc", "-s"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            pass_fds=(self._stdin_fd,) if self._stdin_fd is not None else (),
+        )
+        assert self._proc.stdin is not None
+        self._proc.stdin.write(_SETUP.encode())
+        self._started += 1
+        return self._proc
+
+    def _command(self, cmd: str) -> str:
+        stdin = f"<&{self._stdin_fd}" if self._stdin_fd is not None else "</dev/null"
+        return (
+            ': >"$__mi_env"\n'
+            f"( trap '{_SAVE_ENV}' EXIT; {cmd}\n) 1>&3 2>&3 {stdin}; __mi_status=$?\n"
+            '. "$__mi_env" 2>/dev/null\n'
+            f"printf '\\n%s %d\\n' '{self.marker.decode()}' \"$__mi_status\"\n"
+        )
+
+    def _read_output(self, stdout, log: Optional["TaskLog"]) -> Optional[int]:
+        """Copy output until the sentinel line, its exit status or None on EOF"""
+        pending = b""
+        for line in iter(lambda: stdout.readline(LINE_LIMIT), b""):
+            if line.startswith(self.marker):
+                if pending and pending != b"\n":
+                    _emit(pending, log)
+                return int(line[len(self.marker) :])
+            if pending:
+                _emit(pending, log)
+            # Held back one line: the sentinel is preceded by a "\n" that
+            # ends an unterminated last line, or is an extra empty line
+            pending = line
+        if pending:
+            _emit(pending, log)
+        return None
+
+
+def _emit(line: bytes, log: Optional["TaskLog"]):
+    if log is not None:
+        log.write(line)
+    else:
+        console.print(line.decode(errors="replace").rstrip("\r\n"))
+
+
+def _stop(proc: subprocess.Popen):
+    try:
+        assert proc.stdin is not None
+        proc.stdin.write(b"exit\n")
+        proc.stdin.close()
+        proc.wait(timeout=5)
+    except (OSError, subprocess.TimeoutExpired):
+        proc.kill()
+        proc.wait()
+    if proc.stdout is not None:
+        proc.stdout.close()
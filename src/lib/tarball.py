@@ -0,0 +1,147 @@
+"""
+Streaming tarball installs.
+
+A `tarball` entry in tasks.json is downloaded and extracted in one pass:
+the HTTP response is read by tarfile's stream mode (`r|*`, any
+compression) and each member is written straight to its final place, so
+the archive itself never touches the disk.
+
+Members are extracted into a temporary directory next to the versioned
+destination, with the first `strip_components` path parts removed, and
+renamed into place once the whole body has been read and its SHA-256
+checked. A destination that already exists means that version is
+installed, and the entry is a no-op.
+
+With an offline bundle the archive is streamed out of the bundle the
+same way, instead of over HTTP; with a LAN peer cache it is streamed from
+the peer when the peer has it.
+"""
+
+import os
+import shutil
+import tarfile
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+
+from lib.bandwidth import bandwidth
+from lib.download import ProgressCallback, StreamReader, open_stream
+from lib.events import traced
+from lib.manifest import TarballEntry
+
+if TYPE_CHECKING:
+    from lib.bandwidth import Flow
+    from lib.bundle import Bundle
+    from lib.peer import PeerCache
+
+
+@dataclass
+class ExtractStats:
+    downloaded: int = 0
+    written: int = 0
+    files: int = 0
+    seconds: float = 0.0
+    installed: bool = True
+
+    def summary(self) -> str:
+        if not self.installed:
+            return "already installed"
+        return (
+            f"{self.downloaded / 1024**2:.1f} MB downloaded, "
+            f"{self.written / 1024**2:.1f} MB in {self.files} file(s) written "
+            f"in one pass, {self.seconds:.1f}s"
+        )
+
+
+def open_source(
+    url: str,
+    sha256: Optional[str],
+    progress: Optional[ProgressCallback] = None,
+    bundle: Optional["Bundle"] = None,
+    peer: Optional["PeerCache"] = None,
+    flow: Optional["Flow"] = None,
+) -> StreamReader:
+    """Stream url from the bundle, the peer cache or upstream"""
+    if bundle is not None:
+        # Read from disk, not the network, so not subject to the bandwidth cap
+        return bundle.open_stream(url, progress=progress, sha256=sha256)
+    from lib.peer import with_peer
+
+    # Only opening falls back to upstream, a stream can't switch halfway
+    return with_peer(
+        peer,
+        url,
+        sha256,
+        lambda source: open_stream(source, progress=progress, sha256=sha256, flow=flow),
+    )
+
+
+def _strip(name: str, count: int) -> Optional[str]:
+    parts = [p for p in name.split("/") if p not in ("", ".")]
+    return "/".join(parts[count:]) or None
+
+
+class TarballInstall:
+    def __init__(
+        self,
+        entry: TarballEntry,
+        bundle: Optional["Bundle"] = None,
+        peer: Optional["PeerCache"] = None,
+    ) -> None:
+        self.entry = entry
+        self.bundle = bundle
+        self.peer = peer
+        self.dest = os.path.abspath(os.path.expanduser(entry.dest))
+
+    @traced(
+        "tarball.install",
+        "tarball",
+        args=lambda self, *a, **kw: {"url": self.entry.url},
+    )
+    def run(self, progress: Optional[ProgressCallback] = None) -> ExtractStats:
+        if os.path.exists(self.dest):
+            return ExtractStats(installed=False)
+
+        parent = os.path.dirname(self.dest)
+        os.makedirs(parent, exist_ok=True)
+        tmp = os.path.join(parent, f".{os.path.basename(self.dest)}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        stats = ExtractStats()
+        began = time.perf_counter()
+        try:
+            with self._open(progress) as stream:
+                with tarfile.open(fileobj=stream, mode="r|*") as tar:
+                    tar.extractall(tmp, filter=self._filter(stats))
+                stream.verify()
+                stats.downloaded = stream.bytes_read
+            os.replace(tmp, self.dest)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        stats.seconds = time.perf_counter() - began
+        return stats
+
+    def _open(self, progress: Optional[ProgressCallback]) -> StreamReader:
+        flow = bandwidth.flow(self.entry.name, self.entry.priority, self.entry.weight)
+        return open_source(
+            self.entry.url, self.entry.sha256, progress, self.bundle, self.peer, flow
+        )
+
+    def _filter(self, stats: ExtractStats):
+        strip = self.entry.strip_components
+
+        def filter(member: tarfile.TarInfo, path: str) -> Optional[tarfile.TarInfo]:
+            name = _strip(member.name, strip)
+            if name is None:
+                return None
+            changes = {"name": name}
+            if member.islnk():
+                # Hard links name another member, which was stripped too
+                changes["linkname"] = _strip(member.linkname, strip)
+            # The data filter refuses absolute paths, `..` and links out of path
+            member = tarfile.data_filter(member.replace(**changes, deep=False), path)
+            if member.isfile():
+                stats.written += member.size
+                stats.files += 1
+            return member
+
+        return filter
@@ -0,0 +1,90 @@
+"""
+Per-task output capture.
+
+A task's combined stdout/stderr is read line by line from a pipe and
+written to its own gzip-compressed log file. Only the last few lines are
+kept in memory, in a bounded ring buffer, so even very chatty installers
+run in constant memory; those lines are shown when the task fails.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+from lib.tui import console
+
+DEFAULT_LOG_DIR = os.path.expanduser("~/Library/Logs/macbook-init")
+LOG_DIR_ENV = "MACBOOK_INIT_LOGS"
+DEFAULT_TAIL_LINES = 40
+# Longest chunk treated as one line (progress bars may never emit "\n")
+LINE_LIMIT = 8 * 1024
+
+
+def run_log_dir(root: Optional[str] = None) -> str:
+    """A fresh directory for this run's logs"""
+    root = root or os.environ.get(LOG_DIR_ENV) or DEFAULT_LOG_DIR
+    path = os.path.join(root, time.strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def log_file_name(name: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", name).strip("_").lower()
+    return f"{slug or 'task'}.log.gz"
+
+
+class TaskLog:
+    def __init__(
+        self,
+        path: str,
+        tail_lines: int = DEFAULT_TAIL_LINES,
+        echo: bool = True,
+        prefix: str = "",
+    ) -> None:
+        """
+        Args:
+            path: Log file to write (gzip)
+            tail_lines: How many trailing lines to keep in memory
+            echo: Also print each line to the console as it arrives
+            prefix: Printed before echoed lines, e.g. the task name
+        """
+        self.path = path
+        self.echo = echo
+        self.prefix = prefix
+        self.lines = 0
+        self._tail: deque = deque(maxlen=tail_lines)
+        self._lock = threading.Lock()
+        import gzip
+
+        self._file = gzip.open(path, "wb")
+
+    def write(self, data: bytes):
+        with self._lock:
+            self._file.write(data)
+            text = data.decode(errors="replace").rstrip("\r\n")
+            self._tail.append(text)
+            self.lines += 1
+        if self.echo:
+            console.print(f"{self.prefix}{text}")
+
+    def pump(self, stream):
+        """Copy a binary pipe into the log until EOF"""
+        for line in iter(lambda: stream.readline(LINE_LIMIT), b""):
+            self.write(line)
+
+    def tail(self) -> List[str]:
+        with self._lock:
+            return list(self._tail)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,4 +1,5 @@
 from .fp import FancyPrint
 from .dialog import confirm as confirm
+from .progress import progress as progress
 
 console = FancyPrint()
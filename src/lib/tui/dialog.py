@@ -1,6 +1,8 @@
 import sys
-import tty
-import termios
+import threading
+
+# Only one prompt may own the terminal at a time when tasks run in parallel
+_lock = threading.Lock()
 
 
 def confirm(prompt="Continue?", default=True):
@@ -14,6 +16,15 @@ def confirm(prompt="Continue?", default=True):
     Returns:
         True if Yes is selected, False if No is selected
     """
+    with _lock:
+        return _confirm(prompt=prompt, default=default)
+
+
+def _confirm(prompt="Continue?", default=True):
+    # Only needed when there is someone to ask, not for --validate and friends
+    import termios
+    import tty
+
     # ANSI color codes
     CYAN = "\033[96m"
     GREEN = "\033[92m"
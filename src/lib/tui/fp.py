@@ -1,7 +1,71 @@
 """
 Modern Fancy Print - A stylish console output library
+
+Escape sequences for each (color, bg, style) combination are built once
+and memoized. Output goes through a line sink: every thread buffers its
+own partial line and complete lines are written in a single locked write,
+so lines from parallel tasks never interleave mid-line. When stdout is
+not a TTY, or NO_COLOR is set, styling is skipped entirely.
 """
 
+import functools
+import os
+import sys
+import threading
+from typing import Optional, TextIO
+
+from .progress import progress as _progress
+
+
+class _LineSink:
+    """Per-thread line buffer in front of stdout"""
+
+    def __init__(self, stream: Optional[TextIO] = None) -> None:
+        self._stream = stream
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def stream(self) -> TextIO:
+        # Resolved late so redirected/captured stdout is honoured
+        return self._stream or sys.stdout
+
+    def write(self, data: str):
+        local = self._local
+        buf = getattr(local, "buf", "")
+        if buf:
+            data = buf + data
+        cut = data.rfind("\n") + 1
+        if cut == len(data):
+            # Common case: whole lines only, nothing left to hold back
+            if buf:
+                local.buf = ""
+            self._emit(data)
+            return
+        # A carriage return redraws the current line, show it right away
+        if "\r" in data[cut:]:
+            cut = len(data)
+        if cut:
+            self._emit(data[:cut])
+        local.buf = data[cut:]
+
+    def flush(self):
+        """Write out this thread's partial line, if any"""
+        buf = getattr(self._local, "buf", "")
+        if buf:
+            self._local.buf = ""
+            self._emit(buf)
+
+    def _emit(self, text: str):
+        if _progress.active:
+            # Keep live progress bars below regular output
+            _progress.write_above(text)
+            return
+        stream = self._stream or sys.stdout
+        with self._lock:
+            stream.write(text)
+            stream.flush()
+
 
 class FancyPrint:
     # ANSI color codes
@@ -65,26 +129,59 @@ class FancyPrint:
         "trophy": "🏆",
     }
 
-    @classmethod
-    def _apply_style(cls, text, color=None, bg=None, style=None):
-        """Apply color and style formatting to text"""
-        result = ""
+    _sink = _LineSink()
+    # (stream, color) for the last stream checked
+    _color = (None, False)
 
-        if style:
-            styles = style if isinstance(style, list) else [style]
-            for s in styles:
-                if s in cls.STYLES:
-                    result += cls.STYLES[s]
+    @classmethod
+    def use_color(cls) -> bool:
+        """Styling is on for a terminal, unless NO_COLOR/FORCE_COLOR say otherwise"""
+        stream = cls._sink.stream
+        if cls._color[0] is not stream:
+            FancyPrint._color = (stream, cls._detect_color(stream))
+        return cls._color[1]
+
+    @staticmethod
+    def _detect_color(stream) -> bool:
+        if os.environ.get("NO_COLOR"):
+            return False
+        if os.environ.get("FORCE_COLOR"):
+            return True
+        try:
+            return stream.isatty()
+        except (AttributeError, ValueError):
+            return False
 
+    @classmethod
+    @functools.lru_cache(maxsize=256)
+    def _style_prefix(cls, color=None, bg=None, style=None) -> str:
+        """Escape sequence for one style combination, style is a tuple"""
+        result = ""
+        for s in style or ():
+            if s in cls.STYLES:
+                result += cls.STYLES[s]
         if color and color in cls.COLORS:
             result += cls.COLORS[color]
-
         if bg and bg in cls.BG_COLORS:
             result += cls.BG_COLORS[bg]
-
-        result += str(text) + cls.RESET
         return result
 
+    @classmethod
+    def _apply_style(cls, text, color=None, bg=None, style=None):
+        """Apply color and style formatting to text"""
+        if not cls.use_color():
+            return str(text)
+        if isinstance(style, list):
+            style = tuple(style)
+        elif style:
+            style = (style,)
+        return cls._style_prefix(color, bg, style) + str(text) + cls.RESET
+
+    @classmethod
+    def flush(cls):
+        """Write out a partial line printed with end=\"\" by this thread"""
+        cls._sink.flush()
+
     @classmethod
     def print(
         cls,
@@ -123,8 +220,7 @@ class FancyPrint:
         if suffix:
             text = f"{text}{suffix}"
 
-        styled_text = cls._apply_style(text, color, bg, style)
-        print(styled_text, end=end)
+        cls._sink.write(cls._apply_style(text, color, bg, style) + end)
 
     @classmethod
     def success(cls, *args, **kwargs):
@@ -157,18 +253,19 @@ class FancyPrint:
         lines = text.split("\n")
         width = max(len(line) for line in lines) + padding * 2
 
-        border_color = color
-
         # Top border
-        cls.print("┌" + "─" * width + "┐", color=border_color)
+        rows = ["┌" + "─" * width + "┐"]
 
         # Content
         for line in lines:
             padded_line = " " * padding + line + " " * (width - len(line) - padding)
-            cls.print("│" + padded_line + "│", color=border_color)
+            rows.append("│" + padded_line + "│")
 
         # Bottom border
-        cls.print("└" + "─" * width + "┘", color=border_color)
+        rows.append("└" + "─" * width + "┘")
+
+        # A single write keeps the box together when tasks run in parallel
+        cls._sink.write("".join(cls._apply_style(row, color) + "\n" for row in rows))
 
     @classmethod
     def gradient(cls, text, colors=["blue", "cyan", "green"]):
@@ -176,14 +273,20 @@ class FancyPrint:
         if not text:
             return
 
-        chars_per_color = max(1, len(text) // len(colors))
-        result = ""
+        if not cls.use_color():
+            cls._sink.write(f"{text}\n")
+            return
 
-        for i, char in enumerate(text):
-            color_idx = min(i // chars_per_color, len(colors) - 1)
-            result += cls._apply_style(char, color=colors[color_idx])
+        # One escape sequence per run of same-colored characters
+        chars_per_color = max(1, len(text) // len(colors))
+        runs = []
+        for idx, color in enumerate(colors):
+            start = idx * chars_per_color
+            stop = len(text) if idx == len(colors) - 1 else start + chars_per_color
+            if start < len(text):
+                runs.append(cls._apply_style(text[start:stop], color=color))
 
-        print(result)
+        cls._sink.write("".join(runs) + "\n")
 
     @classmethod
     def rainbow(cls, text):
@@ -203,7 +306,7 @@ class FancyPrint:
         cls.print(f"\033[2K\r[{bar}] {percent_text}", color=color, end="")
 
         if current >= total:
-            print()  # New line when complete
+            cls._sink.write("\n")  # New line when complete
 
 
 # Create a convenient global instance
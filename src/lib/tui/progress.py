@@ -0,0 +1,220 @@
+"""
+Multi-line progress renderer.
+
+Progress callbacks only store numbers on a Bar; a background thread
+redraws all active bars at a fixed frame rate, so the cost of a callback
+doesn't depend on how often it fires. On a TTY every active download or
+task gets its own line with throughput, ETA and elapsed time. When stdout
+is not a TTY, plain status lines are printed every few seconds instead.
+"""
+
+import sys
+import threading
+import time
+from collections import deque
+from typing import List, Optional, TextIO
+
+BAR_WIDTH = 24
+LABEL_WIDTH = 28
+# Seconds of history used for the throughput estimate
+RATE_WINDOW = 3.0
+
+
+def format_bytes(n: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}" if unit != "B" else f"{int(n)} B"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    h, rem = divmod(seconds, 3600)
+    m, s = divmod(rem, 60)
+    return f"{h}:{m:02d}:{s:02d}" if h else f"{m:02d}:{s:02d}"
+
+
+class Bar:
+    """
+    Progress of one download or task. Calling it (or update()) is the hot
+    path and only stores two integers.
+    """
+
+    __slots__ = ("label", "done", "total", "started", "ended", "_samples")
+
+    def __init__(self, label: str, total: int = 0) -> None:
+        self.label = label
+        self.done = 0
+        self.total = total
+        self.started = time.monotonic()
+        self.ended: Optional[float] = None
+        self._samples: deque = deque()
+
+    def update(self, done: int, total: Optional[int] = None):
+        self.done = done
+        if total is not None:
+            self.total = total
+
+    # Usable directly as a download ProgressCallback(done, total)
+    __call__ = update
+
+    def elapsed(self, now: float) -> float:
+        return (self.ended or now) - self.started
+
+    def rate(self, now: float) -> float:
+        """Bytes per second over the last RATE_WINDOW seconds"""
+        samples = self._samples
+        samples.append((now, self.done))
+        while len(samples) > 2 and now - samples[0][0] > RATE_WINDOW:
+            samples.popleft()
+        t0, d0 = samples[0]
+        if now - t0 <= 0:
+            elapsed = self.elapsed(now)
+            return self.done / elapsed if elapsed > 0 else 0.0
+        return (self.done - d0) / (now - t0)
+
+    def render(self, now: float, width: int = BAR_WIDTH) -> str:
+        label = self.label[:LABEL_WIDTH].ljust(LABEL_WIDTH)
+        elapsed = format_duration(self.elapsed(now))
+        if self.total <= 0 and self.done <= 0:
+            state = "done" if self.ended else "running"
+            return f"{label} {state:<{width + 9}} {elapsed}"
+
+        rate = self.rate(now)
+        if self.total > 0:
+            fraction = min(self.done / self.total, 1.0)
+            filled = int(width * fraction)
+            bar = "■" * filled + "□" * (width - filled)
+            remaining = (self.total - self.done) / rate if rate > 0 else None
+            eta = "done" if self.ended else format_duration(remaining)
+            return (
+                f"{label} [{bar}] {fraction * 100:5.1f}% "
+                f"{format_bytes(rate)}/s ETA {eta} {elapsed}"
+            )
+        return f"{label} {format_bytes(self.done)} {format_bytes(rate)}/s {elapsed}"
+
+
+class ProgressRenderer:
+    def __init__(
+        self,
+        stream: Optional[TextIO] = None,
+        fps: float = 10.0,
+        plain_interval: float = 5.0,
+    ) -> None:
+        self._stream = stream
+        self.frame = 1.0 / fps
+        self.plain_interval = plain_interval
+        self._bars: List[Bar] = []
+        self._finished: List[Bar] = []
+        self._drawn = 0
+        self._last_plain = 0.0
+        self._lock = threading.RLock()
+        self._thread: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+
+    @property
+    def stream(self) -> TextIO:
+        # Resolved late so redirected/captured stdout is honoured
+        return self._stream or sys.stdout
+
+    @property
+    def active(self) -> bool:
+        return bool(self._bars)
+
+    def is_tty(self) -> bool:
+        try:
+            return self.stream.isatty()
+        except (AttributeError, ValueError):
+            return False
+
+    def add(self, label: str, total: int = 0) -> Bar:
+        bar = Bar(label, total)
+        with self._lock:
+            self._bars.append(bar)
+            if self._thread is None or not self._thread.is_alive():
+                self._wake.clear()
+                self._thread = threading.Thread(
+                    target=self._loop, name="progress", daemon=True
+                )
+                self._thread.start()
+        return bar
+
+    def finish(self, bar: Bar):
+        with self._lock:
+            if bar.ended is None:
+                bar.ended = time.monotonic()
+            if bar in self._bars:
+                self._bars.remove(bar)
+                self._finished.append(bar)
+            if not self._bars:
+                # Let the render thread draw its last frame and exit
+                self._wake.set()
+
+    def stop(self):
+        """Wait for the render thread to draw its final frame and exit"""
+        self._wake.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def write_above(self, text: str):
+        """Print text without tearing through the bars"""
+        with self._lock:
+            stream = self.stream
+            if self._drawn and self.is_tty():
+                stream.write(f"\033[{self._drawn}F\033[J")
+                self._drawn = 0
+            stream.write(text)
+            if self.is_tty():
+                self._draw_tty(time.monotonic())
+            stream.flush()
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.frame)
+            with self._lock:
+                if self._wake.is_set():
+                    if not self._bars:
+                        self._draw(time.monotonic(), final=True)
+                        self._thread = None
+                        return
+                    # New bars were added while stopping, keep going
+                    self._wake.clear()
+                self._draw(time.monotonic())
+
+    def _draw(self, now: float, final: bool = False):
+        if self.is_tty():
+            self._draw_tty(now)
+        else:
+            self._draw_plain(now, final)
+        self.stream.flush()
+
+    def _draw_tty(self, now: float):
+        out = []
+        if self._drawn:
+            out.append(f"\033[{self._drawn}F")
+        # Finished bars are printed once and scroll up with normal output
+        for bar in self._finished:
+            out.append(f"\033[2K{bar.render(now)}\n")
+        self._finished.clear()
+        for bar in self._bars:
+            out.append(f"\033[2K{bar.render(now)}\n")
+        out.append("\033[J")
+        self._drawn = len(self._bars)
+        self.stream.write("".join(out))
+
+    def _draw_plain(self, now: float, final: bool):
+        out = [f"{bar.render(now)}\n" for bar in self._finished]
+        self._finished.clear()
+        if final or now - self._last_plain >= self.plain_interval:
+            self._last_plain = now
+            out.extend(f"{bar.render(now)}\n" for bar in self._bars)
+        if out:
+            self.stream.write("".join(out))
+
+
+# Shared renderer, like `console`
+progress = ProgressRenderer()
@@ -1,77 +1,884 @@
-import json
-import re
+import argparse
+import dataclasses
+import os
+import sys
 from pathlib import Path
-from typing import List
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 
-from lib.dmg import DmgManagement
-from lib import bash
-from lib.tui import console
-from utils.errors import UserCancelled
+# Only what parsing the manifest needs is imported here. The stages that
+# download, mount or run anything import their modules when they start, so
+# --list/--validate/--dry-run stay fast.
+from lib.cache import DEFAULT_MAX_BYTES
+from lib.diskspace import DEFAULT_MIN_FREE
+from lib.events import events, write_chrome_trace
+from lib.journal import BASH, DMG, Journal, entry_digest, file_digest
+from lib.manifest import (
+    TAR,
+    ZIP,
+    DmgEntry,
+    GitEntry,
+    Manifest,
+    TarballEntry,
+    load_manifest,
+    task_dependencies,
+    validate_manifest,
+)
+from lib.plan import Plan, bash_key, dmg_key, git_key, load_approved, tarball_key
+from lib.scheduler import Job, Scheduler
+from lib.tasklog import DEFAULT_TAIL_LINES, TaskLog, log_file_name, run_log_dir
+from lib.tui import console, progress
+from utils.errors import (
+    ArchiveError,
+    BundleError,
+    ChecksumError,
+    DependencyError,
+    DownloadError,
+    GitError,
+    InsufficientSpace,
+    ManifestError,
+    PlanError,
+    TaskFailed,
+    UserCancelled,
+)
+
+if TYPE_CHECKING:
+    from lib.bundle import Bundle
+    from lib.cache import ArtifactCache
+    from lib.diskspace import AdmissionController
+    from lib.peer import PeerCache
+    from lib.prefetch import DmgPrefetcher
+    from lib.session import BashSession
 
 BASE_DIR = Path(__file__).parent.parent
 TASKS_FILE = BASE_DIR / "tasks.json"
+# git checkouts and tarballs: waiting on the network, not on a CPU
+FETCH_POOL = "fetch"
+
 
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Macbook initial setup")
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument(
+        "--list", action="store_true", help="List the tasks and DMGs and exit"
+    )
+    modes.add_argument(
+        "--validate",
+        action="store_true",
+        help="Check the manifest and exit non-zero if it has problems",
+    )
+    modes.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Show what would run, in which order, and exit",
+    )
+    modes.add_argument(
+        "--serve-cache",
+        nargs="?",
+        const="",
+        metavar="[HOST:]PORT",
+        help="Share the artifact cache with other Macs over HTTP "
+        "(default: 0.0.0.0:8642) until interrupted",
+    )
+    sources = parser.add_mutually_exclusive_group()
+    sources.add_argument(
+        "--tasks",
+        metavar="FILE",
+        help="Manifest to use, scripts are relative to it (default: tasks.json)",
+    )
+    sources.add_argument(
+        "--from-bundle",
+        metavar="FILE",
+        help="Install everything from an offline bundle made by "
+        "`python -m lib.bundle export`, without the network",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of bash tasks to run in parallel (default: 1)",
+    )
+    parser.add_argument(
+        "--prefetch-jobs",
+        type=int,
+        default=2,
+        help="Number of DMGs to download in the background (0 disables)",
+    )
+    parser.add_argument(
+        "--fetch-jobs",
+        "--git-jobs",
+        type=int,
+        default=4,
+        help="Number of git checkouts and tarballs to run at once, besides --jobs",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Artifact cache location (default: ~/Library/Caches/macbook-init)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        default=DEFAULT_MAX_BYTES / 1024**3,
+        help="Artifact cache size limit in GB (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--peer-cache",
+        metavar="URL",
+        help="Try a Mac running --serve-cache for DMGs and tarballs "
+        "before upstream, e.g. http://10.0.0.5:8642",
+    )
+    parser.add_argument(
+        "--max-bandwidth",
+        type=float,
+        metavar="MB/S",
+        help="Cap all downloads together at this many MB/s, shared out by the "
+        "priority and weight of each tasks.json entry (default: no cap)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't cache DMGs or git mirrors",
+    )
+    parser.add_argument(
+        "--min-free",
+        type=float,
+        default=DEFAULT_MIN_FREE / 1024**3,
+        help="Free disk space in GB to keep when admitting downloads and copies "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--fast-mount",
+        action="store_true",
+        help="Attach DMGs read-only without Finder, and skip hdiutil's "
+        "verification of DMGs whose pinned sha256 already matched",
+    )
+    parser.add_argument(
+        "--mount-root",
+        metavar="DIR",
+        help="Mount DMGs under DIR instead of /Volumes (implies --fast-mount)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip tasks and DMGs that completed in an earlier run and are unchanged",
+    )
+    parser.add_argument(
+        "--force",
+        action="append",
+        default=[],
+        metavar="NAME",
+        help="Re-run this task (name, DMG URL or DMG file name) even with --resume "
+        "or when its probe says it is installed",
+    )
+    parser.add_argument(
+        "--no-probe",
+        action="store_true",
+        help="Don't run the tasks.json probes, run everything",
+    )
+    parser.add_argument(
+        "--journal",
+        help="Run journal location "
+        "(default: ~/Library/Application Support/macbook-init/journal.json)",
+    )
+    approvals = parser.add_mutually_exclusive_group()
+    approvals.add_argument(
+        "--plan",
+        metavar="FILE",
+        help="Show every action, record the approvals in FILE and exit",
+    )
+    approvals.add_argument(
+        "--approve-plan",
+        metavar="FILE",
+        help="Run unattended using the approvals recorded in FILE",
+    )
+    parser.add_argument(
+        "--log-dir",
+        help="Where per-task logs go (default: ~/Library/Logs/macbook-init)",
+    )
+    parser.add_argument(
+        "--tail-lines",
+        type=int,
+        default=DEFAULT_TAIL_LINES,
+        help="Lines of output to show when a task fails (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--events",
+        metavar="FILE",
+        help="Append a JSON-lines record of every run phase to FILE",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Write a Chrome trace-event file of the run to FILE",
+    )
+    return parser.parse_args(argv if argv is not None else [])
 
-def parse_prefix(filename: str):
-    """Extract numeric prefix from filename for fallback ordering."""
-    match = re.match(r"(\d+)_", filename)
-    return int(match.group(1)) if match else float("inf")
 
+def run_bash_task(
+    script_path: Path,
+    show_log=True,
+    show_dialog=True,
+    log: Optional[TaskLog] = None,
+    session: Optional["BashSession"] = None,
+) -> bool:
+    """
+    Execute a bash script, returns True if it succeeded. With a session
+    the script is sourced there, so its exported variables carry over.
+    """
+    from lib import bash
 
-def run_bash_task(script_path: Path, show_log=True, show_dialog=True):
-    """Execute a bash script."""
-    cmd = f"bash {script_path}"
+    cmd = f"source {script_path}" if session else f"bash {script_path}"
 
     try:
-        bash.run(cmd, show_log=show_log, show_dialog=show_dialog)
+        bash.run(
+            cmd, show_log=show_log, show_dialog=show_dialog, log=log, session=session
+        )
+    except UserCancelled:
+        raise
+    except TaskFailed as e:
+        console.error(e)
+        for line in e.tail:
+            console.print(f"  {line}", color="bright_black")
+        console.info(f"Full log: {e.log_path}")
+        return False
     except BaseException as e:
         console.error(e)
+        return False
+    return True
 
 
-def run_dmg_tasks(urls: List[str]):
+def run_dmg_tasks(
+    entries: List[DmgEntry],
+    prefetcher: Optional["DmgPrefetcher"] = None,
+    cache: Optional["ArtifactCache"] = None,
+    journal: Optional[Journal] = None,
+    plan: Optional[Plan] = None,
+    admission: Optional["AdmissionController"] = None,
+    bundle: Optional["Bundle"] = None,
+    peer: Optional["PeerCache"] = None,
+    fast_mount: bool = False,
+    mount_root: Optional[str] = None,
+):
     """Execute DMG installation tasks."""
-    for url in urls:
-        dmg = DmgManagement(url=url, show_dialog=True)
+    import subprocess
+
+    from lib.dmg import DmgManagement
+
+    for entry in entries:
+        prefetched = prefetcher.take(entry.url) if prefetcher else None
+        dmg = DmgManagement(
+            url=entry.url,
+            show_dialog=True,
+            prefetched=prefetched,
+            cache=cache,
+            sha256=entry.sha256,
+            plan=plan,
+            admission=admission,
+            bundle=bundle,
+            peer=peer,
+            fast_mount=fast_mount or mount_root is not None,
+            mount_root=mount_root,
+            priority=entry.priority,
+            weight=entry.weight,
+        )
         try:
             dmg.run()
-            print()
+            console.print()
+            if journal:
+                journal.record(DMG, entry.url, dmg_digest(entry))
         except UserCancelled as e:
             console.warning(str(e))
-            console.info(f"Skipping {url}...\n")
+            console.info(f"Skipping {entry.url}...\n")
+            continue
+        except (
+            ArchiveError,
+            BundleError,
+            DownloadError,
+            InsufficientSpace,
+            OSError,
+            subprocess.CalledProcessError,
+        ) as e:
+            # Including those a background download hands over through result()
+            console.error(e)
+            console.info(f"Skipping {entry.url}...\n")
             continue
 
 
-def main():
-    # Load tasks
-    with open(TASKS_FILE) as f:
-        tasks_json = json.load(f)
+def dmg_digest(entry: DmgEntry) -> str:
+    raw = dataclasses.asdict(entry)
+    # How fast it downloads doesn't change what gets installed
+    del raw["priority"], raw["weight"]
+    return entry_digest(raw)
+
+
+def skip_completed_dmgs(entries: List[DmgEntry], journal: Journal) -> List[DmgEntry]:
+    """Drop DMGs the journal says are already installed"""
+    remaining = []
+    for entry in entries:
+        if journal.should_skip(DMG, entry.url, dmg_digest(entry), [entry.name]):
+            events.event("dmg.resumed", "dmg", dmg=entry.name)
+            console.info(f"Already installed {entry.name}, skipping")
+        else:
+            remaining.append(entry)
+    return remaining
+
+
+def skip_satisfied(manifest: Manifest, force: List[str]) -> Manifest:
+    """Run every probe at once and drop the entries that are already installed"""
+    from lib.probe import run_probes
+
+    forced = set(force) | {os.path.basename(name) for name in force}
+    probes = {n: p for n, p in manifest.probes.items() if n not in forced}
+    satisfied = [r for r in run_probes(probes) if r.satisfied]
+    if not satisfied:
+        return manifest
+
+    console.header("Already installed, skipping")
+    for result in satisfied:
+        events.event("probe.satisfied", "probe", task=result.name, reason=result.reason)
+        console.print(f" {result.name}: {result.reason}")
+    return manifest.without({r.name for r in satisfied})
 
-    bash_tasks = tasks_json.get("bash", [])
-    dmg_urls = tasks_json.get("dmg", [])
 
-    # Sort bash tasks by 'order', fallback to filename numeric prefix
-    bash_tasks.sort(key=lambda t: t.get("order", parse_prefix(Path(t["script"]).name)))
+def build_bash_jobs(
+    bash_tasks: List[Dict[str, Any]],
+    journal: Optional[Journal] = None,
+    plan: Optional[Plan] = None,
+    log_dir: Optional[str] = None,
+    tail_lines: int = DEFAULT_TAIL_LINES,
+    parallel: bool = False,
+    base_dir: Optional[Path] = None,
+    session: Optional["BashSession"] = None,
+) -> List[Job]:
+    """
+    Turn sorted bash tasks into scheduler jobs.
+
+    A task with a `depends_on` list only waits for the named tasks. A task
+    without it waits for the task before it, which keeps the old strictly
+    ordered behaviour for manifests that don't use `depends_on`.
+
+    With log_dir set, each task's output goes to its own log file; when
+    running in parallel, echoed lines are prefixed with the task name.
+
+    Tasks with `shared_env: true` run in session, one after another.
+    """
+    jobs: List[Job] = []
+    dependencies = task_dependencies(bash_tasks)
 
-    # Run bash tasks
     for task in bash_tasks:
         name: str = task["name"]
-        script_path: Path = BASE_DIR / task["script"]
-        show_log: bool = task.get("show_log", True)
-        show_dialog: bool = task.get("show_dialog", True)
+        log_opts = {"dir": log_dir, "tail_lines": tail_lines, "prefix": parallel}
+        shared = session if task.get("shared_env") else None
+        run = _bash_job(task, journal, plan, log_opts, base_dir, shared)
+        jobs.append(Job(name=name, run=run, depends_on=dependencies[name]))
+
+    return jobs
+
+
+def _bash_job(
+    task: Dict[str, Any],
+    journal: Optional[Journal] = None,
+    plan: Optional[Plan] = None,
+    log_opts: Optional[Dict[str, Any]] = None,
+    base_dir: Optional[Path] = None,
+    session: Optional["BashSession"] = None,
+):
+    name: str = task["name"]
+    script_path: Path = (base_dir or BASE_DIR) / task["script"]
+    show_log: bool = task.get("show_log", True)
+    show_dialog: bool = task.get("show_dialog", True) and plan is None
+
+    def run() -> bool:
+        digest = file_digest(str(script_path)) if script_path.is_file() else ""
+        if journal and journal.should_skip(BASH, name, digest, [task["script"]]):
+            events.event("bash.resumed", "bash", task=name)
+            console.info(f"Already completed {name}, skipping")
+            return True
 
         try:
             console.box(name)
-            run_bash_task(script_path, show_log=show_log, show_dialog=show_dialog)
+            if plan is not None and not plan.approved(bash_key(name)):
+                raise UserCancelled(f"Not approved in plan: {name}")
+            log = _open_log(name, log_opts)
+            bar = progress.add(name)
+            try:
+                ok = run_bash_task(
+                    script_path,
+                    show_log=show_log,
+                    show_dialog=show_dialog,
+                    log=log,
+                    session=session,
+                )
+            finally:
+                progress.finish(bar)
+                if log:
+                    log.close()
+            if ok and journal:
+                journal.record(BASH, name, digest)
+            return ok
         except UserCancelled as e:
             console.warning(str(e))
             console.info(f"Skipping {name}...\n")
-            continue
+            return False
+
+    return run
+
+
+def build_git_jobs(
+    entries: List[GitEntry],
+    plan: Optional[Plan] = None,
+    mirrors: Optional[str] = None,
+    bundle: Optional["Bundle"] = None,
+) -> List[Job]:
+    """
+    One scheduler job per git checkout, in the fetch pool. Bash tasks can
+    depend on them by name; they wait for nothing unless `depends_on` says so.
+    """
+    return [
+        Job(
+            name=entry.name,
+            run=_git_job(entry, plan, mirrors, bundle),
+            depends_on=list(entry.depends_on),
+            pool=FETCH_POOL,
+        )
+        for entry in entries
+    ]
+
+
+def _git_job(
+    entry: GitEntry,
+    plan: Optional[Plan],
+    mirrors: Optional[str],
+    bundle: Optional["Bundle"] = None,
+):
+    def run() -> bool:
+        from lib.git import GitCheckout
+
+        if plan is not None and not plan.approved(git_key(entry.name)):
+            console.warning(f"Not approved in plan: {entry.name}")
+            console.info(f"Skipping {entry.name}...\n")
+            return False
+
+        bar = progress.add(entry.name)
+        try:
+            result = GitCheckout(entry, mirrors, bundle).run()
+        except TaskFailed as e:
+            console.error(f"{entry.name}: {e}")
+            for line in e.tail:
+                console.print(f"  {line}", color="bright_black")
+            return False
+        except (BundleError, ChecksumError, GitError, OSError) as e:
+            console.error(f"{entry.name}: {e}")
+            return False
+        finally:
+            progress.finish(bar)
+        console.success(f"{entry.name}: {result} {entry.dest}")
+        return True
+
+    return run
+
+
+def build_tarball_jobs(
+    entries: List[TarballEntry],
+    plan: Optional[Plan] = None,
+    bundle: Optional["Bundle"] = None,
+    peer: Optional["PeerCache"] = None,
+) -> List[Job]:
+    """One fetch-pool job per tarball, like build_git_jobs"""
+    return [
+        Job(
+            name=entry.name,
+            run=_tarball_job(entry, plan, bundle, peer),
+            depends_on=list(entry.depends_on),
+            pool=FETCH_POOL,
+        )
+        for entry in entries
+    ]
+
+
+def _tarball_job(
+    entry: TarballEntry,
+    plan: Optional[Plan],
+    bundle: Optional["Bundle"] = None,
+    peer: Optional["PeerCache"] = None,
+):
+    def run() -> bool:
+        import tarfile
+
+        from lib.tarball import TarballInstall
+
+        if plan is not None and not plan.approved(tarball_key(entry.name)):
+            console.warning(f"Not approved in plan: {entry.name}")
+            console.info(f"Skipping {entry.name}...\n")
+            return False
+
+        bar = progress.add(entry.name)
+        try:
+            stats = TarballInstall(entry, bundle, peer).run(progress=bar)
+        except (BundleError, DownloadError, OSError, tarfile.TarError) as e:
+            console.error(f"{entry.name}: {e}")
+            return False
+        finally:
+            progress.finish(bar)
+        console.success(f"{entry.name}: {stats.summary()}, {entry.dest}")
+        return True
+
+    return run
+
+
+def _open_log(name: str, log_opts: Optional[Dict[str, Any]]) -> Optional[TaskLog]:
+    if not log_opts or not log_opts["dir"]:
+        return None
+    return TaskLog(
+        os.path.join(log_opts["dir"], log_file_name(name)),
+        tail_lines=log_opts["tail_lines"],
+        prefix=f"[{name}] " if log_opts["prefix"] else "",
+    )
+
+
+def _report_skip(job: Job, blocker: str):
+    events.event("bash.skipped", "bash", task=job.name, blocker=blocker)
+    console.warning(f"Skipping {job.name}: depends on '{blocker}' which did not run")
+
+
+def main(argv: Optional[List[str]] = None) -> Optional[int]:
+    args = parse_args(argv)
+    if args.serve_cache is not None:
+        return serve_cache(args)
+    if args.from_bundle:
+        return main_from_bundle(args, argv)
+
+    tasks_file = Path(args.tasks) if args.tasks else TASKS_FILE
+    base_dir = tasks_file.resolve().parent if args.tasks else BASE_DIR
+    return _main(args, argv, tasks_file, base_dir)
+
+
+def main_from_bundle(args: argparse.Namespace, argv: Optional[List[str]]):
+    """Run with tasks.json and scripts from the bundle, and no downloads"""
+    from lib.bundle import Bundle
+
+    try:
+        bundle = Bundle(args.from_bundle)
+    except BundleError as e:
+        console.error(e)
+        return 1
+    with bundle:
+        try:
+            tasks_file = Path(bundle.extract_files())
+        except (BundleError, ChecksumError, OSError) as e:
+            console.error(e)
+            return 1
+        return _main(args, argv, tasks_file, tasks_file.parent, bundle)
+
+
+def serve_cache(args: argparse.Namespace) -> int:
+    """--serve-cache: share the artifact cache with --peer-cache clients"""
+    from lib.cache import ArtifactCache
+    from lib.peer import CacheServer, parse_address
+
+    # Only what this Mac's own tasks.json downloads is fetched for peers
+    tasks_file = Path(args.tasks) if args.tasks else TASKS_FILE
+    try:
+        manifest = load_manifest(str(tasks_file))
+    except (OSError, ManifestError) as e:
+        console.error(e)
+        return 1
+    urls = [entry.url for entry in [*manifest.dmg, *manifest.tarball]]
+
+    cache = ArtifactCache(root=args.cache_dir, max_bytes=int(args.cache_size * 1024**3))
+    try:
+        host, port = parse_address(args.serve_cache)
+        server = CacheServer(cache, host, port, urls=urls)
+    except (OSError, ValueError) as e:
+        console.error(f"Can't serve on {args.serve_cache!r}: {e}")
+        return 1
+    with server:
+        console.info(f"Serving {cache.root} on {server.url}, Ctrl-C to stop")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    console.info(cache.stats.summary())
+    return 0
+
+
+def _main(
+    args: argparse.Namespace,
+    argv: Optional[List[str]],
+    tasks_file: Path,
+    base_dir: Path,
+    bundle: Optional["Bundle"] = None,
+) -> Optional[int]:
+    if args.list or args.validate or args.dry_run:
+        return inspect_manifest(args, tasks_file, base_dir)
+
+    events.open(args.events, keep=bool(args.trace))
+    try:
+        with events.span("main", argv=argv or []):
+            return _run(args, tasks_file, base_dir, bundle)
+    finally:
+        records = events.records
+        events.close()
+        if args.trace and records is not None:
+            write_chrome_trace(records, args.trace)
+            console.info(f"Trace written to {args.trace}")
+
+
+def inspect_manifest(args: argparse.Namespace, tasks_file: Path, base_dir: Path) -> int:
+    """--list, --validate and --dry-run: read the manifest, change nothing"""
+    try:
+        manifest = load_manifest(str(tasks_file))
+    except (OSError, ManifestError) as e:
+        console.error(e)
+        return 1
+
+    if args.list:
+        list_manifest(manifest)
+        return 0
+
+    problems = validate_manifest(manifest, str(base_dir))
+    for problem in problems:
+        console.error(problem)
+    if problems:
+        return 1
+    if args.validate:
+        console.success(
+            f"{tasks_file} is valid: {len(manifest.bash)} bash task(s), "
+            f"{len(manifest.git)} git checkout(s), "
+            f"{len(manifest.tarball)} tarball(s), {len(manifest.dmg)} DMG(s)"
+        )
+    else:
+        show_dry_run(manifest, args.jobs, args.fetch_jobs)
+    return 0
+
+
+def list_manifest(manifest: Manifest):
+    dependencies = task_dependencies(manifest.bash)
+    console.header("Bash tasks")
+    for task in manifest.bash:
+        deps = dependencies[task["name"]]
+        after = f" (after {', '.join(deps)})" if deps else ""
+        shared = " (shared env)" if task.get("shared_env") else ""
+        probe = _probe_note(manifest, task["name"])
+        console.print(f" {task['name']}: {task['script']}{after}{shared}{probe}")
+    if manifest.git:
+        console.header("Git checkouts")
+    for git in manifest.git:
+        ref = f" @ {git.ref}" if git.ref else ""
+        after = f" (after {', '.join(git.depends_on)})" if git.depends_on else ""
+        probe = _probe_note(manifest, git.name)
+        console.print(f" {git.name}: {git.repo}{ref} -> {git.dest}{after}{probe}")
+    if manifest.tarball:
+        console.header("Tarballs")
+    for tar in manifest.tarball:
+        after = f" (after {', '.join(tar.depends_on)})" if tar.depends_on else ""
+        probe = _probe_note(manifest, tar.name)
+        console.print(f" {tar.name}: {tar.url} -> {tar.dest}{after}{probe}")
+    console.header("DMGs")
+    for entry in manifest.dmg:
+        pinned = " (sha256 pinned)" if entry.sha256 else ""
+        probe = _probe_note(manifest, entry.name)
+        console.print(f" {entry.name}: {entry.url}{pinned}{probe}")
+
+
+def _probe_note(manifest: Manifest, name: str) -> str:
+    probe = manifest.probes.get(name)
+    if probe is None:
+        return ""
+    return (
+        f" (skipped if {probe.path} exists)"
+        if probe.path
+        else (f" (skipped if `{probe.command}` succeeds)")
+    )
+
+
+def show_dry_run(manifest: Manifest, jobs: int, fetch_jobs: int = 4):
+    """Print the stages the scheduler would run, tasks in a stage run together"""
+    dependencies = task_dependencies(manifest.bash)
+    fetches = manifest.fetches()
+    dependencies.update({f.name: list(f.depends_on) for f in fetches})
+    names = [f.name for f in fetches] + [t["name"] for t in manifest.bash]
+    stage: Dict[str, int] = {}
+    for name in names:
+        # Sorted tasks may depend on later ones, resolve until stable
+        _stage_of(name, dependencies, stage)
+
+    stages: Dict[int, List[str]] = {}
+    for name in names:
+        stages.setdefault(stage[name], []).append(name)
+
+    title = f"Bash tasks, up to {max(1, jobs)} at a time"
+    if fetches:
+        title += f", and up to {max(1, fetch_jobs)} checkouts and tarballs"
+    console.header(title)
+    for number in sorted(stages):
+        console.print(f" {number + 1}. {', '.join(stages[number])}")
+    console.header("Then DMGs, one after another")
+    steps = {
+        None: "download, mount, copy, detach, clean up",
+        ZIP: "download, extract, clean up",
+        TAR: "extract while downloading",
+    }
+    for entry in manifest.dmg:
+        console.print(f" {entry.name}: {steps[entry.archive]}")
+
+
+def _stage_of(name: str, dependencies: Dict[str, List[str]], stage: Dict[str, int]):
+    if name not in stage:
+        deps = dependencies[name]
+        stage[name] = 1 + max(
+            (_stage_of(dep, dependencies, stage) for dep in deps), default=-1
+        )
+    return stage[name]
+
+
+def _run(
+    args: argparse.Namespace,
+    tasks_file: Path,
+    base_dir: Path,
+    bundle: Optional["Bundle"] = None,
+) -> Optional[int]:
+    from lib.cache import ArtifactCache
+    from lib.diskspace import AdmissionController
+    from lib.bandwidth import bandwidth
+    from lib.git import mirror_root
+    from lib.httpclient import warm_up
+    from lib.peer import PeerCache
+    from lib.prefetch import DmgPrefetcher
+    from lib.session import BashSession
+
+    manifest = load_manifest(str(tasks_file))
+    if args.plan:
+        # A plan is replayed on other Macs, it covers what this one already has
+        plan = Plan.build(manifest.bash, manifest.dmg, manifest.git, manifest.tarball)
+        plan.ask()
+        plan.save(args.plan)
+        console.success(f"Plan saved to {args.plan}")
+        return
+
+    # Minus what the probes find installed
+    if not args.no_probe:
+        manifest = skip_satisfied(manifest, args.force)
+    bash_tasks = manifest.bash
+    dmg_entries = manifest.dmg
+
+    git_entries = manifest.git
+    tarball_entries = manifest.tarball
+
+    journal = Journal(path=args.journal, resume=args.resume, force=args.force)
+    dmg_entries = skip_completed_dmgs(dmg_entries, journal)
+
+    if args.max_bandwidth:
+        bandwidth.configure(args.max_bandwidth * 1024**2)
+
+    # Look up every download host while the plan is being answered
+    if bundle is None:
+        warm_up(
+            [
+                *(e.url for e in dmg_entries),
+                *(t.url for t in tarball_entries),
+                *(g.repo for g in git_entries),
+                *([args.peer_cache] if args.peer_cache else []),
+            ]
+        )
+
+    # Every approval is settled here, nothing prompts once work has started
+    if args.approve_plan:
+        try:
+            plan = load_approved(
+                args.approve_plan, bash_tasks, dmg_entries, git_entries, tarball_entries
+            )
+        except PlanError as e:
+            console.error(e)
+            return 1
+    else:
+        plan = Plan.build(bash_tasks, dmg_entries, git_entries, tarball_entries)
+        plan.ask()
+
+    peer = PeerCache(args.peer_cache) if args.peer_cache and not bundle else None
+
+    # Everything comes out of the bundle, the cache would only add a copy
+    cache = None
+    if dmg_entries and not args.no_cache and bundle is None:
+        cache = ArtifactCache(
+            root=args.cache_dir, max_bytes=int(args.cache_size * 1024**3), peer=peer
+        )
+
+    # Downloads and copies only start when the disk has room for them
+    admission = None
+    if dmg_entries:
+        admission = AdmissionController(min_free=int(args.min_free * 1024**3))
+
+    # Start downloading DMGs while the bash tasks run
+    prefetcher = None
+    # Tar archives are extracted as they download, there's nothing to prefetch
+    to_fetch = [
+        e
+        for e in dmg_entries
+        if e.archive != TAR and plan.approved(dmg_key(e.url, "download"))
+    ]
+    if to_fetch and args.prefetch_jobs > 0:
+        prefetcher = DmgPrefetcher(
+            to_fetch,
+            workers=args.prefetch_jobs,
+            cache=cache,
+            admission=admission,
+            bundle=bundle,
+            peer=peer,
+        )
+        console.info(f"Downloading {len(to_fetch)} DMG(s) in the background")
+        prefetcher.start()
+
+    # Only started once a shared_env task runs
+    session = BashSession()
+    try:
+        # Run bash tasks
+        scheduler = Scheduler(
+            jobs=args.jobs, on_skip=_report_skip, pools={FETCH_POOL: args.fetch_jobs}
+        )
+        mirrors = None if args.no_cache or bundle else mirror_root(args.cache_dir)
+        jobs = build_git_jobs(git_entries, plan, mirrors, bundle)
+        jobs += build_tarball_jobs(tarball_entries, plan, bundle, peer)
+        jobs += build_bash_jobs(
+            bash_tasks,
+            journal,
+            plan,
+            log_dir=run_log_dir(args.log_dir),
+            tail_lines=args.tail_lines,
+            parallel=args.jobs > 1,
+            base_dir=base_dir,
+            session=session,
+        )
+        try:
+            scheduler.run(jobs)
+        except DependencyError as e:
+            console.error(e)
+            return 1
+        session.close()
 
-    # Run DMG tasks
-    if dmg_urls:
-        console.box("Installing DMG applications", color="green")
-        run_dmg_tasks(dmg_urls)
+        # Run DMG tasks
+        if dmg_entries:
+            console.box("Installing DMG applications", color="green")
+            run_dmg_tasks(
+                dmg_entries,
+                prefetcher=prefetcher,
+                cache=cache,
+                journal=journal,
+                plan=plan,
+                admission=admission,
+                bundle=bundle,
+                peer=peer,
+                fast_mount=args.fast_mount,
+                mount_root=args.mount_root,
+            )
+    finally:
+        session.close()
+        if prefetcher:
+            prefetcher.shutdown()
+        progress.stop()
+        if cache:
+            console.info(cache.stats.summary())
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main(sys.argv[1:]))
@@ -1,6 +1,32 @@
 # tests/conftest.py
+import os
+import shutil
+import subprocess
+import tempfile
+
 import pytest
 from pytest import MonkeyPatch
+from lib.download import Downloader
+from lib.fastcopy import CopyStats
+from lib.git import UNCHANGED, GitCheckout
+from lib.httpclient import HttpClient
+from lib.session import BashSession
+from lib.tarball import ExtractStats, TarballInstall
+
+# Captured before the autouse fixtures below replace them
+_REAL_IO = {
+    "subprocess.run": subprocess.run,
+    "os.listdir": os.listdir,
+    "os.path.exists": os.path.exists,
+    "shutil.copytree": shutil.copytree,
+    "shutil.rmtree": shutil.rmtree,
+    "tempfile.mkdtemp": tempfile.mkdtemp,
+    "lib.download.Downloader.run": Downloader.run,
+    "lib.httpclient.HttpClient.warm_up": HttpClient.warm_up,
+    "lib.session.BashSession.run": BashSession.run,
+    "lib.git.GitCheckout.run": GitCheckout.run,
+    "lib.tarball.TarballInstall.run": TarballInstall.run,
+}
 
 
 @pytest.fixture(autouse=True)
@@ -16,6 +42,25 @@ def fake_subprocess_run(monkeypatch: MonkeyPatch):
     return fake_run
 
 
+@pytest.fixture(autouse=True)
+def fake_bash_session(monkeypatch: MonkeyPatch):
+    """shared_env tasks would otherwise run for real in a bash coprocess"""
+    monkeypatch.setattr(
+        "lib.session.BashSession.run",
+        lambda self, cmd, log=None: subprocess.CompletedProcess(cmd, 0),
+    )
+
+
+@pytest.fixture(autouse=True)
+def fake_git_checkout(monkeypatch: MonkeyPatch):
+    """tasks.json's git entries would otherwise clone into $HOME"""
+    monkeypatch.setattr("lib.git.GitCheckout.run", lambda self: UNCHANGED)
+    monkeypatch.setattr(
+        "lib.tarball.TarballInstall.run",
+        lambda self, progress=None: ExtractStats(installed=False),
+    )
+
+
 class FakeConsole:
     def warning(self, *a, **kw):
         pass
@@ -44,15 +89,14 @@ def patch_tui(monkeypatch: MonkeyPatch):
     monkeypatch.setattr("lib.bash.confirm", make_fake_confirm(True))
     monkeypatch.setattr("lib.dmg.console", FakeConsole())
     monkeypatch.setattr("lib.dmg.confirm", make_fake_confirm(True))
+    monkeypatch.setattr("lib.plan.confirm", make_fake_confirm(True))
 
     yield
 
 
 @pytest.fixture(autouse=True)
-def patch_urllib(monkeypatch: MonkeyPatch):
-    monkeypatch.setattr(
-        "lib.dmg.urllib.request.urlretrieve", lambda url, dest, reporthook=None: None
-    )
+def patch_download(monkeypatch: MonkeyPatch):
+    monkeypatch.setattr("lib.dmg.download", lambda url, dest, **kwargs: dest)
 
 
 @pytest.fixture(autouse=True)
@@ -67,4 +111,44 @@ def patch_os_shutil(monkeypatch: MonkeyPatch):
     monkeypatch.setattr("lib.dmg.os.listdir", lambda path: ["test.app"])
     monkeypatch.setattr("lib.dmg.os.path.exists", lambda p: False)
     monkeypatch.setattr("lib.dmg.shutil.copytree", lambda *a, **kw: None)
+    monkeypatch.setattr("lib.dmg.copy_tree", lambda *a, **kw: CopyStats())
     monkeypatch.setattr("lib.dmg.shutil.rmtree", lambda *a, **kw: None)
+
+
+@pytest.fixture(autouse=True)
+def no_network(monkeypatch: MonkeyPatch, tmp_path_factory):
+    """Keep downloads and the artifact cache away from the network and $HOME"""
+
+    def fake_run(self):
+        open(self.dest, "wb").close()
+        return self.dest
+
+    monkeypatch.setattr("lib.download.Downloader.run", fake_run)
+    monkeypatch.setattr("lib.httpclient.HttpClient.warm_up", lambda self, urls: None)
+    monkeypatch.setenv("MACBOOK_INIT_CACHE", str(tmp_path_factory.mktemp("cache")))
+
+
+@pytest.fixture(autouse=True)
+def isolate_state(monkeypatch: MonkeyPatch, tmp_path_factory):
+    journal = tmp_path_factory.mktemp("journal") / "journal.json"
+    monkeypatch.setenv("MACBOOK_INIT_JOURNAL", str(journal))
+    monkeypatch.setenv("MACBOOK_INIT_LOGS", str(tmp_path_factory.mktemp("logs")))
+    sizes = tmp_path_factory.mktemp("sizes") / "sizes.json"
+    monkeypatch.setenv("MACBOOK_INIT_SIZES", str(sizes))
+
+
+@pytest.fixture
+def real_io(
+    monkeypatch: MonkeyPatch,
+    patch_os_shutil,
+    patch_tempfile,
+    no_network,
+    fake_bash_session,
+    fake_git_checkout,
+):
+    """
+    Undo the global filesystem/subprocess/network fakes for tests that work
+    on a real temporary directory or a local test server.
+    """
+    for target, func in _REAL_IO.items():
+        monkeypatch.setattr(target, func)
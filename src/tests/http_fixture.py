@@ -0,0 +1,148 @@
+"""
+Local stand-in for a download server.
+
+Serves in-memory files with ETags, optional Range support, bandwidth
+throttling and a one-shot connection drop to simulate flaky networks.
+"""
+
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+
+class FileServer:
+    def __init__(
+        self,
+        files: Dict[str, bytes],
+        ranges: bool = True,
+        rate: Optional[int] = None,
+        drop_after: Optional[int] = None,
+        redirects: Optional[Dict[str, str]] = None,
+        failures: Optional[List[int]] = None,
+    ) -> None:
+        """
+        Args:
+            files: Mapping of URL path (e.g. "/app.dmg") to content
+            ranges: Whether to honour Range requests and send Accept-Ranges
+            rate: Throttle each response to this many bytes per second
+            drop_after: Close the first response after sending this many bytes
+            redirects: Mapping of URL path to the Location it redirects to
+            failures: Statuses to answer the first requests with, e.g. [503]
+        """
+        self.files = files
+        self.ranges = ranges
+        self.rate = rate
+        self.drop_after = drop_after
+        self.redirects = redirects or {}
+        self.failures = list(failures or [])
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, args=(0.05,), daemon=True
+        )
+
+    def url(self, path: str) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{path}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _should_drop(self) -> Optional[int]:
+        with self._lock:
+            limit, self.drop_after = self.drop_after, None
+            return limit
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self._serve(body=False)
+
+            def do_GET(self):
+                self._serve(body=True)
+
+            def _serve(self, body: bool):
+                server.requests.append((self.command, self.path, dict(self.headers)))
+                with server._lock:
+                    failure = server.failures.pop(0) if server.failures else None
+                if failure is not None:
+                    self.send_error(failure)
+                    return
+                if self.path in server.redirects:
+                    self.send_response(302)
+                    self.send_header("Location", server.redirects[self.path])
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                data = server.files.get(self.path)
+                if data is None:
+                    self.send_error(404)
+                    return
+
+                etag = '"%s"' % hashlib.sha256(data).hexdigest()[:16]
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                start, end = 0, len(data) - 1
+                status = 200
+                range_header = self.headers.get("Range")
+                if server.ranges and range_header and range_header.startswith("bytes="):
+                    first, _, last = range_header[6:].partition("-")
+                    start = int(first)
+                    end = min(int(last), len(data) - 1) if last else len(data) - 1
+                    status = 206
+
+                self.send_response(status)
+                self.send_header("Content-Length", str(end - start + 1))
+                self.send_header("ETag", etag)
+                if server.ranges:
+                    self.send_header("Accept-Ranges", "bytes")
+                if status == 206:
+                    self.send_header(
+                        "Content-Range", f"bytes {start}-{end}/{len(data)}"
+                    )
+                self.end_headers()
+                if body:
+                    self._write(data[start : end + 1])
+
+            def _write(self, payload: bytes):
+                drop = server._should_drop()
+                chunk = 16 * 1024
+                sent = 0
+                began = time.monotonic()
+                while sent < len(payload):
+                    if drop is not None and sent >= drop:
+                        self.close_connection = True
+                        return
+                    piece = payload[sent : sent + chunk]
+                    try:
+                        self.wfile.write(piece)
+                    except (BrokenPipeError, ConnectionResetError):
+                        return
+                    sent += len(piece)
+                    if server.rate:
+                        ahead = sent / server.rate - (time.monotonic() - began)
+                        if ahead > 0:
+                            time.sleep(ahead)
+
+        return Handler
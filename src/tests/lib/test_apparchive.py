@@ -0,0 +1,151 @@
+import hashlib
+import io
+import os
+import stat
+import tarfile
+import zipfile
+
+import pytest
+from pytest import MonkeyPatch
+
+from lib.apparchive import app_path, extract_zip
+from lib.dmg import DmgManagement
+from lib.download import download
+from tests.http_fixture import FileServer
+from utils.errors import ArchiveError
+
+BINARY = os.urandom(64 * 1024)
+
+
+def make_zip(extra=()) -> bytes:
+    """Like a release zip: the app under a versioned directory, plus clutter"""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+
+        def add(name, data=b"", mode=0o644, kind=stat.S_IFREG):
+            info = zipfile.ZipInfo(name)
+            info.create_system = 3
+            info.external_attr = (kind | mode) << 16
+            zf.writestr(info, data)
+
+        add("Foo-1.2/Foo.app/", mode=0o755, kind=stat.S_IFDIR)
+        add("Foo-1.2/Foo.app/Contents/MacOS/foo", BINARY, mode=0o755)
+        add("Foo-1.2/Foo.app/Contents/Info.plist", b"<plist/>")
+        add("Foo-1.2/Foo.app/Contents/Frameworks/A/lib.dylib", b"lib", mode=0o755)
+        add("Foo-1.2/Foo.app/Contents/Frameworks/Current", b"A", kind=stat.S_IFLNK)
+        add("Foo-1.2/README.md", b"readme")
+        add("__MACOSX/Foo-1.2/Foo.app/._Info.plist", b"fork")
+        for name, data, kind in extra:
+            add(name, data, kind=kind)
+    return buf.getvalue()
+
+
+def make_tar_xz() -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:xz") as tar:
+
+        def add(name, data=b"", **kw):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            for key, value in kw.items():
+                setattr(info, key, value)
+            tar.addfile(info, io.BytesIO(data))
+
+        add("Bar.app/Contents/MacOS/bar", BINARY, mode=0o755)
+        add("Bar.app/Contents/Info.plist", b"<plist/>", mode=0o644)
+        add(
+            "Bar.app/Contents/Resources/bar",
+            type=tarfile.SYMTYPE,
+            linkname="../MacOS/bar",
+        )
+    return buf.getvalue()
+
+
+def assert_app(app: str, binary: str):
+    assert open(os.path.join(app, "Contents", "MacOS", binary), "rb").read() == BINARY
+    assert os.stat(os.path.join(app, "Contents", "MacOS", binary)).st_mode & 0o111
+    assert not os.stat(os.path.join(app, "Contents", "Info.plist")).st_mode & 0o111
+
+
+def test_zip_keeps_modes_and_symlinks(real_io, tmp_path):
+    path = tmp_path / "Foo.zip"
+    path.write_bytes(make_zip())
+    dest = tmp_path / "out"
+
+    stats = extract_zip(str(path), str(dest), workers=4)
+
+    assert os.listdir(dest) == ["Foo.app"]
+    assert_app(str(dest / "Foo.app"), "foo")
+    frameworks = dest / "Foo.app" / "Contents" / "Frameworks"
+    assert os.readlink(frameworks / "Current") == "A"
+    assert (frameworks / "Current" / "lib.dylib").read_bytes() == b"lib"
+    assert stats.files == 3
+
+
+def test_zip_symlink_out_of_the_archive_is_refused(real_io, tmp_path):
+    path = tmp_path / "Evil.zip"
+    path.write_bytes(make_zip([("Foo.app/Contents/x", b"../../../etc", stat.S_IFLNK)]))
+
+    with pytest.raises(ArchiveError):
+        extract_zip(str(path), str(tmp_path / "out"))
+
+
+def test_zip_chained_symlinks_out_of_the_archive_are_refused(real_io, tmp_path):
+    # Each looks harmless on its own, together b points two levels above out/
+    path = tmp_path / "Evil.zip"
+    path.write_bytes(
+        make_zip(
+            [
+                ("Foo.app/a", b".", stat.S_IFLNK),
+                ("Foo.app/a/b", b"../../x", stat.S_IFLNK),
+            ]
+        )
+    )
+
+    with pytest.raises(ArchiveError):
+        extract_zip(str(path), str(tmp_path / "out"))
+    assert not os.path.lexists(tmp_path / "out" / "Foo.app" / "b")
+
+
+def test_tar_extracts_into_applications_while_downloading(real_io, tmp_path):
+    applications = tmp_path / "Applications"
+    (applications / "Bar.app").mkdir(parents=True)
+    (applications / "Bar.app" / "old").write_text("old version")
+
+    with FileServer({"/Bar.tar.xz": make_tar_xz()}) as server:
+        dmg = DmgManagement(
+            server.url("/Bar.tar.xz"), applications_dir=str(applications)
+        )
+        dmg.run()
+
+    assert os.listdir(applications) == ["Bar.app"]
+    assert_app(str(applications / "Bar.app"), "bar")
+    assert (applications / "Bar.app" / "Contents" / "Resources" / "bar").is_symlink()
+    # Nothing went through a download directory
+    assert dmg.dmg_path is None
+
+
+def test_zip_is_downloaded_then_extracted(real_io, monkeypatch: MonkeyPatch, tmp_path):
+    monkeypatch.setattr("lib.dmg.download", download)
+    data = make_zip()
+    applications = tmp_path / "Applications"
+    applications.mkdir()
+
+    with FileServer({"/Foo.zip": data}) as server:
+        dmg = DmgManagement(
+            server.url("/Foo.zip"),
+            sha256=hashlib.sha256(data).hexdigest(),
+            applications_dir=str(applications),
+        )
+        dmg.run()
+
+    assert os.listdir(applications) == ["Foo.app"]
+    assert_app(str(applications / "Foo.app"), "foo")
+    assert not os.path.exists(dmg.tmpdir)
+
+
+def test_app_path():
+    assert app_path("Foo-1.2/Foo.app/Contents/x") == "Foo.app/Contents/x"
+    assert app_path("./Foo.app/") == "Foo.app"
+    assert app_path("Foo-1.2/README") is None
+    assert app_path("__MACOSX/Foo.app/._x") is None
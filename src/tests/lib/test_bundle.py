@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import zipfile
+
+import pytest
+
+from lib.bundle import Bundle, BundleWriter, export_bundle
+from lib.git import CLONED, GitCheckout
+from lib.manifest import GitEntry, TarballEntry
+from lib.tarball import TarballInstall
+from tests.http_fixture import FileServer
+from tests.lib.test_tarball import make_tarball
+from utils.errors import BundleError, ChecksumError
+
+DMG = os.urandom(256 * 1024)
+
+
+def git(*args, cwd=None) -> str:
+    cmd = ["git", "-c", "user.name=t", "-c", "user.email=t@t", *args]
+    return subprocess.run(
+        cmd, cwd=cwd, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+def make_repo(tmp_path) -> str:
+    work = str(tmp_path / "work")
+    git("init", "-q", "-b", "main", work)
+    (tmp_path / "work" / "plugin.zsh").write_text("echo plugin\n")
+    git("add", "plugin.zsh", cwd=work)
+    git("commit", "-q", "-m", "one", cwd=work)
+    git("tag", "v1", cwd=work)
+    bare = str(tmp_path / "upstream.git")
+    git("clone", "-q", "--bare", work, bare)
+    return bare
+
+
+def write_tasks(root, server, repo) -> str:
+    (root / "scripts").mkdir(parents=True)
+    (root / "scripts" / "01_hello.sh").write_text("echo hello\n")
+    tasks = {
+        "bash": [{"name": "hello", "script": "./scripts/01_hello.sh"}],
+        "git": [{"name": "plugin", "repo": repo, "dest": "unused", "ref": "v1"}],
+        "tarball": [{"url": server.url("/nvim.tar.gz"), "dest": "unused"}],
+        "dmg": [
+            {"url": server.url("/App.dmg"), "sha256": hashlib.sha256(DMG).hexdigest()}
+        ],
+    }
+    path = root / "tasks.json"
+    path.write_text(json.dumps(tasks))
+    return str(path)
+
+
+def test_export_then_install_offline(real_io, tmp_path):
+    tarball = make_tarball()
+    repo = make_repo(tmp_path)
+    out = str(tmp_path / "macbook.bundle")
+    files = {"/App.dmg": DMG, "/nvim.tar.gz": tarball}
+    with FileServer(files) as server:
+        tasks = write_tasks(tmp_path / "repo", server, repo)
+        items = export_bundle(tasks, out, cache_dir=str(tmp_path / "cache"))
+        dmg_url, tar_url = server.url("/App.dmg"), server.url("/nvim.tar.gz")
+
+    # The server is gone and the upstream repository too, only the bundle is left
+    shutil.rmtree(repo)
+    assert [i.kind for i in items] == ["dmg", "tarball", "git"]
+    assert not os.path.exists(out + ".partial")
+    with zipfile.ZipFile(out) as zf:
+        assert zf.getinfo(f"dmg/{items[0].sha256}").compress_type == zipfile.ZIP_STORED
+
+    with Bundle(out) as bundle:
+        scripts = os.path.dirname(bundle.extract_files())
+        assert open(os.path.join(scripts, "scripts", "01_hello.sh")).read() == (
+            "echo hello\n"
+        )
+
+        dmg = bundle.extract(dmg_url, str(tmp_path / "App.dmg"))
+        assert open(dmg, "rb").read() == DMG
+
+        entry = TarballEntry(tar_url, str(tmp_path / "nvim"), strip_components=1)
+        assert TarballInstall(entry, bundle).run().files == 2
+        assert os.path.isfile(tmp_path / "nvim" / "bin" / "nvim")
+
+        entry = GitEntry(repo, str(tmp_path / "plugin"), ref="v1")
+        assert GitCheckout(entry, bundle=bundle).run() == CLONED
+        assert git("config", "remote.origin.url", cwd=entry.dest) == repo
+        assert os.path.isfile(tmp_path / "plugin" / "plugin.zsh")
+        work_dir = bundle.work_dir
+    assert not os.path.exists(work_dir)
+
+
+def test_members_are_checked_on_extract(real_io, tmp_path):
+    artifact = tmp_path / "App.dmg"
+    artifact.write_bytes(DMG)
+    sha256 = hashlib.sha256(DMG).hexdigest()
+    out = str(tmp_path / "test.bundle")
+    writer = BundleWriter(out)
+    writer.add_artifact("dmg", "https://x/App.dmg", str(artifact), sha256)
+    writer.add_artifact("dmg", "https://y/App.dmg", str(artifact), "0" * 64)
+    writer.close()
+
+    with Bundle(out) as bundle:
+        with pytest.raises(BundleError):
+            bundle.extract("https://x/Other.dmg", str(tmp_path / "a"))
+        # Pinned in tasks.json to something other than what was exported
+        with pytest.raises(ChecksumError):
+            bundle.extract("https://x/App.dmg", str(tmp_path / "a"), sha256="1" * 64)
+        # The bundle's own index disagrees with the member's content
+        with pytest.raises(ChecksumError):
+            bundle.extract("https://y/App.dmg", str(tmp_path / "b"))
+        assert not os.path.exists(tmp_path / "b")
+
+
+def test_not_a_bundle(tmp_path):
+    path = tmp_path / "empty.zip"
+    zipfile.ZipFile(path, "w").close()
+
+    with pytest.raises(BundleError):
+        Bundle(str(path))
+
+
+def test_installers_are_bundled(real_io, tmp_path):
+    installer = b"echo installed from the bundle\n"
+    out = str(tmp_path / "macbook.bundle")
+    root = tmp_path / "repo"
+    with FileServer({"/install.sh": installer}) as server:
+        (root / "scripts").mkdir(parents=True)
+        (root / "scripts" / "01_brew.sh").write_text(
+            f'/bin/bash -c "$(curl -fsSL {server.url("/install.sh")})"\n'
+        )
+        tasks = {"bash": [{"name": "brew", "script": "./scripts/01_brew.sh"}]}
+        (root / "tasks.json").write_text(json.dumps(tasks))
+        items = export_bundle(
+            str(root / "tasks.json"), out, cache_dir=str(tmp_path / "cache")
+        )
+
+    assert [(i.kind, i.source) for i in items] == [
+        ("script", server.url("/install.sh"))
+    ]
+    with Bundle(out) as bundle:
+        script = os.path.join(
+            os.path.dirname(bundle.extract_files()), "scripts", "01_brew.sh"
+        )
+        assert "127.0.0.1" not in open(script).read()
+        result = subprocess.run(
+            ["bash", script], check=True, capture_output=True, text=True
+        )
+        assert result.stdout == "installed from the bundle\n"
+
+
+def test_scripts_fetching_unbundled_urls_fail_up_front(tmp_path):
+    script = tmp_path / "01_uv.sh"
+    script.write_text("curl -LsSf https://astral.sh/uv/install.sh | sh\n")
+    out = str(tmp_path / "test.bundle")
+    writer = BundleWriter(out)
+    writer.add_file("01_uv.sh", str(script))
+    writer.close()
+
+    with Bundle(out) as bundle:
+        with pytest.raises(BundleError, match="astral.sh"):
+            bundle.extract_files()
@@ -0,0 +1,146 @@
+import hashlib
+import os
+
+import pytest
+from lib.cache import ArtifactCache, file_sha256
+from tests.http_fixture import FileServer
+from utils.errors import ChecksumError
+
+DATA = os.urandom(64 * 1024)
+
+
+@pytest.fixture
+def cache(tmp_path, real_io):
+    return ArtifactCache(root=str(tmp_path / "cache"))
+
+
+def test_miss_then_hit(cache):
+    with FileServer({"/a.dmg": DATA}) as server:
+        url = server.url("/a.dmg")
+        first = cache.fetch(url)
+        server.requests.clear()
+        second = cache.fetch(url)
+        methods = [(m, h.get("If-None-Match")) for m, _, h in server.requests]
+
+    assert first == second
+    assert os.path.basename(first) == file_sha256(first)
+    assert open(second, "rb").read() == DATA
+    # The hit costs one conditional HEAD and no body transfer
+    assert len(methods) == 1 and methods[0][0] == "HEAD" and methods[0][1]
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+
+
+def test_changed_content_is_downloaded_again(cache):
+    files = {"/a.dmg": DATA}
+    with FileServer(files) as server:
+        url = server.url("/a.dmg")
+        first = cache.fetch(url)
+        files["/a.dmg"] = DATA[::-1]
+        second = cache.fetch(url)
+
+    assert first != second
+    assert open(second, "rb").read() == DATA[::-1]
+    assert cache.stats.misses == 2
+
+
+def test_index_persists(tmp_path, cache):
+    with FileServer({"/a.dmg": DATA}) as server:
+        url = server.url("/a.dmg")
+        cache.fetch(url)
+
+        again = ArtifactCache(root=cache.root)
+        again.fetch(url)
+
+    assert again.stats.hits == 1
+
+
+def test_same_content_is_stored_once(cache):
+    with FileServer({"/a.dmg": DATA, "/b.dmg": DATA}) as server:
+        a = cache.fetch(server.url("/a.dmg"))
+        b = cache.fetch(server.url("/b.dmg"))
+
+    assert a == b
+    assert len(os.listdir(cache.objects_dir)) == 1
+
+
+def test_lru_eviction(tmp_path, real_io):
+    cache = ArtifactCache(root=str(tmp_path / "cache"), max_bytes=2 * len(DATA))
+    files = {f"/{n}.dmg": os.urandom(len(DATA)) for n in "abc"}
+    with FileServer(files) as server:
+        a = cache.fetch(server.url("/a.dmg"))
+        cache.fetch(server.url("/b.dmg"))
+        cache.fetch(server.url("/a.dmg"))  # a is now more recent than b
+        cache.fetch(server.url("/c.dmg"))
+
+        assert cache.lookup(server.url("/b.dmg")) is None
+        assert cache.lookup(server.url("/a.dmg")) == a
+
+    assert cache.stats.evictions == 1
+
+
+def test_pinned_objects_are_not_evicted(tmp_path, real_io):
+    cache = ArtifactCache(root=str(tmp_path / "cache"), max_bytes=len(DATA))
+    files = {f"/{n}.dmg": os.urandom(len(DATA)) for n in "abc"}
+    with FileServer(files) as server:
+        a = cache.fetch(server.url("/a.dmg"))
+        # As while another thread's fetch_to() is still linking a
+        with cache.pinned(server.url("/a.dmg")):
+            cache.fetch(server.url("/b.dmg"))
+            assert os.path.isfile(a)
+        cache.fetch_to(server.url("/c.dmg"), str(tmp_path / "c.dmg"))
+
+    assert not os.path.exists(a)
+    assert (tmp_path / "c.dmg").read_bytes() == files["/c.dmg"]
+    assert cache._pins == {}
+
+
+def test_offline_serves_cached_copy(cache):
+    with FileServer({"/a.dmg": DATA}) as server:
+        url = server.url("/a.dmg")
+        path = cache.fetch(url)
+
+    assert cache.fetch(url) == path
+
+
+def test_dmg_links_cached_object(cache, monkeypatch):
+    from lib.dmg import DmgManagement
+
+    monkeypatch.setattr("lib.dmg.os.system", lambda cmd: 0)
+    with FileServer({"/App.dmg": DATA}) as server:
+        dmg = DmgManagement(server.url("/App.dmg"), cache=cache)
+        dmg._fetch()
+
+    assert os.path.basename(dmg.dmg_path) == "App.dmg"
+    assert os.path.samefile(dmg.dmg_path, cache.lookup(dmg.url))
+
+
+def test_pinned_checksum_skips_revalidation(cache):
+    sha256 = hashlib.sha256(DATA).hexdigest()
+    with FileServer({"/a.dmg": DATA}) as server:
+        url = server.url("/a.dmg")
+        path = cache.fetch(url, sha256=sha256)
+        server.requests.clear()
+
+        assert cache.fetch(url, sha256=sha256) == path
+        assert server.requests == []
+
+
+def test_corrupted_object_is_downloaded_again(cache):
+    sha256 = hashlib.sha256(DATA).hexdigest()
+    with FileServer({"/a.dmg": DATA}) as server:
+        path = cache.fetch(server.url("/a.dmg"), sha256=sha256)
+        with open(path, "r+b") as f:
+            f.write(b"corrupt")
+
+        cache.fetch(server.url("/a.dmg"), sha256=sha256)
+
+    assert file_sha256(path) == sha256
+    assert cache.stats.misses == 2
+
+
+def test_pinned_checksum_mismatch(cache):
+    with FileServer({"/a.dmg": DATA}) as server:
+        with pytest.raises(ChecksumError):
+            cache.fetch(server.url("/a.dmg"), sha256="0" * 64)
+
+    assert os.listdir(cache.objects_dir) == []
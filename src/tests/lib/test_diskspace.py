@@ -0,0 +1,158 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from lib.diskspace import (
+    DEFAULT_EXPANSION,
+    AdmissionController,
+    SizeHistory,
+    tree_size,
+)
+from lib.dmg import DmgManagement
+from utils.errors import InsufficientSpace
+
+MB = 1024**2
+
+
+def fake_disk(free: int):
+    return lambda path: SimpleNamespace(free=free)
+
+
+def controller(tmp_path, free: int) -> AdmissionController:
+    history = SizeHistory(str(tmp_path / "sizes.json"))
+    return AdmissionController(min_free=0, history=history, disk_usage=fake_disk(free))
+
+
+def test_estimate_uses_history(tmp_path):
+    history = SizeHistory(str(tmp_path / "sizes.json"))
+    assert history.estimate("a", 10 * MB).install == 10 * MB * DEFAULT_EXPANSION
+
+    history.record("a", 10 * MB, 40 * MB)
+    history.record("b", 10 * MB, 20 * MB)
+    reloaded = SizeHistory(history.path)
+
+    # Same DMG: its own expansion, scaled to the new size
+    assert reloaded.estimate("a", 20 * MB).install == 80 * MB
+    # Unknown size: the last known download size
+    assert reloaded.estimate("a", None).download == 10 * MB
+    # New DMG: median expansion of the others
+    assert reloaded.estimate("c", 10 * MB).install == 30 * MB
+
+
+def test_needs_on_one_disk_are_summed(tmp_path):
+    admission = controller(tmp_path, free=100 * MB)
+    needs = {str(tmp_path / "tmp"): 60 * MB, str(tmp_path / "apps"): 60 * MB}
+
+    with pytest.raises(InsufficientSpace):
+        admission.acquire("a", needs, wait=False)
+    assert not admission.held("a")
+
+
+def test_reservations_reduce_headroom(tmp_path):
+    admission = controller(tmp_path, free=100 * MB)
+    admission.acquire("a", {str(tmp_path): 70 * MB}, wait=False)
+
+    assert admission.headroom(str(tmp_path)) == 30 * MB
+    assert admission.headroom(str(tmp_path), exclude="a") == 100 * MB
+    with pytest.raises(InsufficientSpace):
+        admission.acquire("b", {str(tmp_path): 40 * MB}, wait=False)
+
+    admission.release("a")
+    admission.acquire("b", {str(tmp_path): 40 * MB}, wait=False)
+
+
+def test_waiters_are_admitted_in_order(tmp_path):
+    admission = controller(tmp_path, free=100 * MB)
+    admission.acquire("first", {str(tmp_path): 80 * MB})
+    admitted = []
+
+    def wait_for(key, need):
+        admission.acquire(key, {str(tmp_path): need})
+        admitted.append(key)
+
+    big = threading.Thread(target=wait_for, args=("big", 90 * MB))
+    big.start()
+    time.sleep(0.05)
+    # Would fit right now, but must not overtake the queued download
+    small = threading.Thread(target=wait_for, args=("small", 10 * MB))
+    small.start()
+    time.sleep(0.05)
+    assert admitted == []
+
+    admission.release("first")
+    big.join(timeout=5)
+    assert admitted == ["big"]
+
+    admission.release("big")
+    small.join(timeout=5)
+    assert admitted == ["big", "small"]
+
+
+def test_waiting_fails_when_it_can_never_fit(tmp_path):
+    admission = controller(tmp_path, free=100 * MB)
+
+    with pytest.raises(InsufficientSpace):
+        admission.acquire("huge", {str(tmp_path): 200 * MB})
+
+
+def test_close_stops_waiters(tmp_path):
+    admission = controller(tmp_path, free=100 * MB)
+    admission.acquire("first", {str(tmp_path): 80 * MB})
+    errors = []
+
+    def waiter():
+        try:
+            admission.acquire("second", {str(tmp_path): 50 * MB})
+        except InsufficientSpace as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    time.sleep(0.05)
+    admission.close()
+    thread.join(timeout=5)
+
+    assert len(errors) == 1
+
+
+def test_copy_refused_before_old_app_is_removed(real_io, tmp_path):
+    volume = tmp_path / "Volumes" / "App"
+    (volume / "App.app" / "Contents").mkdir(parents=True)
+    (volume / "App.app" / "Contents" / "binary").write_bytes(b"x" * 3 * MB)
+    apps = tmp_path / "Applications"
+    (apps / "App.app").mkdir(parents=True)
+    (apps / "App.app" / "old").write_bytes(b"y" * MB)
+
+    admission = controller(tmp_path, free=MB)
+    dmg = DmgManagement("http://example.com/App.dmg", applications_dir=str(apps))
+    dmg.admission = admission
+    dmg.mount_point = str(volume)
+
+    with pytest.raises(InsufficientSpace):
+        dmg.copy_to_applications()
+    assert (apps / "App.app" / "old").exists()
+    assert tree_size(str(volume)) == 3 * MB
+
+
+def test_installer_abandons_prefetch_waiting_on_later_install(monkeypatch, tmp_path):
+    monkeypatch.setattr("lib.dmg.probe_size", lambda url: 10 * MB)
+    admission = controller(tmp_path, free=100 * MB)
+    # A later DMG's prefetch got its space first and keeps it until installed
+    admission.acquire("http://example.com/Later.dmg", {str(tmp_path): 80 * MB})
+    background = DmgManagement("http://example.com/App.dmg", admission=admission)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        prefetched = pool.submit(background.prefetch, "App.dmg")
+        time.sleep(0.05)
+        dmg = DmgManagement(
+            "http://example.com/App.dmg",
+            admission=admission,
+            prefetched=prefetched,
+            applications_dir=str(tmp_path),
+        )
+
+        with pytest.raises(InsufficientSpace):
+            dmg.download_dmg()
+        assert isinstance(prefetched.exception(timeout=5), InsufficientSpace)
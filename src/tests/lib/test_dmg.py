@@ -1,7 +1,10 @@
+import plistlib
+
 import pytest
 from pytest import MonkeyPatch
-from lib.dmg import DmgManagement
-from utils.errors import UserCancelled
+from lib.dmg import DmgManagement, parse_attach_plist
+from lib.fastcopy import CopyStats
+from utils.errors import ChecksumError, UserCancelled
 
 
 @pytest.fixture
@@ -49,3 +52,130 @@ def test_cancel_stops_install(confirm_no):
 
     with pytest.raises(UserCancelled):
         dmg.download_dmg()
+
+
+def test_checksum_mismatch_stops_before_mount(monkeypatch: MonkeyPatch):
+    calls = []
+
+    def bad_download(url, dest, **kwargs):
+        raise ChecksumError("mismatch")
+
+    monkeypatch.setattr("lib.dmg.download", bad_download)
+    monkeypatch.setattr("lib.dmg.subprocess.run", lambda *a, **k: calls.append(a))
+
+    dmg = DmgManagement("http://example.com/test.dmg", sha256="0" * 64)
+    with pytest.raises(ChecksumError):
+        dmg.run()
+
+    assert calls == []
+
+
+def test_mount_point_under_private_root(monkeypatch: MonkeyPatch):
+    def fake_run(*a, **k):
+        class Result:
+            stdout = "/dev/disk7s1\tApple_HFS\t/tmp/bench/Volumes/Test App\n"
+
+        return Result()
+
+    monkeypatch.setattr("lib.dmg.subprocess.run", fake_run)
+
+    dmg = DmgManagement("url")
+    dmg.dmg_path = "/tmp/fake.dmg"
+    dmg.mount_dmg()
+
+    assert dmg.mount_point == "/tmp/bench/Volumes/Test App"
+
+
+def test_applications_dir_from_env(monkeypatch: MonkeyPatch):
+    copies = []
+    monkeypatch.setenv("MACBOOK_INIT_APPLICATIONS", "/tmp/apps")
+    monkeypatch.setattr(
+        "lib.dmg.copy_tree", lambda src, dst: copies.append(dst) or CopyStats()
+    )
+
+    dmg = DmgManagement("x")
+    dmg.mount_point = "/Volumes/Test"
+    dmg.copy_to_applications()
+
+    assert copies == ["/tmp/apps/test.app"]
+
+
+ATTACH_PLIST = plistlib.dumps(
+    {
+        "system-entities": [
+            {"content-hint": "GUID_partition_scheme", "dev-entry": "/dev/disk5"},
+            {"content-hint": "EFI", "dev-entry": "/dev/disk5s1"},
+            {
+                "content-hint": "Apple_HFS",
+                "dev-entry": "/dev/disk5s2",
+                "mount-point": "/tmp/mnt/Docker Resources",
+            },
+            {
+                "content-hint": "Apple_HFS",
+                "dev-entry": "/dev/disk5s3",
+                "mount-point": "/tmp/mnt/Docker",
+            },
+        ]
+    }
+)
+
+
+def fake_attach(monkeypatch: MonkeyPatch, calls: list):
+    def fake_run(args, **k):
+        calls.append(args)
+
+        class Result:
+            returncode = 0
+            stdout = ATTACH_PLIST
+
+        return Result()
+
+    monkeypatch.setattr("lib.dmg.subprocess.run", fake_run)
+    monkeypatch.setattr(
+        "lib.dmg.os.listdir",
+        lambda path: ["Docker.app"] if path == "/tmp/mnt/Docker" else [".fseventsd"],
+    )
+
+
+def test_fast_mount_finds_the_app_volume(monkeypatch: MonkeyPatch, tmp_path):
+    calls = []
+    fake_attach(monkeypatch, calls)
+    root = str(tmp_path / "mnt")
+
+    dmg = DmgManagement("url", fast_mount=True, mount_root=root)
+    dmg.dmg_path = "/tmp/fake.dmg"
+    dmg.mount_dmg()
+
+    assert calls[0][:5] == ["hdiutil", "attach", "-nobrowse", "-readonly", "-plist"]
+    assert calls[0][-3:] == ["-mountroot", root, "/tmp/fake.dmg"]
+    assert dmg.disk_id == "/dev/disk5"
+    assert dmg.mount_point == "/tmp/mnt/Docker"
+
+    # Both volumes and the partition map go with the whole disk
+    dmg._force_detach()
+    assert calls[1] == ["hdiutil", "detach", "/dev/disk5"]
+
+
+def test_fast_mount_skips_verify_only_after_checksum(monkeypatch: MonkeyPatch):
+    calls = []
+    fake_attach(monkeypatch, calls)
+    monkeypatch.setattr("lib.dmg.download", lambda *a, **kw: None)
+
+    unpinned = DmgManagement("http://example.com/a.dmg", fast_mount=True)
+    unpinned.download_dmg()
+    unpinned.mount_dmg()
+    pinned = DmgManagement("http://example.com/a.dmg", sha256="0" * 64, fast_mount=True)
+    pinned.download_dmg()
+    pinned.mount_dmg()
+
+    assert "-noverify" not in calls[0]
+    assert "-noverify" in calls[1]
+
+
+def test_parse_attach_plist():
+    assert parse_attach_plist(ATTACH_PLIST) == [
+        ("/dev/disk5s2", "/tmp/mnt/Docker Resources"),
+        ("/dev/disk5s3", "/tmp/mnt/Docker"),
+    ]
+    with pytest.raises(RuntimeError):
+        parse_attach_plist(b"/dev/disk4  Apple_HFS  /Volumes/TestApp")
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import time
+
+import pytest
+from lib import download as dl
+from lib.download import Downloader, download
+from tests.http_fixture import FileServer
+from utils.errors import ChecksumError, DownloadError
+
+DATA = os.urandom(3 * 1024 * 1024 + 123)
+
+
+@pytest.fixture(autouse=True)
+def small_segments(monkeypatch, real_io):
+    monkeypatch.setattr(dl, "MIN_SEGMENT_SIZE", 256 * 1024)
+    monkeypatch.setattr(dl, "STATE_SAVE_INTERVAL", 0.0)
+
+
+def test_segmented_download(tmp_path):
+    dest = str(tmp_path / "app.dmg")
+    with FileServer({"/app.dmg": DATA}) as server:
+        download(server.url("/app.dmg"), dest, segments=4)
+        ranges = [h.get("Range") for _, _, h in server.requests]
+
+    assert open(dest, "rb").read() == DATA
+    # One probe plus one request per segment
+    assert len(ranges) == 5
+    assert not os.path.exists(dest + dl.STATE_SUFFIX)
+    assert not os.path.exists(dest + dl.PART_SUFFIX)
+
+
+def test_falls_back_to_single_stream(tmp_path):
+    dest = str(tmp_path / "app.dmg")
+    with FileServer({"/app.dmg": DATA}, ranges=False) as server:
+        download(server.url("/app.dmg"), dest, segments=4)
+
+        assert len(server.requests) == 1
+
+    assert open(dest, "rb").read() == DATA
+
+
+def test_dropped_connection_is_retried(tmp_path):
+    dest = str(tmp_path / "app.dmg")
+    with FileServer({"/app.dmg": DATA}, drop_after=100 * 1024) as server:
+        download(server.url("/app.dmg"), dest, segments=2)
+
+    assert open(dest, "rb").read() == DATA
+
+
+def test_resume_from_state_file(tmp_path):
+    dest = str(tmp_path / "app.dmg")
+    with FileServer({"/app.dmg": DATA}, rate=2 * 1024 * 1024) as server:
+        url = server.url("/app.dmg")
+
+        # Interrupt the first attempt half way
+        def stop(done, total):
+            if done > total // 2:
+                raise KeyboardInterrupt
+
+        with pytest.raises(KeyboardInterrupt):
+            Downloader(url, dest, segments=1, progress=stop).run()
+
+        state = json.load(open(dest + dl.STATE_SUFFIX))
+        done_before = state["segments"][0]["done"]
+        assert done_before > 0
+
+        server.requests.clear()
+        download(url, dest, segments=1)
+        resumed_from = server.requests[-1][2]["Range"]
+
+    assert resumed_from == f"bytes={done_before}-{len(DATA) - 1}"
+    assert open(dest, "rb").read() == DATA
+
+
+def test_stale_state_is_ignored(tmp_path):
+    dest = str(tmp_path / "app.dmg")
+    with open(dest + dl.STATE_SUFFIX, "w") as f:
+        json.dump({"url": "other", "size": 1, "etag": None, "segments": []}, f)
+    with open(dest + dl.PART_SUFFIX, "wb") as f:
+        f.write(b"x")
+
+    with FileServer({"/app.dmg": DATA}) as server:
+        download(server.url("/app.dmg"), dest)
+
+    assert open(dest, "rb").read() == DATA
+
+
+def test_parallel_segments_are_faster(tmp_path):
+    rate = 1024 * 1024
+    with FileServer({"/app.dmg": DATA}, rate=rate) as server:
+        began = time.monotonic()
+        download(server.url("/app.dmg"), str(tmp_path / "a.dmg"), segments=4)
+        elapsed = time.monotonic() - began
+
+    # A single throttled stream needs len(DATA) / rate seconds
+    assert elapsed < len(DATA) / rate * 0.6
+
+
+def test_missing_file(tmp_path):
+    with FileServer({}) as server:
+        with pytest.raises(OSError):
+            download(server.url("/nope.dmg"), str(tmp_path / "x.dmg"))
+
+
+def test_short_single_stream_raises(tmp_path):
+    with FileServer({"/app.dmg": DATA}, ranges=False, drop_after=1024) as server:
+        with pytest.raises((DownloadError, OSError)):
+            download(server.url("/app.dmg"), str(tmp_path / "x.dmg"))
+
+
+def test_inline_sha256(tmp_path):
+    expected = hashlib.sha256(DATA).hexdigest()
+    with FileServer({"/app.dmg": DATA}) as server:
+        segmented = Downloader(server.url("/app.dmg"), str(tmp_path / "a"), segments=4)
+        segmented.run()
+    with FileServer({"/app.dmg": DATA}, ranges=False) as server:
+        single = Downloader(server.url("/app.dmg"), str(tmp_path / "b"))
+        single.run()
+
+    assert segmented.sha256 == single.sha256 == expected
+
+
+def test_inline_sha256_after_resume(tmp_path):
+    dest = str(tmp_path / "app.dmg")
+    with FileServer({"/app.dmg": DATA}, rate=4 * 1024 * 1024) as server:
+        url = server.url("/app.dmg")
+
+        def stop(done, total):
+            if done > total // 3:
+                raise KeyboardInterrupt
+
+        with pytest.raises(KeyboardInterrupt):
+            Downloader(url, dest, segments=3, progress=stop).run()
+        resumed = Downloader(url, dest, segments=3)
+        resumed.run()
+
+    assert resumed.sha256 == hashlib.sha256(DATA).hexdigest()
+
+
+def test_checksum_mismatch(tmp_path):
+    dest = str(tmp_path / "app.dmg")
+    with FileServer({"/app.dmg": DATA}) as server:
+        with pytest.raises(ChecksumError):
+            download(server.url("/app.dmg"), dest, sha256="0" * 64)
+
+    assert os.listdir(tmp_path) == []
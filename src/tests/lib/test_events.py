@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from lib.events import EventStream, chrome_trace, events, read_events, traced
+
+
+@pytest.fixture
+def recording(tmp_path):
+    path = str(tmp_path / "events.jsonl")
+    events.open(path, keep=True)
+    yield path
+    events.close()
+
+
+def test_disabled_records_nothing():
+    stream = EventStream()
+    with stream.span("phase") as span:
+        span.set(size=1)
+    stream.event("point")
+
+    assert stream.span("a") is stream.span("b")
+    assert stream.records is None
+
+
+def test_spans_are_written_as_json_lines(recording):
+    with events.span("outer", "dmg", dmg="A.dmg") as outer:
+        with events.span("inner"):
+            pass
+        outer.set(bytes=10)
+    events.event("skipped", task="x")
+
+    records = read_events(recording)
+    assert [r["name"] for r in records] == ["inner", "outer", "skipped"]
+    inner, outer, point = records
+    assert outer["type"] == "span" and point["type"] == "event"
+    assert outer["args"] == {"dmg": "A.dmg", "bytes": 10}
+    assert outer["ts"] <= inner["ts"]
+    assert outer["dur"] >= inner["dur"] >= 0
+
+
+def test_span_records_errors(recording):
+    with pytest.raises(ValueError):
+        with events.span("broken"):
+            raise ValueError("bad")
+
+    (record,) = read_events(recording)
+    assert record["error"] == "ValueError: bad"
+
+
+def test_traced_decorator(recording):
+    @traced("work", "bash", args=lambda n: {"n": n})
+    def work(n):
+        return n * 2
+
+    assert work(21) == 42
+    assert events.records[0]["name"] == "work"
+    assert events.records[0]["args"] == {"n": 21}
+
+    events.close()
+    assert work(1) == 2
+
+
+def test_chrome_trace(recording, tmp_path):
+    with events.span("phase", "dmg"):
+        events.event("point")
+
+    trace = chrome_trace(events.records)["traceEvents"]
+    point, phase, meta = trace
+    assert phase["ph"] == "X" and phase["dur"] >= 0
+    assert point["ph"] == "i"
+    assert meta["ph"] == "M" and meta["args"]["name"] == "MainThread"
+    json.dumps(trace)
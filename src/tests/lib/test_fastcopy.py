@@ -0,0 +1,95 @@
+import os
+import shutil
+import stat
+
+import pytest
+from lib.fastcopy import copy_tree
+
+
+@pytest.fixture
+def bundle(tmp_path, real_io):
+    app = tmp_path / "Test.app"
+    macos = app / "Contents" / "MacOS"
+    macos.mkdir(parents=True)
+    (app / "Contents" / "Info.plist").write_text("<plist/>")
+    binary = macos / "test"
+    binary.write_bytes(os.urandom(300_000))
+    binary.chmod(0o755)
+    (app / "Contents" / "Resources").mkdir()
+    for i in range(50):
+        (app / "Contents" / "Resources" / f"r{i}.txt").write_text(str(i) * i)
+    (app / "Contents" / "empty").write_bytes(b"")
+    os.symlink("MacOS/test", app / "Contents" / "link")
+    os.symlink("does-not-exist", app / "Contents" / "dangling")
+    return app
+
+
+def snapshot(root):
+    result = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            rel = os.path.relpath(path, root)
+            if stat.S_ISLNK(st.st_mode):
+                result[rel] = ("link", os.readlink(path))
+            elif stat.S_ISDIR(st.st_mode):
+                result[rel] = ("dir", stat.S_IMODE(st.st_mode))
+            else:
+                data = open(path, "rb").read()
+                result[rel] = ("file", stat.S_IMODE(st.st_mode), data)
+    return result
+
+
+def test_copy_matches_source(bundle, tmp_path):
+    dest = tmp_path / "out" / "Test.app"
+    dest.parent.mkdir()
+
+    stats = copy_tree(str(bundle), str(dest), workers=4)
+
+    assert snapshot(dest) == snapshot(bundle)
+    assert stats.files == 53
+    assert stats.symlinks == 2
+    assert sum(stats.methods.values()) == stats.files
+
+
+def test_preserves_xattrs(bundle, tmp_path):
+    target = bundle / "Contents" / "Info.plist"
+    try:
+        os.setxattr(target, "user.test", b"value")
+    except (AttributeError, OSError):
+        pytest.skip("xattrs not supported here")
+
+    dest = tmp_path / "Copy.app"
+    copy_tree(str(bundle), str(dest))
+
+    assert os.getxattr(dest / "Contents" / "Info.plist", "user.test") == b"value"
+
+
+def test_same_result_as_copytree(bundle, tmp_path):
+    copy_tree(str(bundle), str(tmp_path / "a.app"))
+    shutil.copytree(str(bundle), str(tmp_path / "b.app"), symlinks=True)
+
+    assert snapshot(tmp_path / "a.app") == snapshot(tmp_path / "b.app")
+
+
+def test_existing_destination(bundle, tmp_path):
+    with pytest.raises(FileExistsError):
+        copy_tree(str(bundle), str(bundle))
+
+
+def test_read_write_fallback_handles_short_writes(bundle, tmp_path, monkeypatch):
+    import lib.fastcopy
+
+    real_write = os.write
+    monkeypatch.setattr(lib.fastcopy, "_copyfile", None)
+    monkeypatch.setattr(
+        lib.fastcopy.os, "write", lambda fd, data: real_write(fd, data[:1000])
+    )
+    copier = lib.fastcopy._Copier()
+    copier.reflink = copier.copy_file_range = copier.sendfile = False
+    src = bundle / "Contents" / "MacOS" / "test"
+    dst = tmp_path / "copy"
+
+    assert copier.copy(str(src), str(dst), src.stat().st_size) == "read/write"
+    assert dst.read_bytes() == src.read_bytes()
@@ -0,0 +1,111 @@
+import io
+import threading
+
+import pytest
+
+from lib.tui.fp import FancyPrint, _LineSink
+
+
+class TtyBuffer(io.StringIO):
+    def isatty(self):
+        return True
+
+
+@pytest.fixture
+def tty(monkeypatch):
+    out = TtyBuffer()
+    monkeypatch.setattr(FancyPrint, "_sink", _LineSink(out))
+    monkeypatch.delenv("NO_COLOR", raising=False)
+    monkeypatch.delenv("FORCE_COLOR", raising=False)
+    return out
+
+
+@pytest.fixture
+def pipe(monkeypatch):
+    out = io.StringIO()
+    monkeypatch.setattr(FancyPrint, "_sink", _LineSink(out))
+    monkeypatch.delenv("NO_COLOR", raising=False)
+    monkeypatch.delenv("FORCE_COLOR", raising=False)
+    return out
+
+
+def test_styles_on_a_tty(tty):
+    FancyPrint.print("hi", color="red", style=["bold", "underline"])
+
+    assert tty.getvalue() == "\033[1m\033[4m\033[31mhi\033[0m\n"
+
+
+def test_style_sequences_are_memoized(tty):
+    FancyPrint._style_prefix.cache_clear()
+    for _ in range(5):
+        FancyPrint.info("again")
+
+    info = FancyPrint._style_prefix.cache_info()
+    assert info.misses == 1
+    assert info.hits == 4
+
+
+def test_plain_text_when_not_a_tty(pipe):
+    FancyPrint.success("done")
+    FancyPrint.gradient("abcdef")
+    FancyPrint.box("title")
+
+    assert "\033" not in pipe.getvalue()
+    assert pipe.getvalue().splitlines()[:2] == ["✓ done", "abcdef"]
+
+
+def test_no_color_env_wins_over_tty(tty, monkeypatch):
+    monkeypatch.setenv("NO_COLOR", "1")
+    FancyPrint.error("oops")
+
+    assert tty.getvalue() == "✗ oops\n"
+
+
+def test_gradient_emits_one_sequence_per_color(tty):
+    FancyPrint.gradient("aabbcc", colors=["red", "green", "blue"])
+
+    out = tty.getvalue()
+    assert out.count("\033[0m") == 3
+    assert "\033[31maa\033[0m" in out
+
+
+def test_partial_line_is_held_until_complete(pipe):
+    FancyPrint.print("Downloading...", end="")
+    assert pipe.getvalue() == ""
+
+    FancyPrint.print(" done")
+    assert pipe.getvalue() == "Downloading... done\n"
+
+
+def test_flush_writes_partial_line(pipe):
+    FancyPrint.print("Continue? ", end="")
+    FancyPrint.flush()
+
+    assert pipe.getvalue() == "Continue? "
+
+
+def test_carriage_return_is_shown_immediately(pipe):
+    FancyPrint.progress(5, 10, width=4)
+
+    assert "[■■□□] 50.0%" in pipe.getvalue()
+
+
+def test_lines_from_threads_do_not_interleave(pipe):
+    def worker(name):
+        for i in range(200):
+            # The line is built from several partial writes
+            FancyPrint.print(f"[{name}]", end="")
+            FancyPrint.print(f" line {i}", end="")
+            FancyPrint.print(" end")
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in "abcd"]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    lines = pipe.getvalue().splitlines()
+    assert len(lines) == 800
+    for line in lines:
+        assert line.startswith("[") and line.endswith(" end")
+        assert line.count("[") == 1
@@ -0,0 +1,102 @@
+import os
+import subprocess
+
+import pytest
+
+from lib.git import CLONED, UNCHANGED, UPDATED, GitCheckout, mirror_path
+from lib.manifest import GitEntry
+from utils.errors import GitError
+
+
+def git(*args, cwd=None) -> str:
+    cmd = ["git", "-c", "user.name=t", "-c", "user.email=t@t", *args]
+    return subprocess.run(
+        cmd, cwd=cwd, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+def commit(work, message):
+    with open(os.path.join(work, "file.txt"), "a") as f:
+        f.write(message + "\n")
+    git("add", "file.txt", cwd=work)
+    git("commit", "-q", "-m", message, cwd=work)
+    git("push", "-q", "origin", "HEAD", cwd=work)
+    return git("rev-parse", "HEAD", cwd=work)
+
+
+@pytest.fixture
+def upstream(real_io, tmp_path):
+    """A bare repository with three commits on main and a tag on the second"""
+    bare = str(tmp_path / "upstream.git")
+    work = str(tmp_path / "work")
+    git("init", "-q", "--bare", "-b", "main", bare)
+    git("clone", "-q", bare, work)
+    git("checkout", "-q", "-b", "main", cwd=work)
+    shas = [commit(work, "one"), commit(work, "two")]
+    git("tag", "v1", cwd=work)
+    git("push", "-q", "origin", "v1", cwd=work)
+    shas.append(commit(work, "three"))
+    return {"repo": bare, "work": work, "shas": shas}
+
+
+def checkout(tmp_path, upstream, **kw) -> GitCheckout:
+    entry = GitEntry(repo=upstream["repo"], dest=str(tmp_path / "dest"), **kw)
+    return GitCheckout(entry, mirrors=str(tmp_path / "mirrors"))
+
+
+def test_shallow_clone_through_mirror(tmp_path, upstream):
+    co = checkout(tmp_path, upstream)
+
+    assert co.run() == CLONED
+    assert git("rev-parse", "HEAD", cwd=co.dest) == upstream["shas"][-1]
+    assert git("rev-list", "--count", "HEAD", cwd=co.dest) == "1"
+    assert git("config", "remote.origin.url", cwd=co.dest) == upstream["repo"]
+    assert os.path.isdir(mirror_path(str(tmp_path / "mirrors"), upstream["repo"]))
+    assert [p for p in os.listdir(tmp_path) if p.endswith(".tmp")] == []
+    assert checkout(tmp_path, upstream, ref="main").run() == UNCHANGED
+
+
+def test_checkout_at_ref_is_a_noop(tmp_path, upstream):
+    co = checkout(tmp_path, upstream, ref="v1")
+    assert co.run() == CLONED
+    assert git("rev-parse", "HEAD", cwd=co.dest) == upstream["shas"][1]
+
+    # Without touching the repository or the mirror
+    os.rename(upstream["repo"], upstream["repo"] + ".moved")
+    assert co.run() == UNCHANGED
+    short = upstream["shas"][1][:10]
+    assert checkout(tmp_path, upstream, ref=short).run() == UNCHANGED
+
+
+def test_moves_to_another_ref(tmp_path, upstream):
+    assert checkout(tmp_path, upstream, ref="v1").run() == CLONED
+
+    first = upstream["shas"][0]
+    co = checkout(tmp_path, upstream, ref=first)
+    assert co.run() == UPDATED
+    assert git("rev-parse", "HEAD", cwd=co.dest) == first
+    assert co.run() == UNCHANGED
+
+
+def test_mirror_picks_up_new_commits(tmp_path, upstream):
+    co = checkout(tmp_path, upstream, ref="main", depth=0)
+    co.run()
+    newest = commit(upstream["work"], "four")
+
+    co = checkout(tmp_path, upstream, ref=newest, depth=0)
+    assert co.run() == UPDATED
+    assert git("rev-list", "--count", "HEAD", cwd=co.dest) == "4"
+
+
+def test_refuses_to_replace_other_content(tmp_path, upstream):
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    (dest / "notes.txt").write_text("mine")
+    with pytest.raises(GitError):
+        checkout(tmp_path, upstream).run()
+
+    (dest / "notes.txt").unlink()
+    git("init", "-q", str(dest))
+    git("remote", "add", "origin", "https://example.com/other.git", cwd=str(dest))
+    with pytest.raises(GitError):
+        checkout(tmp_path, upstream).run()
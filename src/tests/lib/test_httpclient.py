@@ -0,0 +1,110 @@
+import os
+import socket
+import urllib.error
+
+import pytest
+from pytest import MonkeyPatch
+
+from lib import httpclient
+from lib.download import download
+from lib.httpclient import HttpClient, backoff
+from tests.http_fixture import FileServer
+
+DATA = os.urandom(4 * 1024 * 1024)
+
+
+def get(client: HttpClient, url: str, **kw) -> bytes:
+    with client.request("GET", url, **kw) as resp:
+        return resp.read()
+
+
+def test_connections_are_kept_alive(real_io):
+    client = HttpClient(proxies={})
+    with FileServer({"/a": b"a" * 100, "/b": b"b" * 100}) as server:
+        assert get(client, server.url("/a")) == b"a" * 100
+        assert get(client, server.url("/b")) == b"b" * 100
+        # An unread body is drained so the connection still goes back
+        client.request("GET", server.url("/a")).close()
+        with client.request("HEAD", server.url("/b")) as resp:
+            assert resp.headers["Content-Length"] == "100"
+        assert get(client, server.url("/a")) == b"a" * 100
+
+    assert client.stats.connections == 1
+    assert client.stats.reused == 4
+
+
+def test_segments_reuse_the_probe_connection(real_io, tmp_path):
+    stats = httpclient.client.stats
+    with FileServer({"/big.bin": DATA}) as server:
+        before = stats.connections
+        download(server.url("/big.bin"), str(tmp_path / "a"), segments=4)
+        first = stats.connections - before
+        download(server.url("/big.bin"), str(tmp_path / "b"), segments=4)
+        second = stats.connections - before - first
+
+    assert (tmp_path / "b").read_bytes() == DATA
+    # Four segments, one of them on the connection that probed the size
+    assert first <= 4
+    assert second == 0
+
+
+def test_redirects_stay_on_the_pool(real_io):
+    client = HttpClient(proxies={})
+    with FileServer({"/new": b"x"}, redirects={"/old": "/new"}) as server:
+        for _ in range(3):
+            with client.request("GET", server.url("/old")) as resp:
+                assert resp.read() == b"x"
+                assert resp.geturl() == server.url("/new")
+
+    assert client.stats.redirects == 3
+    assert client.stats.connections == 1
+
+
+def test_transient_errors_are_retried(real_io, monkeypatch: MonkeyPatch):
+    delays = []
+    monkeypatch.setattr("lib.httpclient.time.sleep", delays.append)
+    client = HttpClient(proxies={})
+    with FileServer({"/a": b"a"}, failures=[503, 502]) as server:
+        assert get(client, server.url("/a")) == b"a"
+        with pytest.raises(urllib.error.HTTPError) as e:
+            get(client, server.url("/missing"))
+
+    assert e.value.code == 404
+    assert client.stats.retries == 2
+    assert len(delays) == 2
+
+
+def test_stale_connection_is_replaced(real_io):
+    client = HttpClient(proxies={})
+    with FileServer({"/a": b"a"}) as server:
+        get(client, server.url("/a"))
+        # As if the server had timed the idle connection out
+        for idle in client._idle.values():
+            for conn, _ in idle:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+        assert get(client, server.url("/a"), retries=0) == b"a"
+
+    assert client.stats.connections == 2
+
+
+def test_warm_up_resolves_each_host_once(real_io):
+    client = HttpClient(proxies={})
+    with FileServer({"/a": b"a"}) as server:
+        url = server.url("/a").replace("127.0.0.1", "localhost")
+        client.warm_up([url, url, "git@github.com:x/y.git"])
+        assert get(client, url) == b"a"
+        assert get(client, url) == b"a"
+
+    assert client.stats.dns_lookups == 1
+
+
+def test_refused_connections_fail_fast(real_io, monkeypatch: MonkeyPatch):
+    monkeypatch.setattr("lib.httpclient.time.sleep", pytest.fail)
+    with pytest.raises(urllib.error.URLError):
+        HttpClient(proxies={}).request("GET", "http://127.0.0.1:9/")
+
+
+def test_backoff_is_jittered_and_capped():
+    delays = [backoff(attempt) for attempt in range(1, 10) for _ in range(20)]
+    assert all(0 < d <= 2.0 for d in delays)
+    assert len(set(delays)) > 100
@@ -0,0 +1,39 @@
+from lib.journal import BASH, DMG, Journal, entry_digest, file_digest
+
+
+def test_record_and_resume(tmp_path):
+    path = str(tmp_path / "journal.json")
+    Journal(path).record(BASH, "Install nvm", "abc")
+
+    journal = Journal(path, resume=True)
+
+    assert journal.should_skip(BASH, "Install nvm", "abc")
+    assert not journal.should_skip(BASH, "Install nvm", "changed")
+    assert not journal.should_skip(BASH, "Install uv", "abc")
+    assert not journal.should_skip(DMG, "Install nvm", "abc")
+
+
+def test_no_skip_without_resume(tmp_path):
+    path = str(tmp_path / "journal.json")
+    Journal(path).record(BASH, "a", "abc")
+
+    assert not Journal(path).should_skip(BASH, "a", "abc")
+
+
+def test_force_by_name_or_alias(tmp_path):
+    path = str(tmp_path / "journal.json")
+    Journal(path).record(BASH, "a", "abc")
+    Journal(path).record(DMG, "http://x/App.dmg", "def")
+
+    journal = Journal(path, resume=True, force=["a", "App.dmg"])
+
+    assert not journal.should_skip(BASH, "a", "abc")
+    assert not journal.should_skip(DMG, "http://x/App.dmg", "def", ["App.dmg"])
+
+
+def test_digests(tmp_path):
+    script = tmp_path / "s.sh"
+    script.write_text("echo hi\n")
+
+    assert file_digest(str(script)) != entry_digest("echo hi\n")
+    assert entry_digest({"a": 1, "b": 2}) == entry_digest({"b": 2, "a": 1})
@@ -0,0 +1,126 @@
+import pytest
+from lib.manifest import (
+    DmgEntry,
+    GitEntry,
+    Manifest,
+    parse_dmg_entries,
+    parse_git_entry,
+    validate_manifest,
+)
+from utils.errors import ManifestError
+
+SHA = "ab" * 32
+
+
+def test_bare_url_and_object():
+    entries = parse_dmg_entries(
+        ["http://x/a.dmg", {"url": "http://x/b.dmg", "sha256": SHA.upper()}]
+    )
+
+    assert entries == [DmgEntry("http://x/a.dmg"), DmgEntry("http://x/b.dmg", SHA)]
+    assert entries[1].name == "b.dmg"
+
+
+def test_priority_and_weight():
+    (entry,) = parse_dmg_entries(
+        [{"url": "http://x/a.dmg", "priority": 5, "weight": 2}]
+    )
+
+    assert (entry.priority, entry.weight) == (5, 2.0)
+    assert (DmgEntry("http://x/b.dmg").priority, DmgEntry("b").weight) == (0, 1.0)
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        42,
+        {"sha256": SHA},
+        {"url": "http://x/a.dmg", "sha256": "nope"},
+        {"url": "http://x/a.dmg", "priority": "high"},
+        {"url": "http://x/a.dmg", "weight": 0},
+    ],
+)
+def test_invalid_entries(raw):
+    with pytest.raises(ManifestError):
+        parse_dmg_entries([raw])
+
+
+def test_git_entry_defaults():
+    entry = parse_git_entry({"repo": "https://x/tpm.git", "dest": "~/.tmux/tpm"})
+
+    assert entry == GitEntry("https://x/tpm.git", "~/.tmux/tpm", name="Clone tpm")
+    assert entry.depth == 1
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        {"repo": "https://x/a.git"},
+        {"repo": "https://x/a.git", "dest": "a", "depth": -1},
+        {"repo": "https://x/a.git", "dest": "a", "ref": ""},
+        {"repo": "https://x/a.git", "dest": "a", "depends_on": "b"},
+    ],
+)
+def test_invalid_git_entries(raw):
+    with pytest.raises(ManifestError):
+        parse_git_entry(raw)
+
+
+def test_validate_checks_git_entries(tmp_path):
+    manifest = Manifest(
+        bash=[],
+        dmg=[],
+        git=[
+            GitEntry("https://x/a.git", "~/a", name="a", depends_on=("missing",)),
+            GitEntry("https://x/b.git", "~/a/", name="b"),
+        ],
+    )
+
+    problems = validate_manifest(manifest, str(tmp_path))
+    assert any("missing" in p for p in problems)
+    assert any("More than one checkout" in p for p in problems)
+
+
+def test_probes_and_dropping_entries(tmp_path):
+    import json
+
+    from lib.manifest import Probe, load_manifest
+
+    tasks = {
+        "bash": [
+            {"name": "brew", "script": "01.sh", "probe": {"path": "~/brew"}},
+            {"name": "nvm", "script": "02.sh"},
+            {"name": "pynvim", "script": "03.sh", "depends_on": ["brew", "nvm"]},
+        ],
+        "git": [{"name": "omz", "repo": "r", "dest": "d", "depends_on": ["brew"]}],
+        "dmg": ["http://x/a.dmg", {"url": "http://x/b.dmg", "probe": {"command": "x"}}],
+    }
+    (tmp_path / "tasks.json").write_text(json.dumps(tasks))
+    manifest = load_manifest(str(tmp_path / "tasks.json"))
+
+    assert manifest.probes == {
+        "brew": Probe(path="~/brew"),
+        "b.dmg": Probe(command="x"),
+    }
+    rest = manifest.without({"brew", "b.dmg"})
+    assert [t["name"] for t in rest.bash] == ["nvm", "pynvim"]
+    assert rest.bash[1]["depends_on"] == ["nvm"]
+    assert rest.git[0].depends_on == ()
+    assert [e.name for e in rest.dmg] == ["a.dmg"]
+    assert rest.probes == {}
+    # The loaded manifest itself is unchanged
+    assert manifest.bash[2]["depends_on"] == ["brew", "nvm"]
+
+
+@pytest.mark.parametrize(
+    "probe", ["~/x", {}, {"path": ""}, {"path": "a", "command": "b"}]
+)
+def test_invalid_probes(tmp_path, probe):
+    import json
+
+    from lib.manifest import load_manifest
+
+    tasks = {"bash": [{"name": "a", "script": "a.sh", "probe": probe}]}
+    (tmp_path / "tasks.json").write_text(json.dumps(tasks))
+    with pytest.raises(ManifestError):
+        load_manifest(str(tmp_path / "tasks.json"))
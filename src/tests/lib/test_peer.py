@@ -0,0 +1,151 @@
+import contextlib
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from lib.cache import ArtifactCache
+from lib.peer import CacheServer, PeerCache, _byte_range
+from tests.http_fixture import FileServer
+
+SRC = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DATA = os.urandom(2 * 1024 * 1024)
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+@contextlib.contextmanager
+def peer_process(tmp_path, urls):
+    """`main.py --serve-cache` in its own process, on a free port"""
+    tasks = tmp_path / "tasks.json"
+    tasks.write_text(json.dumps({"dmg": urls}))
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            "-u",
+            "main.py",
+            "--serve-cache",
+            "127.0.0.1:0",
+            "--cache-dir",
+            str(tmp_path / "peer"),
+            "--tasks",
+            str(tasks),
+        ],
+        cwd=SRC,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        assert proc.stdout is not None
+        line = proc.stdout.readline()
+        yield line.split(" on ")[1].split(",")[0]
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def upstream_downloads(server: FileServer) -> int:
+    # Every download starts with a one-byte probe of the size
+    return sum(1 for _, _, h in server.requests if h.get("Range") == "bytes=0-0")
+
+
+def test_clients_share_one_upstream_download(real_io, tmp_path):
+    with (
+        FileServer({"/Docker.dmg": DATA}, rate=8 * 1024**2) as upstream,
+        peer_process(tmp_path, [upstream.url("/Docker.dmg")]) as peer_url,
+    ):
+        peer = PeerCache(peer_url)
+        url = upstream.url("/Docker.dmg")
+        results = []
+
+        def client(name: str, sha256=None):
+            cache = ArtifactCache(root=str(tmp_path / name), peer=peer)
+            results.append(open(cache.fetch(url, sha256=sha256), "rb").read())
+
+        # Both ask while the peer is still downloading
+        threads = [threading.Thread(target=client, args=(n,)) for n in "ab"]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+        client("c", sha256=SHA256)
+
+    assert results == [DATA, DATA, DATA]
+    assert upstream_downloads(upstream) == 1
+    assert peer.reachable
+
+
+def test_falls_back_to_upstream(real_io, tmp_path):
+    peer = PeerCache("http://127.0.0.1:9")
+    cache = ArtifactCache(root=str(tmp_path / "cache"), peer=peer)
+    with FileServer({"/a.dmg": DATA}) as upstream:
+        path = cache.fetch(upstream.url("/a.dmg"))
+
+    assert open(path, "rb").read() == DATA
+    assert not peer.reachable
+
+
+def test_peer_serves_ranges_and_reports_upstream_failures(real_io, tmp_path):
+    cache = ArtifactCache(root=str(tmp_path / "peer"))
+    with (
+        FileServer({"/a.dmg": DATA}) as upstream,
+        CacheServer(cache, "127.0.0.1", 0).start() as server,
+    ):
+        fetch = PeerCache(server.url).url_for(upstream.url("/a.dmg"))
+        req = urllib.request.Request(fetch, headers={"Range": "bytes=10-19"})
+        with urllib.request.urlopen(req) as resp:
+            assert resp.status == 206
+            assert resp.geturl().startswith(f"{server.url}/objects/{SHA256}")
+            assert resp.read() == DATA[10:20]
+
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(PeerCache(server.url).url_for(upstream.url("/x")))
+        assert e.value.code == 502
+
+
+def test_byte_range():
+    assert _byte_range(None, 100) is None
+    assert _byte_range("bytes=0-0", 100) == (0, 0)
+    assert _byte_range("bytes=90-", 100) == (90, 99)
+    assert _byte_range("bytes=-10", 100) == (90, 99)
+    assert _byte_range("bytes=50-500", 100) == (50, 99)
+    with pytest.raises(ValueError):
+        _byte_range("bytes=100-", 100)
+
+
+def test_clients_wait_for_slow_peer_downloads(real_io, monkeypatch, tmp_path):
+    # The peer's download takes many polls, each shorter than a read timeout
+    monkeypatch.setattr("lib.peer.POLL_WAIT", 0.05)
+    cache = ArtifactCache(root=str(tmp_path / "peer"))
+    with (
+        FileServer({"/a.dmg": DATA}, rate=4 * 1024**2) as upstream,
+        CacheServer(cache, "127.0.0.1", 0).start() as server,
+    ):
+        peer = PeerCache(server.url)
+        client = ArtifactCache(root=str(tmp_path / "client"), peer=peer)
+        path = client.fetch(upstream.url("/a.dmg"))
+
+    assert open(path, "rb").read() == DATA
+    assert upstream_downloads(upstream) == 1
+    assert peer.reachable
+
+
+def test_peer_only_fetches_its_own_urls(real_io, tmp_path):
+    cache = ArtifactCache(root=str(tmp_path / "peer"))
+    with (
+        FileServer({"/a.dmg": DATA, "/b.dmg": DATA}) as upstream,
+        CacheServer(
+            cache, "127.0.0.1", 0, urls=[upstream.url("/a.dmg")]
+        ).start() as server,
+    ):
+        peer = PeerCache(server.url)
+        assert peer.resolve(upstream.url("/a.dmg")).startswith(f"{server.url}/objects/")
+        with pytest.raises(urllib.error.HTTPError) as e:
+            peer.resolve(upstream.url("/b.dmg"))
+
+    assert e.value.code == 403
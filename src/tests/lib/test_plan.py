@@ -0,0 +1,95 @@
+import pytest
+from pytest import MonkeyPatch
+from lib.dmg import DmgManagement
+from lib.manifest import DmgEntry
+from lib.plan import Plan, bash_key, dmg_key, load_approved
+from utils.errors import PlanError, UserCancelled
+
+TASKS = [
+    {"name": "a", "script": "a.sh"},
+    {"name": "quiet", "script": "q.sh", "show_dialog": False},
+]
+DMGS = [DmgEntry("http://x/App.dmg")]
+
+
+def test_build_covers_every_prompt():
+    plan = Plan.build(TASKS, DMGS)
+
+    assert len(plan.actions) == 2 + 6
+    assert plan.approved(bash_key("quiet"))
+    assert not plan.approved(bash_key("a"))
+    assert not plan.approved("unknown")
+
+
+def test_archives_have_no_mount_steps():
+    plan = Plan.build([], [DmgEntry("http://x/App.zip"), DmgEntry("http://x/B.tar.xz")])
+
+    steps = [a.key.rsplit(":", 1)[1] for a in plan.actions]
+    assert steps == ["download", "copy", "replace", "cleanup"] + [
+        "download",
+        "copy",
+        "replace",
+    ]
+
+
+def test_ask_all_at_once(monkeypatch: MonkeyPatch):
+    prompts = []
+    monkeypatch.setattr(
+        "lib.plan.confirm", lambda prompt=None: prompts.append(prompt) or True
+    )
+    plan = Plan.build(TASKS, DMGS)
+    plan.ask()
+
+    assert len(prompts) == 1
+    assert plan.pending() == []
+
+
+def test_ask_each(monkeypatch: MonkeyPatch):
+    answers = iter([False] + [True] * 6 + [False])
+    monkeypatch.setattr("lib.plan.confirm", lambda prompt=None: next(answers))
+    plan = Plan.build(TASKS, DMGS)
+    plan.ask()
+
+    assert plan.approved(bash_key("a"))
+    assert plan.approved(dmg_key(DMGS[0].url, "download"))
+    assert not plan.approved(dmg_key(DMGS[0].url, "cleanup"))
+
+
+def test_save_and_load(tmp_path):
+    plan = Plan.build(TASKS, DMGS)
+    plan.actions[0].approved = True
+    path = str(tmp_path / "plan.json")
+    plan.save(path)
+
+    loaded = load_approved(path, TASKS + [{"name": "new", "script": "n.sh"}], DMGS)
+
+    assert loaded.approved(bash_key("a"))
+    assert not loaded.approved(bash_key("new"))
+
+
+def test_dmg_uses_plan_without_prompting(monkeypatch: MonkeyPatch):
+    def no_prompt(prompt=None):
+        raise AssertionError("prompted")
+
+    monkeypatch.setattr("lib.dmg.confirm", no_prompt)
+    plan = Plan.build([], DMGS)
+    dmg = DmgManagement(DMGS[0].url, show_dialog=True, plan=plan)
+
+    with pytest.raises(UserCancelled):
+        dmg.download_dmg()
+
+    plan.actions[0].approved = True
+    dmg.download_dmg()
+
+
+@pytest.mark.parametrize(
+    "content",
+    [None, "{not json", '["a list"]', '{"actions": [{"key": "bash:a", "extra": 1}]}'],
+)
+def test_bad_plan_file(tmp_path, content):
+    path = tmp_path / "plan.json"
+    if content is not None:
+        path.write_text(content)
+
+    with pytest.raises(PlanError):
+        Plan.load(str(path))
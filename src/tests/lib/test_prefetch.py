@@ -0,0 +1,62 @@
+from concurrent.futures import Future
+
+from pytest import MonkeyPatch
+from lib.dmg import DmgManagement
+from lib.manifest import DmgEntry
+from lib.prefetch import DmgPrefetcher
+
+
+def test_prefetch_downloads_every_url(monkeypatch: MonkeyPatch):
+    fetched = []
+    monkeypatch.setattr("lib.dmg.os.system", lambda cmd: 0)
+    monkeypatch.setattr(
+        "lib.dmg.download", lambda url, dest, **kwargs: fetched.append(url)
+    )
+
+    urls = ["http://example.com/a.dmg", "http://example.com/b.dmg"]
+    prefetcher = DmgPrefetcher([DmgEntry(url) for url in urls], workers=2)
+    prefetcher.start()
+
+    results = [prefetcher.take(url).result() for url in urls]
+    prefetcher.shutdown()
+
+    assert sorted(fetched) == urls
+    assert results[0] == ("/tmp/dmgdl_test", "/tmp/dmgdl_test/a.dmg")
+
+
+def test_download_uses_prefetched_file(monkeypatch: MonkeyPatch):
+    def no_download(*a, **k):
+        raise AssertionError("should not download again")
+
+    monkeypatch.setattr("lib.dmg.download", no_download)
+
+    fut: Future = Future()
+    fut.set_result(("/tmp/pre", "/tmp/pre/app.dmg"))
+    dmg = DmgManagement("http://example.com/app.dmg", prefetched=fut)
+    dmg.download_dmg()
+
+    assert dmg.dmg_path == "/tmp/pre/app.dmg"
+
+
+def test_failed_prefetch_falls_back(monkeypatch: MonkeyPatch):
+    monkeypatch.setattr("lib.dmg.os.system", lambda cmd: 0)
+    fut: Future = Future()
+    fut.set_exception(OSError("connection reset"))
+    dmg = DmgManagement("http://example.com/app.dmg", prefetched=fut)
+    dmg.download_dmg()
+
+    assert dmg.dmg_path == "/tmp/dmgdl_test/app.dmg"
+
+
+def test_shutdown_removes_unclaimed(monkeypatch: MonkeyPatch):
+    removed = []
+    monkeypatch.setattr("lib.dmg.os.system", lambda cmd: 0)
+    monkeypatch.setattr(
+        "lib.prefetch.shutil.rmtree", lambda p, ignore_errors=False: removed.append(p)
+    )
+
+    prefetcher = DmgPrefetcher([DmgEntry("http://example.com/a.dmg")])
+    prefetcher.start()
+    prefetcher.shutdown()
+
+    assert removed == ["/tmp/dmgdl_test"]
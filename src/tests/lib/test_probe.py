@@ -0,0 +1,26 @@
+import time
+
+from lib.manifest import Probe
+from lib.probe import check, run_probes
+
+
+def test_path_probe(real_io, tmp_path):
+    assert check(Probe(path=str(tmp_path))) == (True, f"{tmp_path} exists")
+    assert check(Probe(path=str(tmp_path / "missing")))[0] is False
+
+
+def test_command_probe(real_io):
+    assert check(Probe(command="true")) == (True, "`true` succeeded")
+    assert check(Probe(command="exit 3")) == (False, "`exit 3` exited 3")
+    assert check(Probe(command="sleep 5"), timeout=0.1)[0] is False
+
+
+def test_probes_run_concurrently(real_io):
+    probes = {f"task {i}": Probe(command="sleep 0.3") for i in range(6)}
+
+    began = time.perf_counter()
+    results = run_probes(probes)
+
+    assert time.perf_counter() - began < 1.2
+    assert [r.name for r in results] == list(probes)
+    assert all(r.satisfied for r in results)
@@ -0,0 +1,75 @@
+import io
+
+from lib.tui.progress import Bar, ProgressRenderer, format_bytes, format_duration
+
+
+class TtyBuffer(io.StringIO):
+    def isatty(self):
+        return True
+
+
+def test_formatting():
+    assert format_bytes(512) == "512 B"
+    assert format_bytes(3 * 1024**2) == "3.0 MB"
+    assert format_duration(75) == "01:15"
+    assert format_duration(3725) == "1:02:05"
+    assert format_duration(None) == "--:--"
+
+
+def test_bar_render_with_rate_and_eta():
+    bar = Bar("Docker.dmg", total=100 * 1024**2)
+    bar.started = 0.0
+    bar.rate(0.0)
+    bar(50 * 1024**2, 100 * 1024**2)
+    line = bar.render(5.0)
+
+    assert "Docker.dmg" in line
+    assert " 50.0%" in line
+    assert "10.0 MB/s" in line
+    assert "ETA 00:05" in line
+
+
+def test_task_bar_without_total():
+    bar = Bar("Install nvm")
+    bar.started = 0.0
+
+    assert "running" in bar.render(3.0)
+
+
+def test_plain_output_when_not_a_tty():
+    out = io.StringIO()
+    renderer = ProgressRenderer(stream=out, fps=100, plain_interval=60)
+    bar = renderer.add("a.dmg", total=10)
+    for i in range(10_000):
+        bar(i % 11, 10)
+    renderer.finish(bar)
+    renderer.stop()
+
+    lines = out.getvalue().splitlines()
+    assert len(lines) == 1
+    assert "a.dmg" in lines[0] and "\033" not in lines[0]
+
+
+def test_tty_redraw_rate_is_bounded():
+    out = TtyBuffer()
+    renderer = ProgressRenderer(stream=out, fps=20)
+    bar = renderer.add("a.dmg", total=10**6)
+    for i in range(200_000):
+        bar(i, 10**6)
+    renderer.finish(bar)
+    renderer.stop()
+
+    # Far fewer frames than callbacks
+    assert out.getvalue().count("a.dmg") < 100
+
+
+def test_write_above_keeps_bars_last():
+    out = TtyBuffer()
+    renderer = ProgressRenderer(stream=out, fps=1)
+    bar = renderer.add("a.dmg", total=10)
+    renderer.write_above("hello\n")
+    text = out.getvalue()
+    renderer.finish(bar)
+    renderer.stop()
+
+    assert text.index("hello") < text.rindex("a.dmg")
@@ -0,0 +1,131 @@
+import threading
+import time
+
+import pytest
+from lib.scheduler import FAILED, OK, SKIPPED, Job, Scheduler
+from utils.errors import DependencyError
+
+
+def make_job(name, calls, result=True, depends_on=None, delay=0.0):
+    def run():
+        time.sleep(delay)
+        calls.append(name)
+        return result
+
+    return Job(name=name, run=run, depends_on=depends_on or [])
+
+
+def test_sequential_order_with_one_job():
+    calls = []
+    jobs = [make_job(n, calls) for n in ["a", "b", "c"]]
+
+    status = Scheduler(jobs=1).run(jobs)
+
+    assert calls == ["a", "b", "c"]
+    assert status == {"a": OK, "b": OK, "c": OK}
+
+
+def test_dependency_runs_first():
+    calls = []
+    jobs = [
+        make_job("b", calls, depends_on=["a"]),
+        make_job("a", calls, delay=0.05),
+    ]
+
+    Scheduler(jobs=2).run(jobs)
+
+    assert calls == ["a", "b"]
+
+
+def test_failure_skips_only_dependents():
+    calls = []
+    skipped = []
+    jobs = [
+        make_job("a", calls, result=False),
+        make_job("b", calls, depends_on=["a"]),
+        make_job("c", calls, depends_on=["b"]),
+        make_job("d", calls),
+    ]
+
+    status = Scheduler(jobs=2, on_skip=lambda j, b: skipped.append((j.name, b))).run(
+        jobs
+    )
+
+    assert status == {"a": FAILED, "b": SKIPPED, "c": SKIPPED, "d": OK}
+    assert skipped == [("b", "a"), ("c", "b")]
+    assert sorted(calls) == ["a", "d"]
+
+
+def test_exception_counts_as_failure(monkeypatch):
+    errors, lines = [], []
+    monkeypatch.setattr("lib.scheduler.console.error", errors.append)
+    monkeypatch.setattr(
+        "lib.scheduler.console.print", lambda line, **kw: lines.append(line)
+    )
+
+    def boom():
+        raise RuntimeError("boom")
+
+    status = Scheduler().run([Job(name="a", run=boom)])
+
+    assert status == {"a": FAILED}
+    assert errors == ["a crashed: RuntimeError('boom')"]
+    assert any("in boom" in line for line in lines)
+
+
+def test_independent_jobs_run_in_parallel():
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def run():
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.pop()
+        return True
+
+    jobs = [Job(name=str(i), run=run) for i in range(4)]
+    Scheduler(jobs=2).run(jobs)
+
+    assert max(peak) == 2
+
+
+def test_pool_has_its_own_slots():
+    lock = threading.Lock()
+    active = {"git": 0, None: 0}
+    peak = {"git": 0, None: 0}
+
+    def job(name, pool=None):
+        def run():
+            with lock:
+                active[pool] += 1
+                peak[pool] = max(peak[pool], active[pool])
+            time.sleep(0.05)
+            with lock:
+                active[pool] -= 1
+            return True
+
+        return Job(name=name, run=run, pool=pool)
+
+    jobs = [job(f"git{i}", "git") for i in range(3)] + [job("a"), job("b")]
+    status = Scheduler(jobs=1, pools={"git": 3}).run(jobs)
+
+    assert set(status.values()) == {OK}
+    assert peak == {"git": 3, None: 1}
+
+
+def test_unknown_dependency():
+    with pytest.raises(DependencyError):
+        Scheduler().run([Job(name="a", run=lambda: True, depends_on=["x"])])
+
+
+def test_cycle():
+    jobs = [
+        Job(name="a", run=lambda: True, depends_on=["b"]),
+        Job(name="b", run=lambda: True, depends_on=["a"]),
+    ]
+    with pytest.raises(DependencyError, match="cycle"):
+        Scheduler().run(jobs)
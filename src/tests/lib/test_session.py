@@ -0,0 +1,58 @@
+import pytest
+
+from lib.session import BashSession
+from lib.tasklog import TaskLog
+from utils.errors import TaskFailed
+
+
+@pytest.fixture
+def session(real_io):
+    with BashSession() as s:
+        yield s
+
+
+def _log(tmp_path, name="task"):
+    return TaskLog(str(tmp_path / f"{name}.log.gz"), echo=False)
+
+
+def test_exports_carry_over(session, tmp_path):
+    session.run("export FOO=bar; LOCAL=x; cd /")
+    log = _log(tmp_path)
+    session.run('echo "$FOO-${LOCAL:-unset}"; pwd', log)
+
+    assert log.tail()[0] == "bar-unset"
+    assert log.tail()[1] != "/"
+
+
+def test_output_is_split_per_task(session, tmp_path):
+    first, second = _log(tmp_path, "first"), _log(tmp_path, "second")
+    session.run("echo one; echo; printf 'two'", first)
+    session.run("echo three", second)
+
+    assert first.tail() == ["one", "", "two"]
+    assert second.tail() == ["three"]
+
+
+def test_failure_keeps_the_session(session, tmp_path):
+    with pytest.raises(TaskFailed) as e:
+        session.run("export FOO=bar; set -e; false; echo unreachable", _log(tmp_path))
+    assert e.value.returncode == 1
+    assert e.value.tail == []
+
+    with pytest.raises(TaskFailed) as e:
+        session.run("exit 4")
+    assert e.value.returncode == 4
+
+    log = _log(tmp_path, "after")
+    session.run('echo "$FOO"', log)
+    assert log.tail() == ["bar"]
+
+
+def test_dead_session_is_restarted(session, tmp_path):
+    session.run("export FOO=bar")
+    with pytest.raises(TaskFailed):
+        session.run("kill -9 $$")
+
+    log = _log(tmp_path)
+    session.run('echo "${FOO:-gone}"', log)
+    assert log.tail() == ["gone"]
@@ -0,0 +1,100 @@
+import hashlib
+import io
+import os
+import stat
+import tarfile
+
+import pytest
+
+from lib.manifest import TarballEntry
+from lib.tarball import TarballInstall
+from tests.http_fixture import FileServer
+from utils.errors import ChecksumError
+
+NVIM = b"#!/bin/sh\necho nvim\n"
+
+
+def make_tarball(mode: str = "w:gz", extra=()) -> bytes:
+    """Like a GitHub release: everything under one top-level directory"""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=mode) as tar:
+
+        def add(name, data=b"", **kw):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            for key, value in kw.items():
+                setattr(info, key, value)
+            tar.addfile(info, io.BytesIO(data))
+
+        add("nvim-macos/bin", type=tarfile.DIRTYPE, mode=0o755)
+        add("nvim-macos/bin/nvim", NVIM, mode=0o755)
+        add("nvim-macos/share/doc.txt", b"doc" * 1000, mode=0o644)
+        add("nvim-macos/bin/vi", type=tarfile.SYMTYPE, linkname="nvim")
+        # Hard links carry their target's mode, which is applied to it again
+        add(
+            "nvim-macos/bin/nvim2",
+            type=tarfile.LNKTYPE,
+            linkname="nvim-macos/bin/nvim",
+            mode=0o755,
+        )
+        for name, kw in extra:
+            add(name, **kw)
+    return buf.getvalue()
+
+
+def install(tmp_path, data: bytes, **kw):
+    with FileServer({"/nvim.tar.gz": data}) as server:
+        entry = TarballEntry(
+            url=server.url("/nvim.tar.gz"), dest=str(tmp_path / "nvim" / "v1"), **kw
+        )
+        return TarballInstall(entry).run(), entry
+
+
+def test_streams_into_place(real_io, tmp_path):
+    data = make_tarball()
+    seen = []
+    with FileServer({"/nvim.tar.gz": data}) as server:
+        entry = TarballEntry(
+            url=server.url("/nvim.tar.gz"),
+            dest=str(tmp_path / "nvim" / "v1"),
+            strip_components=1,
+            sha256=hashlib.sha256(data).hexdigest(),
+        )
+        stats = TarballInstall(entry).run(
+            progress=lambda done, total: seen.append(done)
+        )
+
+    dest = tmp_path / "nvim" / "v1"
+    assert (dest / "bin" / "nvim").read_bytes() == NVIM
+    assert os.stat(dest / "bin" / "nvim").st_mode & stat.S_IXUSR
+    assert os.readlink(dest / "bin" / "vi") == "nvim"
+    assert (dest / "bin" / "nvim2").read_bytes() == NVIM
+    assert stats.downloaded == len(data) == seen[-1]
+    assert stats.written == len(NVIM) + 3000
+    assert os.listdir(tmp_path / "nvim") == ["v1"]
+
+    # That version is installed, nothing to do
+    assert not TarballInstall(entry).run().installed
+
+
+def test_plain_tar_without_strip(real_io, tmp_path):
+    install(tmp_path, make_tarball("w"))
+
+    assert (tmp_path / "nvim" / "v1" / "nvim-macos" / "bin" / "nvim").exists()
+
+
+def test_checksum_mismatch_leaves_nothing(real_io, tmp_path):
+    with pytest.raises(ChecksumError):
+        install(tmp_path, make_tarball(), sha256="0" * 64)
+
+    assert os.listdir(tmp_path / "nvim") == []
+
+
+def test_refuses_paths_outside_dest(real_io, tmp_path):
+    evil = make_tarball(extra=[("nvim-macos/../../../evil.sh", {"mode": 0o755})])
+
+    with pytest.raises(tarfile.TarError):
+        install(tmp_path, evil, strip_components=1)
+
+    assert not (tmp_path / "evil.sh").exists()
+    assert os.listdir(tmp_path / "nvim") == []
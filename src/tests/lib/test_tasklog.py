@@ -0,0 +1,64 @@
+import gzip
+
+import pytest
+from lib import bash
+from lib.tasklog import LINE_LIMIT, TaskLog, log_file_name, run_log_dir
+from utils.errors import TaskFailed
+
+
+def read_log(path):
+    with gzip.open(path, "rt") as f:
+        return f.read().splitlines()
+
+
+def test_output_goes_to_log(tmp_path):
+    path = str(tmp_path / "t.log.gz")
+    with TaskLog(path, tail_lines=3, echo=False) as log:
+        bash.run("echo out; echo err >&2", show_log=False, show_dialog=False, log=log)
+
+    assert read_log(path) == ["out", "err"]
+
+
+def test_tail_is_bounded(tmp_path):
+    path = str(tmp_path / "t.log.gz")
+    with TaskLog(path, tail_lines=5, echo=False) as log:
+        bash.run("seq 1 50000", show_log=False, show_dialog=False, log=log)
+
+    assert log.lines == 50000
+    assert log.tail() == ["49996", "49997", "49998", "49999", "50000"]
+    assert len(read_log(path)) == 50000
+
+
+def test_failure_carries_tail(tmp_path):
+    path = str(tmp_path / "t.log.gz")
+    with TaskLog(path, tail_lines=2, echo=False) as log:
+        with pytest.raises(TaskFailed) as exc:
+            bash.run("seq 1 10; exit 3", show_log=False, show_dialog=False, log=log)
+
+    assert exc.value.returncode == 3
+    assert exc.value.tail == ["9", "10"]
+    assert exc.value.log_path == path
+
+
+def test_long_lines_are_split(tmp_path):
+    path = str(tmp_path / "t.log.gz")
+    cmd = f"yes x | head -n {LINE_LIMIT * 3} | tr -d '\\n'"
+    with TaskLog(path, echo=False) as log:
+        bash.run(cmd, show_log=False, show_dialog=False, log=log)
+
+    assert log.lines == 3
+    assert "".join(read_log(path)) == "x" * LINE_LIMIT * 3
+
+
+def test_echo_with_prefix(tmp_path, capsys):
+    with TaskLog(str(tmp_path / "t.log.gz"), prefix="[a] ") as log:
+        bash.run("echo hi", show_log=False, show_dialog=False, log=log)
+
+    assert "[a] hi" in capsys.readouterr().out
+
+
+def test_names(tmp_path, monkeypatch):
+    monkeypatch.setenv("MACBOOK_INIT_LOGS", str(tmp_path))
+
+    assert log_file_name("Install oh-my-zsh") == "install_oh_my_zsh.log.gz"
+    assert run_log_dir().startswith(str(tmp_path))
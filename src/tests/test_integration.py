@@ -3,7 +3,7 @@ def test_full_run(monkeypatch):
     shell_calls = []
 
     class FakeDMG:
-        def __init__(self, url, show_dialog):
+        def __init__(self, url, show_dialog, **kwargs):
             dmg_calls.append(url)
 
         def run(self):
@@ -17,8 +17,8 @@ def test_full_run(monkeypatch):
         shell_calls.append(cmd)
         return Result()
 
-    monkeypatch.setattr("main.DmgManagement", FakeDMG)
-    monkeypatch.setattr("main.bash.run", fake_exec)
+    monkeypatch.setattr("lib.dmg.DmgManagement", FakeDMG)
+    monkeypatch.setattr("lib.bash.run", fake_exec)
     monkeypatch.setattr("main.console.box", lambda *a, **k: None)
 
     import main
@@ -9,7 +9,7 @@ def test_dmg_install(monkeypatch):
         def run(self):
             pass
 
-    monkeypatch.setattr("main.DmgManagement", FakeDMG)
+    monkeypatch.setattr("lib.dmg.DmgManagement", FakeDMG)
     monkeypatch.setattr("main.console", lambda: None)
 
     m.run_dmg_tasks([])  # Should not crash
@@ -18,7 +18,7 @@ def test_dmg_install(monkeypatch):
 def test_shell_exec(monkeypatch):
     calls = []
 
-    def fake_shell(cmd, show_log=True, show_dialog=True):
+    def fake_shell(cmd, show_log=True, show_dialog=True, log=None, session=None):
         class Result:
             stderr = ""
             stdout = "ok"
@@ -26,9 +26,336 @@ def test_shell_exec(monkeypatch):
         calls.append(cmd)
         return Result()
 
-    monkeypatch.setattr("main.bash.run", fake_shell)
+    monkeypatch.setattr("lib.bash.run", fake_shell)
     monkeypatch.setattr("main.console.box", lambda title: None)
 
     m.run_bash_task("")
 
     assert len(calls) > 0
+
+
+def test_build_bash_jobs_implicit_order():
+    tasks = [
+        {"name": "a", "script": "a.sh"},
+        {"name": "b", "script": "b.sh"},
+        {"name": "c", "script": "c.sh", "depends_on": []},
+        {"name": "d", "script": "d.sh", "depends_on": ["a"]},
+    ]
+
+    jobs = m.build_bash_jobs(tasks)
+
+    assert [j.depends_on for j in jobs] == [[], ["a"], [], ["a"]]
+
+
+def test_run_bash_task_reports_failure(monkeypatch):
+    def fail(cmd, show_log=True, show_dialog=True, log=None, session=None):
+        raise RuntimeError("exit 1")
+
+    monkeypatch.setattr("lib.bash.run", fail)
+    monkeypatch.setattr("main.console.error", lambda *a: None)
+
+    assert m.run_bash_task("x.sh") is False
+
+
+def test_resume_skips_unchanged_script(monkeypatch, tmp_path):
+    from lib.journal import Journal
+
+    calls = []
+    script = tmp_path / "01_a.sh"
+    script.write_text("echo a\n")
+    monkeypatch.setattr("main.BASE_DIR", tmp_path)
+    monkeypatch.setattr("main.console.box", lambda *a, **k: None)
+    monkeypatch.setattr("lib.bash.run", lambda cmd, **kw: calls.append(cmd))
+    tasks = [{"name": "a", "script": "01_a.sh"}]
+    path = str(tmp_path / "journal.json")
+
+    m.build_bash_jobs(tasks, Journal(path))[0].run()
+    m.build_bash_jobs(tasks, Journal(path, resume=True))[0].run()
+    assert len(calls) == 1
+
+    script.write_text("echo changed\n")
+    m.build_bash_jobs(tasks, Journal(path, resume=True))[0].run()
+    assert len(calls) == 2
+
+    m.build_bash_jobs(tasks, Journal(path, resume=True, force=["a"]))[0].run()
+    assert len(calls) == 3
+
+
+def test_plan_then_approve_plan(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setattr("lib.bash.run", lambda cmd, **kw: calls.append(kw))
+    monkeypatch.setattr("main.run_dmg_tasks", lambda *a, **kw: None)
+    monkeypatch.setattr("lib.prefetch.DmgPrefetcher.start", lambda self: None)
+    plan_file = str(tmp_path / "plan.json")
+
+    m.main(["--plan", plan_file])
+    assert calls == []
+
+    def no_prompt(prompt=None):
+        raise AssertionError("prompted")
+
+    monkeypatch.setattr("lib.plan.confirm", no_prompt)
+    m.main(["--approve-plan", plan_file])
+
+    assert len(calls) > 0
+    assert all(kw["show_dialog"] is False for kw in calls)
+
+
+def test_events_and_trace(monkeypatch, tmp_path):
+    import json
+
+    from lib.events import read_events
+
+    monkeypatch.setattr("lib.bash._run_captured", lambda cmd, log: None)
+    monkeypatch.setattr("main.run_dmg_tasks", lambda *a, **kw: None)
+    monkeypatch.setattr("lib.prefetch.DmgPrefetcher.start", lambda self: None)
+    plan_file = str(tmp_path / "plan.json")
+    events_file = str(tmp_path / "events.jsonl")
+    trace_file = str(tmp_path / "trace.json")
+
+    m.main(["--plan", plan_file])
+    m.main(
+        ["--approve-plan", plan_file, "--events", events_file, "--trace", trace_file]
+    )
+
+    records = read_events(events_file)
+    names = [r["name"] for r in records]
+    assert names[-1] == "main"
+    assert "bash.run" in names
+
+    with open(trace_file) as f:
+        trace = json.load(f)["traceEvents"]
+    assert {e["name"] for e in trace if e["ph"] == "X"} == set(names)
+
+
+def _write_tasks(tmp_path, bash_tasks, dmg=()):
+    import json
+
+    for task in bash_tasks:
+        (tmp_path / task["script"]).write_text("true\n")
+    tasks_file = tmp_path / "tasks.json"
+    tasks_file.write_text(json.dumps({"bash": bash_tasks, "dmg": list(dmg)}))
+    return str(tasks_file)
+
+
+def test_dry_run_shows_stages_without_running(monkeypatch, tmp_path, capsys):
+    def no_run(*a, **kw):
+        raise AssertionError("ran something")
+
+    monkeypatch.setattr("lib.bash.run", no_run)
+    monkeypatch.setattr("lib.plan.confirm", no_run)
+    tasks = _write_tasks(
+        tmp_path,
+        [
+            {"name": "brew", "script": "01_brew.sh"},
+            {"name": "fonts", "script": "02_fonts.sh", "depends_on": ["brew"]},
+            {"name": "nvim", "script": "03_nvim.sh", "depends_on": ["brew"]},
+            {"name": "plugins", "script": "04_plugins.sh"},
+        ],
+        [{"url": "https://example.com/App.dmg"}],
+    )
+
+    assert m.main(["--tasks", tasks, "--dry-run"]) == 0
+
+    out = capsys.readouterr().out
+    assert "1. brew" in out
+    assert "2. fonts, nvim" in out
+    assert "3. plugins" in out
+    assert "App" in out
+
+
+def test_validate_reports_problems(tmp_path, capsys):
+    tasks = _write_tasks(
+        tmp_path,
+        [
+            {"name": "a", "script": "01_a.sh", "depends_on": ["missing"]},
+            {"name": "b", "script": "02_b.sh"},
+        ],
+    )
+    (tmp_path / "02_b.sh").unlink()
+
+    assert m.main(["--tasks", tasks, "--validate"]) == 1
+
+    out = capsys.readouterr().out
+    assert "02_b.sh" in out
+    assert "missing" in out
+
+
+def test_list_and_validate_valid_manifest(tmp_path, capsys):
+    tasks = _write_tasks(tmp_path, [{"name": "brew", "script": "01_brew.sh"}])
+
+    assert m.main(["--tasks", tasks, "--list"]) == 0
+    assert "brew: 01_brew.sh" in capsys.readouterr().out
+    assert m.main(["--tasks", tasks, "--validate"]) == 0
+
+
+def test_shared_env_tasks_run_in_the_session(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setattr("main.console.box", lambda *a, **k: None)
+    monkeypatch.setattr(
+        "lib.bash.run", lambda cmd, **kw: calls.append((cmd, kw["session"]))
+    )
+    tasks = [
+        {"name": "brew", "script": "01_brew.sh", "shared_env": True},
+        {"name": "other", "script": "02_other.sh"},
+    ]
+    session = object()
+
+    for job in m.build_bash_jobs(tasks, base_dir=tmp_path, session=session):
+        job.run()
+
+    assert calls == [
+        (f"source {tmp_path / '01_brew.sh'}", session),
+        (f"bash {tmp_path / '02_other.sh'}", None),
+    ]
+
+
+def test_git_jobs_need_approval(monkeypatch):
+    from lib.manifest import GitEntry
+    from lib.plan import Plan
+
+    ran = []
+    monkeypatch.setattr("lib.git.GitCheckout.run", lambda self: ran.append(self))
+    entry = GitEntry("https://x/tpm.git", "~/.tmux/tpm", name="tpm", depends_on=("a",))
+    plan = Plan.build([], [], [entry])
+
+    job = m.build_git_jobs([entry], plan)[0]
+    assert (job.name, job.depends_on, job.pool) == ("tpm", ["a"], m.FETCH_POOL)
+    assert job.run() is False
+
+    plan.actions[0].approved = True
+    assert job.run() is True
+    assert len(ran) == 1
+
+
+def test_from_bundle_runs_the_bundled_manifest(monkeypatch, tmp_path, real_io):
+    from lib.bundle import BundleWriter
+
+    calls = []
+    monkeypatch.setattr("main.console.box", lambda *a, **k: None)
+    monkeypatch.setattr("lib.bash.run", lambda cmd, **kw: calls.append(cmd))
+    monkeypatch.setattr(
+        "main.run_dmg_tasks", lambda entries, **kw: calls.append(kw["bundle"])
+    )
+    monkeypatch.setattr("lib.prefetch.DmgPrefetcher.start", lambda self: None)
+    # Nothing may be downloaded, so there is no artifact cache either
+    monkeypatch.setattr("lib.cache.ArtifactCache.__init__", None)
+    tasks = _write_tasks(
+        tmp_path, [{"name": "a", "script": "01_a.sh"}], dmg=["https://x/App.dmg"]
+    )
+    writer = BundleWriter(str(tmp_path / "test.bundle"))
+    writer.add_file("tasks.json", tasks)
+    writer.add_file("01_a.sh", str(tmp_path / "01_a.sh"))
+    writer.close()
+    (tmp_path / "01_a.sh").unlink()
+
+    m.main(["--from-bundle", str(tmp_path / "test.bundle")])
+
+    script, bundle = calls
+    assert script.startswith(f"bash {bundle.work_dir}") and script.endswith("01_a.sh")
+    assert m.main(["--from-bundle", str(tmp_path / "missing.bundle")]) == 1
+
+
+def test_satisfied_tasks_are_dropped_before_the_plan(monkeypatch, tmp_path, real_io):
+    import json
+
+    asked, ran = [], []
+    monkeypatch.setattr("main.console.box", lambda *a, **k: None)
+    monkeypatch.setattr("lib.bash.run", lambda cmd, **kw: ran.append(cmd))
+    (tmp_path / "01_brew.sh").write_text("true\n")
+    (tmp_path / "02_nvm.sh").write_text("true\n")
+    tasks = {
+        "bash": [
+            {"name": "brew", "script": "01_brew.sh", "probe": {"path": str(tmp_path)}},
+            {"name": "nvm", "script": "02_nvm.sh", "depends_on": ["brew"]},
+        ],
+        "dmg": [{"url": "https://x/App.dmg", "probe": {"path": str(tmp_path)}}],
+    }
+    (tmp_path / "tasks.json").write_text(json.dumps(tasks))
+
+    def approve_all(plan):
+        for action in plan.actions:
+            asked.append(action.key)
+            action.approved = True
+
+    monkeypatch.setattr("lib.plan.Plan.ask", approve_all)
+
+    m.main(["--tasks", str(tmp_path / "tasks.json")])
+
+    assert asked == ["bash:nvm"]
+    assert ran == [f"bash {tmp_path / '02_nvm.sh'}"]
+
+    ran.clear()
+    m.main(["--tasks", str(tmp_path / "tasks.json"), "--force", "brew"])
+    assert len(ran) == 2
+
+
+def test_failed_dmg_does_not_stop_the_rest(monkeypatch):
+    import subprocess
+    import urllib.error
+
+    from lib.manifest import DmgEntry
+    from utils.errors import DownloadError
+
+    failures = {
+        "http://example.com/a.dmg": DownloadError("gave up after 3 attempts"),
+        "http://example.com/b.dmg": urllib.error.URLError("connection refused"),
+        "http://example.com/c.dmg": subprocess.CalledProcessError(1, "hdiutil"),
+    }
+    installed = []
+
+    def run(self):
+        if self.url in failures:
+            raise failures[self.url]
+        installed.append(self.url)
+
+    monkeypatch.setattr("lib.dmg.DmgManagement.run", run)
+    monkeypatch.setattr("main.console.error", lambda *a: None)
+
+    urls = [*failures, "http://example.com/d.dmg"]
+    m.run_dmg_tasks([DmgEntry(url) for url in urls])
+
+    assert installed == ["http://example.com/d.dmg"]
+
+
+def test_plan_includes_satisfied_tasks(monkeypatch, tmp_path, real_io):
+    import json
+
+    from lib.plan import Plan
+
+    (tmp_path / "01_brew.sh").write_text("true\n")
+    tasks = {
+        "bash": [
+            {"name": "brew", "script": "01_brew.sh", "probe": {"path": str(tmp_path)}}
+        ],
+        "dmg": [{"url": "https://x/App.dmg", "probe": {"path": str(tmp_path)}}],
+    }
+    (tmp_path / "tasks.json").write_text(json.dumps(tasks))
+    monkeypatch.setattr("lib.plan.Plan.ask", lambda plan: None)
+    plan_file = str(tmp_path / "plan.json")
+
+    m.main(["--tasks", str(tmp_path / "tasks.json"), "--plan", plan_file])
+
+    keys = [action.key for action in Plan.load(plan_file).actions]
+    assert "bash:brew" in keys
+    assert any(key.startswith("dmg:") for key in keys)
+
+
+def test_missing_plan_file_is_reported(monkeypatch, tmp_path):
+    errors = []
+    monkeypatch.setattr("main.console.error", lambda e: errors.append(str(e)))
+
+    assert m.main(["--approve-plan", str(tmp_path / "missing.json")]) == 1
+    assert "missing.json" in errors[0]
+
+
+def test_dependency_errors_are_reported(monkeypatch, tmp_path):
+    errors = []
+    monkeypatch.setattr("main.console.error", lambda e: errors.append(str(e)))
+    monkeypatch.setattr("lib.plan.Plan.ask", lambda plan: None)
+    tasks = _write_tasks(
+        tmp_path, [{"name": "a", "script": "01_a.sh", "depends_on": ["missing"]}]
+    )
+
+    assert m.main(["--tasks", tasks, "--no-probe"]) == 1
+    assert "missing" in errors[0]
@@ -0,0 +1,71 @@
+"""
+Startup budget: inspecting the manifest must not load the modules that
+download, mount or run anything. Measured in a fresh interpreter with
+-X importtime, so modules other tests imported don't hide a regression.
+"""
+
+import os
+import sys
+
+from tests.conftest import _REAL_IO
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = (
+    "lib.bash",
+    "lib.dmg",
+    "lib.download",
+    "lib.prefetch",
+    "concurrent.futures",
+    "gzip",
+    "hashlib",
+    "mmap",
+    "shutil",
+    "subprocess",
+    "tempfile",
+    "urllib.request",
+    "ssl",
+    "termios",
+)
+# Generous: about 70ms on a laptop, most of it argparse, typing and dataclasses
+BUDGET_US = 400_000
+
+
+def _import_times(code: str):
+    run = _REAL_IO["subprocess.run"]
+    result = run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=SRC,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "cumulative" not in line:
+            _, cumulative, name = line[len("import time:") :].split("|")
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def _heavy(code: str, baseline: str):
+    """HEAVY modules code imports that baseline doesn't already"""
+    times = _import_times(code)
+    before = _import_times(baseline)
+    return [name for name in HEAVY if name in times and name not in before], times
+
+
+def test_import_skips_heavy_imports(real_io):
+    loaded, times = _heavy("import main", "pass")
+
+    assert loaded == []
+    assert times["main"] < BUDGET_US
+
+
+def test_validate_skips_heavy_imports(real_io):
+    # argparse imports shutil itself, for the terminal width of --help
+    loaded, _ = _heavy(
+        "import main; main.main(['--validate'])",
+        "import argparse; argparse.ArgumentParser()",
+    )
+
+    assert loaded == []
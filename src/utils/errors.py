@@ -2,3 +2,68 @@ class UserCancelled(Exception):
     """Raised when the user cancels a step."""
 
     pass
+
+
+class DependencyError(Exception):
+    """Raised when task dependencies are unknown or form a cycle."""
+
+    pass
+
+
+class DownloadError(Exception):
+    """Raised when a download cannot be completed."""
+
+    pass
+
+
+class ChecksumError(DownloadError):
+    """Raised when downloaded content does not match its expected SHA-256."""
+
+    pass
+
+
+class InsufficientSpace(Exception):
+    """Raised when there is not enough free disk space to start a step."""
+
+    pass
+
+
+class ManifestError(Exception):
+    """Raised when tasks.json is malformed."""
+
+    pass
+
+
+class TaskFailed(Exception):
+    """Raised when a captured shell task exits non-zero."""
+
+    def __init__(self, cmd, returncode: int, tail=None, log_path=None):
+        super().__init__(f"Command '{cmd}' returned non-zero exit status {returncode}")
+        self.cmd = cmd
+        self.returncode = returncode
+        self.tail = tail or []
+        self.log_path = log_path
+
+
+class GitError(Exception):
+    """Raised when a git checkout can't be created where tasks.json says."""
+
+    pass
+
+
+class BundleError(Exception):
+    """Raised when an offline bundle is unreadable or lacks an artifact."""
+
+    pass
+
+
+class PlanError(Exception):
+    """Raised when a saved plan file is unreadable or malformed."""
+
+    pass
+
+
+class ArchiveError(Exception):
+    """Raised when an app archive holds no app or unsafe paths."""
+
+    pass